@@ -47,18 +47,25 @@ limitations under the License.
 # from jose import jwt
 # from jose import jwk
 
+import hashlib
 import json
 import os
 import re
+import time
 from typing import Dict
 
 import jwcrypto
 import jwcrypto.jwk
 import jwcrypto.jwt
-import requests
 from dataclasses import dataclass
 
+from example_app.cache import create_cache
+from example_app.deadline import deadline_context
+from example_app.http_client import HTTP_CLIENT
+from example_app.leak_detector import detect_leaks
 from example_app.logger import get_logger
+from example_app.logger import logging_context
+from example_app.resilience import resilient
 
 LOGGER = get_logger(__name__)
 
@@ -69,6 +76,15 @@ API_ADMIN_EMAILS = [
 COGNITO_REGION = os.getenv("API_COGNITO_REGION", "us-west-2")
 COGNITO_CLIENT_ID = os.getenv("API_COGNITO_CLIENT_ID")
 COGNITO_POOL_ID = os.getenv("API_COGNITO_POOL_ID")
+JWKS_TTL = float(os.getenv("API_JWKS_TTL", "3600"))
+JWKS_TIMEOUT = float(os.getenv("API_JWKS_TIMEOUT", "5"))
+JWKS_HEDGE_DELAY = float(os.getenv("API_JWKS_HEDGE_DELAY", "0"))
+CLAIMS_TTL = float(os.getenv("API_CLAIMS_TTL", "300"))
+CLAIMS_CACHE_SIZE = int(os.getenv("API_CLAIMS_CACHE_SIZE", "1024"))
+
+#: the JWKS and the verified claims of tokens, which can be shared by
+#: server workers (see example_app.cache.create_cache)
+AUTH_CACHE = create_cache("auth", max_size=CLAIMS_CACHE_SIZE, ttl=CLAIMS_TTL)
 
 
 @dataclass
@@ -77,6 +93,24 @@ class AuthError(Exception):
     status_code: int
 
 
+@resilient("jwks", hedge_delay=JWKS_HEDGE_DELAY)
+def fetch_jwks(jwks_uri: str) -> Dict:
+    """
+    Get a JWKS, with retries and a circuit breaker for the JWKS endpoint
+
+    :param jwks_uri: the URI of the JWKS
+    :returns: the JWKS, parsed by jwcrypto
+    """
+    LOGGER.debug(jwks_uri)
+    # a pooled connection, and the response cache when it is configured
+    response = HTTP_CLIENT.get(jwks_uri, timeout=JWKS_TIMEOUT, cache=True)
+    LOGGER.debug(response)
+    response.raise_for_status()
+    # use jwcrypto to parse the JWKS (it takes a json string)
+    jwks = jwcrypto.jwk.JWKSet.from_json(response.text)
+    return json.loads(jwks.export())
+
+
 @dataclass
 class CognitoPool:
     id: str
@@ -93,13 +127,10 @@ class CognitoPool:
     @property
     def jwks(self) -> Dict:
         if self._jwks is None:
-            LOGGER.debug(self.jwks_uri)
-            response = requests.get(self.jwks_uri)
-            LOGGER.debug(response)
-            response.raise_for_status()
-            # use jwcrypto to parse the JWKS (it takes a json string)
-            jwks = jwcrypto.jwk.JWKSet.from_json(response.text)
-            self._jwks = json.loads(jwks.export())
+            self._jwks = AUTH_CACHE.get(self.jwks_uri)
+        if self._jwks is None:
+            self._jwks = fetch_jwks(self.jwks_uri)
+            AUTH_CACHE.put(self.jwks_uri, self._jwks, ttl=JWKS_TTL)
             LOGGER.debug(self._jwks)
         return self._jwks
 
@@ -151,18 +182,31 @@ class CognitoPool:
         raise AuthError("Unauthorized - JWT-kid has no matching public-kid", 401)
 
     def jwt_claims(self, jwt_token: str):
+        # the claims of a verified token are cached until it expires; the
+        # key is a digest, so the cache does not hold the tokens
+        digest = hashlib.sha256(jwt_token.encode("utf-8")).hexdigest()
+        cache_key = (self.jwks_uri, digest)
+        claims = AUTH_CACHE.get(cache_key)
+        if claims is not None and claims.get("exp", 0) > time.time():
+            return claims
+
         try:
             public_key = self.jwt_public_key(jwt_token)
             public_jwk = jwcrypto.jwk.JWK(**public_key)
             verified_token = jwcrypto.jwt.JWT(
                 key=public_jwk, jwt=jwt_token, algs=[public_key["alg"]]
             )
-            return json.loads(verified_token.claims)
+            claims = json.loads(verified_token.claims)
 
         except Exception as err:
             LOGGER.error(err)
             raise AuthError("Unauthorized - token failed to verify", 401)
 
+        ttl = min(CLAIMS_TTL, claims.get("exp", 0) - time.time())
+        if ttl > 0:
+            AUTH_CACHE.put(cache_key, claims, ttl=ttl)
+        return claims
+
 
 COGNITO_POOL = CognitoPool(
     region=COGNITO_REGION, client_id=COGNITO_CLIENT_ID, id=COGNITO_POOL_ID
@@ -203,6 +247,9 @@ class APIGateway:
         return policy
 
 
+@detect_leaks
+@logging_context
+@deadline_context
 def aws_auth_handler(event, context):
     """AWS Authorizer for JWT tokens provided by AWS Cognito
 
@@ -0,0 +1,162 @@
+"""
+AWS Clients
+-----------
+
+A process-wide registry of boto3 clients.  Creating a boto3 client takes
+tens of milliseconds and a few MB of memory, so the registry creates one
+client for each (service, region, config) on first use and then reuses it,
+e.g. across warm Lambda invocations.  Clients are thread-safe, but the
+boto3 default session is not, so the registry creates clients from its own
+session while it holds a lock.
+
+.. code-block::
+
+    from example_app.aws_clients import boto_client
+
+    s3_client = boto_client("s3")
+    secrets_client = boto_client("secretsmanager", region_name="us-east-1")
+
+The default botocore config is set by env-vars:
+
+- ``APP_BOTO_MAX_POOL_CONNECTIONS`` - the connection pool size (default 10)
+- ``APP_BOTO_MAX_ATTEMPTS`` - the maximum retry attempts (default 3)
+- ``APP_BOTO_RETRY_MODE`` - the retry mode (default "standard")
+- ``APP_BOTO_CONNECT_TIMEOUT`` - the connect timeout seconds (default 5)
+- ``APP_BOTO_READ_TIMEOUT`` - the read timeout seconds (default 60)
+
+The clients fail fast with :class:`example_app.deadline.DeadlineExceeded`
+when the request deadline has passed, before each attempt of a call, so
+the retries of a slow service do not run past the end of an invocation.
+
+.. seealso::
+    - https://boto3.amazonaws.com/v1/documentation/api/latest/guide/session.html#multithreading-or-multiprocessing-with-sessions
+    - https://botocore.amazonaws.com/v1/documentation/api/latest/reference/config.html
+"""
+
+import copy
+import os
+import threading
+from collections import Counter
+from typing import Dict
+from typing import Tuple
+
+import boto3
+from botocore.client import BaseClient
+from botocore.config import Config
+
+from .deadline import check_deadline
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+BOTO_MAX_POOL_CONNECTIONS = int(os.getenv("APP_BOTO_MAX_POOL_CONNECTIONS", "10"))
+BOTO_MAX_ATTEMPTS = int(os.getenv("APP_BOTO_MAX_ATTEMPTS", "3"))
+BOTO_RETRY_MODE = os.getenv("APP_BOTO_RETRY_MODE", "standard")
+BOTO_CONNECT_TIMEOUT = float(os.getenv("APP_BOTO_CONNECT_TIMEOUT", "5"))
+BOTO_READ_TIMEOUT = float(os.getenv("APP_BOTO_READ_TIMEOUT", "60"))
+
+
+def boto_config(
+    max_pool_connections: int = BOTO_MAX_POOL_CONNECTIONS,
+    max_attempts: int = BOTO_MAX_ATTEMPTS,
+    retry_mode: str = BOTO_RETRY_MODE,
+    connect_timeout: float = BOTO_CONNECT_TIMEOUT,
+    read_timeout: float = BOTO_READ_TIMEOUT,
+) -> Config:
+    """
+    A botocore config, with defaults from the env-vars
+
+    :param max_pool_connections: the connection pool size
+    :param max_attempts: the maximum retry attempts
+    :param retry_mode: the retry mode, i.e. "legacy", "standard" or "adaptive"
+    :param connect_timeout: the connect timeout seconds
+    :param read_timeout: the read timeout seconds
+    """
+    return Config(
+        max_pool_connections=max_pool_connections,
+        retries={"max_attempts": max_attempts, "mode": retry_mode},
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+    )
+
+
+def config_key(config: Config) -> Tuple:
+    """A hashable key for the options of a botocore config"""
+    options = getattr(config, "_user_provided_options", {})
+    return tuple(sorted((k, repr(v)) for k, v in options.items()))
+
+
+class BotoClientRegistry:
+    """
+    A thread-safe registry of boto3 clients
+
+    :param config: the default botocore config for clients
+    """
+
+    def __init__(self, config: Config = None):
+        self.config = config or boto_config()
+        self._config_key = config_key(self.config)
+        self.created = Counter()  # the number of clients created by service
+        self._session = None
+        self._clients: Dict[Tuple, BaseClient] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> boto3.session.Session:
+        if self._session is None:
+            self._session = boto3.session.Session()
+        return self._session
+
+    def client(
+        self, service_name: str, region_name: str = None, config: Config = None
+    ) -> BaseClient:
+        """
+        Get or create a client
+
+        :param service_name: an AWS service name, e.g. "s3"
+        :param region_name: an AWS region; the default is the
+            AWS_DEFAULT_REGION or "us-west-2"
+        :param config: an optional botocore config, which is merged
+            with the default config of the registry
+        """
+        region = region_name or os.getenv("AWS_DEFAULT_REGION", "us-west-2")
+        if config is not None:
+            config = self.config.merge(config)
+            key = (service_name, region, config_key(config))
+        else:
+            config = self.config
+            key = (service_name, region, self._config_key)
+
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    # botocore modifies the retries options of a config
+                    client = self.session.client(
+                        service_name=service_name,
+                        region_name=region,
+                        config=copy.deepcopy(config),
+                    )
+                    client.meta.events.register("before-send", check_deadline)
+                    self._clients[key] = client
+                    self.created[service_name] += 1
+                    LOGGER.debug("Created boto3 client: %s, %s", service_name, region)
+        return client
+
+    def clear(self):
+        """Remove all clients and the session, e.g. after a fork"""
+        with self._lock:
+            self._clients.clear()
+            self._session = None
+            self.created.clear()
+
+
+BOTO_CLIENTS = BotoClientRegistry()
+
+
+def boto_client(
+    service_name: str, region_name: str = None, config: Config = None
+) -> BaseClient:
+    """Get or create a client from the BOTO_CLIENTS registry"""
+    return BOTO_CLIENTS.client(service_name, region_name=region_name, config=config)
@@ -1,42 +1,169 @@
+"""
+AWS S3 Events
+-------------
+
+Parse S3 event notifications into :class:`S3Object` items.
+
+.. code-block::
+
+    # a list of all the S3 objects in an S3 event
+    s3_objects = parse_s3_event(event)
+
+    # stream S3 objects from S3 events, including S3 events that are
+    # delivered in SQS messages or SNS notifications
+    for s3_object in iter_s3_objects(event):
+        process(s3_object)
+
+S3 object keys are URL-encoded in S3 events, e.g. a space is a '+'; the
+keys are decoded in the :class:`S3Object`.  S3 can deliver a notification
+more than once, so :func:`iter_s3_objects` skips duplicate notifications
+for the same (bucket, key, versionId or sequencer), using a bounded set of
+recent notifications.
+
+.. seealso::
+    - https://docs.aws.amazon.com/AmazonS3/latest/dev/notification-content-structure.html
+    - https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html
+    - https://docs.aws.amazon.com/lambda/latest/dg/with-sns.html
+"""
+
+import json
+from collections import OrderedDict
 from typing import Dict
+from typing import Hashable
+from typing import Iterator
 from typing import List
 from typing import NamedTuple
 from typing import Optional
+from urllib.parse import unquote_plus
 
 from .logger import get_logger
 
 LOGGER = get_logger(__name__)
 
+S3_EVENT_DEDUP_SIZE = 10000
+
 
 class S3Object(NamedTuple):
     """
     :param s3_bucket: Source s3 bucket for file
     :param s3_key: Source s3 key for s3 file_path
     :param s3_region: Source s3 region for file
+    :param version_id: Source s3 object version, if the bucket is versioned
+    :param sequencer: Source s3 event sequencer, to order events for a key
     """
 
     bucket: str
     key: str
     region: str = None
+    version_id: str = None
+    sequencer: str = None
 
     @property
     def uri(self) -> str:
         return f"s3://{self.bucket}/{self.key}"
 
+    @property
+    def dedup_key(self) -> Hashable:
+        return self.bucket, self.key, self.version_id or self.sequencer
+
+
+class RecentKeys:
+    """
+    A bounded set of recent keys; the oldest keys are discarded
+
+    :param max_size: the maximum number of keys
+    """
+
+    def __init__(self, max_size: int = S3_EVENT_DEDUP_SIZE):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: Hashable) -> bool:
+        """
+        :returns: False if the key is a recent key, True if it is added
+        """
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+        return True
+
 
 def parse_s3_record(s3_record: Dict) -> Optional[S3Object]:
     s3_data = s3_record.get("s3")
+    s3_object = s3_data.get("object")
     return S3Object(
         bucket=s3_data.get("bucket").get("name"),
-        key=s3_data.get("object").get("key"),
+        key=unquote_plus(s3_object.get("key")),
         region=s3_record.get("awsRegion"),
+        version_id=s3_object.get("versionId"),
+        sequencer=s3_object.get("sequencer"),
     )
 
 
+def unwrap_message(message: Dict) -> Dict:
+    """
+    Unwrap an SNS notification that is delivered in an SQS message body
+    """
+    if message.get("Type") == "Notification" and "Message" in message:
+        return json.loads(message["Message"])
+    return message
+
+
+def iter_s3_records(event: Dict) -> Iterator[Dict]:
+    """
+    Stream the S3 records in an S3 event, an SQS event or an SNS event
+
+    Records that are not S3 event records are skipped, e.g. the
+    's3:TestEvent' that S3 sends when notifications are configured.
+
+    :param event: a Lambda event
+    :returns: an iterator of S3 event records
+    """
+    for record in event.get("Records") or []:
+        if "s3" in record:
+            yield record
+        elif record.get("eventSource") == "aws:sqs":
+            message = unwrap_message(json.loads(record["body"]))
+            yield from iter_s3_records(message)
+        elif record.get("EventSource") == "aws:sns":
+            message = json.loads(record["Sns"]["Message"])
+            yield from iter_s3_records(message)
+        else:
+            LOGGER.warning("Skipped a record that is not an S3 event record")
+
+
+def iter_s3_objects(
+    event: Dict, dedup: bool = True, recent_keys: RecentKeys = None
+) -> Iterator[S3Object]:
+    """
+    Stream the S3 objects in an S3 event, an SQS event or an SNS event
+
+    :param event: a Lambda event
+    :param dedup: skip duplicate notifications for an S3 object
+    :param recent_keys: the recent notifications to skip; pass the
+        same RecentKeys to skip duplicates across several events
+    :returns: an iterator of S3Object
+    """
+    if dedup and recent_keys is None:
+        recent_keys = RecentKeys()
+    for s3_record in iter_s3_records(event):
+        s3_object = parse_s3_record(s3_record)
+        if dedup and not recent_keys.add(s3_object.dedup_key):
+            LOGGER.info("Skipped a duplicate notification for %s", s3_object.uri)
+            continue
+        yield s3_object
+
+
 def parse_s3_event(s3_event: Dict) -> List[S3Object]:
     s3_records = s3_event.get("Records")
     if s3_records is None:
         msg = "Missing s3_event['Records']"
         LOGGER.error(msg)
         raise ValueError(msg)
-    return [parse_s3_record(s3) for s3 in s3_records]
+    return list(iter_s3_objects(s3_event, dedup=False))
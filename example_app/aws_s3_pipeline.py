@@ -0,0 +1,153 @@
+"""
+AWS S3 Processing Pipeline
+--------------------------
+
+Fetch and process S3 objects concurrently, e.g. the S3 objects in an S3 event.
+
+.. code-block::
+
+    def count_lines(s3_object: S3Object, body: Iterator[bytes]) -> int:
+        return sum(chunk.count(b"\\n") for chunk in body)
+
+    for s3_result in process_s3_objects(iter_s3_objects(event), count_lines):
+        if s3_result.ok:
+            LOGGER.info("%s has %d lines", s3_result.s3_object.uri, s3_result.result)
+        else:
+            LOGGER.error("%s failed: %s", s3_result.s3_object.uri, s3_result.error)
+
+The objects are processed by a bounded thread pool.  Each object body is
+streamed to the processing function in chunks, so an object is never held
+in memory unless the function does that.  No more than ``max_pending``
+objects are taken from the input iterator before their results are
+consumed, which applies backpressure to both the input and the output.
+Results are yielded in the order that they complete.
+
+The pool size is set by ``APP_S3_PIPELINE_WORKERS`` (default 8); the boto3
+S3 client should have a connection pool at least as large, see
+:mod:`example_app.aws_clients`.
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import NamedTuple
+from typing import Set
+
+from botocore.client import BaseClient
+
+from .aws_clients import boto_client
+from .aws_s3_event import S3Object
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+S3_PIPELINE_WORKERS = int(os.getenv("APP_S3_PIPELINE_WORKERS", "8"))
+S3_CHUNK_SIZE = 1024 * 1024
+
+
+class S3Result(NamedTuple):
+    """
+    :param s3_object: the S3 object that was processed
+    :param result: the result of the processing function
+    :param error: an error from fetching or processing the object
+    """
+
+    s3_object: S3Object
+    result: Any = None
+    error: Exception = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def s3_object_client(s3_object: S3Object) -> BaseClient:
+    """A registry S3 client for the region of an S3 object"""
+    return boto_client("s3", region_name=s3_object.region)
+
+
+def iter_s3_body(
+    s3_object: S3Object, client: BaseClient = None, chunk_size: int = S3_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Stream the body of an S3 object in chunks
+
+    :param s3_object: an S3 object
+    :param client: an optional S3 client
+    :param chunk_size: the maximum bytes in each chunk
+    :returns: an iterator of the body chunks
+    """
+    if client is None:
+        client = s3_object_client(s3_object)
+    params = {"Bucket": s3_object.bucket, "Key": s3_object.key}
+    if s3_object.version_id:
+        params["VersionId"] = s3_object.version_id
+    response = client.get_object(**params)
+    body = response["Body"]
+    try:
+        for chunk in iter(lambda: body.read(chunk_size), b""):
+            yield chunk
+    finally:
+        body.close()
+
+
+def process_s3_objects(
+    s3_objects: Iterable[S3Object],
+    func: Callable[[S3Object, Iterator[bytes]], Any],
+    client: BaseClient = None,
+    max_workers: int = S3_PIPELINE_WORKERS,
+    max_pending: int = None,
+    chunk_size: int = S3_CHUNK_SIZE,
+) -> Iterator[S3Result]:
+    """
+    Process S3 objects concurrently
+
+    :param s3_objects: an iterable of S3 objects
+    :param func: a function to process an S3 object; it is called with the
+        S3Object and an iterator of the object body chunks
+    :param client: an optional S3 client; the default is a registry
+        client for the region of each S3 object
+    :param max_workers: the maximum number of concurrent objects
+    :param max_pending: the maximum number of objects that are in progress
+        or have results waiting to be consumed (default is 2 * max_workers)
+    :param chunk_size: the maximum bytes in each body chunk
+    :returns: an iterator of S3Result, in the order that they complete
+    """
+    max_pending = max_pending or 2 * max_workers
+
+    def process(s3_object: S3Object) -> S3Result:
+        try:
+            body = iter_s3_body(s3_object, client=client, chunk_size=chunk_size)
+            try:
+                return S3Result(s3_object, result=func(s3_object, body))
+            finally:
+                body.close()
+        except Exception as err:
+            LOGGER.error("Failed to process %s: %s", s3_object.uri, err)
+            return S3Result(s3_object, error=err)
+
+    executor = ThreadPoolExecutor(max_workers, thread_name_prefix="s3-pipeline")
+    pending: Set[Future] = set()
+    try:
+        for s3_object in s3_objects:
+            while len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(process, s3_object))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        # when the consumer stops early, do not start the remaining objects
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
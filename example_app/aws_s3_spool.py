@@ -0,0 +1,207 @@
+"""
+AWS S3 Spool Reader
+-------------------
+
+Read large S3 objects with ranged GETs in parallel parts and spool them to
+a local file, e.g. in the Lambda ``/tmp`` storage.  The spooled object is
+available as a file or as a read-only memory-map, so parsers can read it
+without copies and without holding the whole object in memory.
+
+.. code-block::
+
+    with spool_s3_object(s3_object) as spooled:
+        header = spooled.mmap()[:100]
+        reader = csv.reader(io.TextIOWrapper(spooled.file))
+
+Each part is streamed to its offset in the spool file in small chunks, so
+the memory used for an object depends on the number of workers and the
+chunk size, not on the object size.  The spool files share a disk budget
+(``APP_S3_SPOOL_BUDGET``, default 448 MB of the 512 MB Lambda ``/tmp``);
+an object that does not fit raises :class:`SpoolBudgetError`.  The spool
+file is removed when the spooled object is closed.
+
+.. seealso::
+    - https://docs.aws.amazon.com/AmazonS3/latest/API/API_GetObject.html
+    - https://docs.aws.amazon.com/lambda/latest/dg/configuration-function-common.html#configuration-ephemeral-storage
+"""
+
+import mmap
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from botocore.client import BaseClient
+
+from .aws_s3_event import S3Object
+from .aws_s3_pipeline import s3_object_client
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+S3_SPOOL_DIR = os.getenv("APP_S3_SPOOL_DIR", tempfile.gettempdir())
+S3_SPOOL_BUDGET = int(os.getenv("APP_S3_SPOOL_BUDGET", str(448 * 1024 * 1024)))
+S3_SPOOL_PART_SIZE = int(os.getenv("APP_S3_SPOOL_PART_SIZE", str(8 * 1024 * 1024)))
+S3_SPOOL_WORKERS = int(os.getenv("APP_S3_SPOOL_WORKERS", "4"))
+S3_SPOOL_CHUNK_SIZE = 256 * 1024
+
+
+class SpoolBudgetError(Exception):
+    pass
+
+
+class DiskBudget:
+    """
+    A thread-safe budget for the bytes of spool files
+
+    :param max_bytes: the maximum bytes for all spool files
+    """
+
+    def __init__(self, max_bytes: int = S3_SPOOL_BUDGET):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size: int):
+        with self._lock:
+            if self.used + size > self.max_bytes:
+                raise SpoolBudgetError(
+                    f"Spool budget exceeded: {size} bytes requested, "
+                    f"{self.max_bytes - self.used} bytes available"
+                )
+            self.used += size
+
+    def release(self, size: int):
+        with self._lock:
+            self.used = max(0, self.used - size)
+
+
+SPOOL_BUDGET = DiskBudget()
+
+
+class SpooledS3Object:
+    """
+    An S3 object in a local spool file
+
+    :param s3_object: the S3 object
+    :param path: the spool file path
+    :param size: the object size
+    :param budget: the disk budget that is released on close
+    """
+
+    def __init__(self, s3_object: S3Object, path: str, size: int, budget: DiskBudget):
+        self.s3_object = s3_object
+        self.path = path
+        self.size = size
+        self.budget = budget
+        self.file: BinaryIO = open(path, "rb")
+        self._mmap = None
+
+    def mmap(self) -> memoryview:
+        """A read-only, zero-copy view of the spooled object"""
+        if self.size == 0:
+            return memoryview(b"")
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def close(self):
+        """Close the spool file, remove it and release the disk budget"""
+        if self.file.closed:
+            return
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                LOGGER.warning("A memoryview of %s is still in use", self.path)
+        self.file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.budget.release(self.size)
+
+    def __enter__(self) -> "SpooledS3Object":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def byte_ranges(size: int, part_size: int) -> List[Tuple[int, int]]:
+    """Inclusive byte ranges for the parts of an object"""
+    return [
+        (start, min(start + part_size, size) - 1) for start in range(0, size, part_size)
+    ]
+
+
+def spool_s3_object(
+    s3_object: S3Object,
+    client: BaseClient = None,
+    spool_dir: str = S3_SPOOL_DIR,
+    part_size: int = S3_SPOOL_PART_SIZE,
+    max_workers: int = S3_SPOOL_WORKERS,
+    chunk_size: int = S3_SPOOL_CHUNK_SIZE,
+    budget: DiskBudget = SPOOL_BUDGET,
+) -> SpooledS3Object:
+    """
+    Spool an S3 object to a local file, with ranged GETs in parallel parts
+
+    :param s3_object: an S3 object
+    :param client: an optional S3 client; the default is a registry
+        client for the region of the S3 object
+    :param spool_dir: the directory for the spool file
+    :param part_size: the bytes in each ranged GET
+    :param max_workers: the maximum number of concurrent ranged GETs
+    :param chunk_size: the bytes in each read of a ranged GET
+    :param budget: the disk budget for spool files
+    :returns: a SpooledS3Object, which must be closed to remove the spool file
+    :raises SpoolBudgetError: when the object does not fit in the budget
+    """
+    if client is None:
+        client = s3_object_client(s3_object)
+
+    params: Dict = {"Bucket": s3_object.bucket, "Key": s3_object.key}
+    if s3_object.version_id:
+        params["VersionId"] = s3_object.version_id
+    head = client.head_object(**params)
+    size = head["ContentLength"]
+    # every part must come from the same version of the object
+    params["IfMatch"] = head["ETag"]
+
+    budget.reserve(size)
+    fd, path = tempfile.mkstemp(prefix="s3-spool-", dir=spool_dir)
+    try:
+        os.ftruncate(fd, size)
+
+        def fetch_part(byte_range: Tuple[int, int]):
+            start, end = byte_range
+            response = client.get_object(Range=f"bytes={start}-{end}", **params)
+            body = response["Body"]
+            offset = start
+            try:
+                for chunk in iter(lambda: body.read(chunk_size), b""):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+            finally:
+                body.close()
+            if offset != end + 1:
+                raise IOError(f"Incomplete part {start}-{end} of {s3_object.uri}")
+
+        parts = byte_ranges(size, part_size)
+        workers = max(1, min(max_workers, len(parts)))
+        with ThreadPoolExecutor(workers, thread_name_prefix="s3-spool") as executor:
+            list(executor.map(fetch_part, parts))
+        LOGGER.debug("Spooled %s (%d bytes) to %s", s3_object.uri, size, path)
+        os.close(fd)
+    except BaseException:
+        os.close(fd)
+        os.unlink(path)
+        budget.release(size)
+        raise
+
+    return SpooledS3Object(s3_object, path, size, budget)
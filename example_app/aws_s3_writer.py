@@ -0,0 +1,260 @@
+"""
+AWS S3 Multipart Writer
+-----------------------
+
+Stream a large output to an S3 object, without holding it in memory.
+
+.. code-block::
+
+    output = S3Object(bucket="bucket", key="output/result.csv")
+    with S3MultipartWriter(output) as writer:
+        for line in lines:
+            writer.write(line)
+    LOGGER.info("%.1f MB/s", writer.stats.throughput / 1024 / 1024)
+
+The writer buffers the output into parts and uploads the parts concurrently
+with a bounded thread pool.  No more than ``max_pending`` parts are buffered
+or in progress, so a ``write`` blocks until a part upload is done when the
+uploads are slower than the output.  When the writer is closed, the
+multipart upload is completed; when the ``with`` block raises, or a part
+upload fails, the multipart upload is aborted, so the S3 object is either
+written completely or not at all.  An output that is smaller than one part
+is written with a single PUT.
+
+The part size is set by ``APP_S3_MULTIPART_PART_SIZE`` (default 8 MB, the
+S3 minimum is 5 MB) and the pool size by ``APP_S3_MULTIPART_WORKERS``
+(default 4).
+
+.. seealso::
+    - https://docs.aws.amazon.com/AmazonS3/latest/userguide/mpuoverview.html
+    - https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+"""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Set
+
+from botocore.client import BaseClient
+
+from .aws_s3_event import S3Object
+from .aws_s3_pipeline import s3_object_client
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+S3_MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MULTIPART_PART_SIZE = int(
+    os.getenv("APP_S3_MULTIPART_PART_SIZE", str(8 * 1024 * 1024))
+)
+S3_MULTIPART_WORKERS = int(os.getenv("APP_S3_MULTIPART_WORKERS", "4"))
+
+
+class S3WriteStats(NamedTuple):
+    """
+    :param size: the bytes written
+    :param parts: the number of parts; 0 for a single PUT
+    :param seconds: the seconds from the first write to the close
+    """
+
+    size: int
+    parts: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """The bytes per second"""
+        return self.size / self.seconds if self.seconds > 0 else 0.0
+
+
+class S3MultipartWriter:
+    """
+    A streaming writer for an S3 object, with concurrent multipart uploads
+
+    :param s3_object: the output S3 object
+    :param client: an optional S3 client; the default is a registry
+        client for the region of the S3 object
+    :param part_size: the bytes in each part, at least 5 MB
+    :param max_workers: the maximum number of concurrent part uploads
+    :param max_pending: the maximum number of parts that are in progress
+        (default is 2 * max_workers)
+    :param extra_args: optional parameters for the upload, e.g.
+        {"ContentType": "text/csv"}
+    """
+
+    def __init__(
+        self,
+        s3_object: S3Object,
+        client: BaseClient = None,
+        part_size: int = S3_MULTIPART_PART_SIZE,
+        max_workers: int = S3_MULTIPART_WORKERS,
+        max_pending: int = None,
+        extra_args: Dict = None,
+    ):
+        if part_size < S3_MULTIPART_MIN_PART_SIZE:
+            raise ValueError(
+                f"The part size must be at least {S3_MULTIPART_MIN_PART_SIZE} bytes"
+            )
+        self.s3_object = s3_object
+        self.client = client or s3_object_client(s3_object)
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self.max_pending = max_pending or 2 * max_workers
+        self.extra_args = extra_args or {}
+        self.upload_id: str = None
+        self.stats: S3WriteStats = None
+        self.closed = False
+        self._buffer = bytearray()
+        self._size = 0
+        self._started: float = None
+        self._parts: List[Dict] = []
+        self._pending: Set[Future] = set()
+        self._executor: ThreadPoolExecutor = None
+
+    def write(self, data: bytes) -> int:
+        """
+        Buffer data and upload each complete part
+
+        :param data: the bytes to write
+        :returns: the number of bytes written
+        """
+        if self.closed:
+            raise ValueError(f"The writer for {self.s3_object.uri} is closed")
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._buffer.extend(data)
+        self._size += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[: self.part_size])
+            del self._buffer[: self.part_size]
+            self._upload_part(part)
+        return len(data)
+
+    def close(self) -> S3WriteStats:
+        """
+        Upload the remaining data and complete the upload
+
+        :returns: the write stats
+        """
+        if self.closed:
+            return self.stats
+        if self._started is None:
+            self._started = time.perf_counter()
+        try:
+            if self.upload_id is None:
+                self.client.put_object(
+                    Bucket=self.s3_object.bucket,
+                    Key=self.s3_object.key,
+                    Body=bytes(self._buffer),
+                    **self.extra_args,
+                )
+            else:
+                if self._buffer:
+                    self._upload_part(bytes(self._buffer))
+                self._wait(0)
+                self.client.complete_multipart_upload(
+                    Bucket=self.s3_object.bucket,
+                    Key=self.s3_object.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={
+                        "Parts": sorted(self._parts, key=lambda p: p["PartNumber"])
+                    },
+                )
+        except BaseException:
+            self.abort()
+            raise
+        self._shutdown()
+        self._buffer = bytearray()
+        self.closed = True
+        self.stats = S3WriteStats(
+            size=self._size,
+            parts=len(self._parts),
+            seconds=time.perf_counter() - self._started,
+        )
+        LOGGER.info(
+            "Wrote %s: %d bytes in %d parts, %.0f bytes/s",
+            self.s3_object.uri,
+            self.stats.size,
+            self.stats.parts,
+            self.stats.throughput,
+        )
+        return self.stats
+
+    def abort(self):
+        """Discard the buffered data and abort the multipart upload"""
+        if self.closed:
+            return
+        self.closed = True
+        self._buffer = bytearray()
+        for future in self._pending:
+            future.cancel()
+        self._shutdown()
+        if self.upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(
+                    Bucket=self.s3_object.bucket,
+                    Key=self.s3_object.key,
+                    UploadId=self.upload_id,
+                )
+            except Exception as err:
+                LOGGER.error(
+                    "Failed to abort the upload for %s: %s", self.s3_object.uri, err
+                )
+        LOGGER.warning("Aborted the upload for %s", self.s3_object.uri)
+
+    def _upload_part(self, part: bytes):
+        if self.upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.s3_object.bucket, Key=self.s3_object.key, **self.extra_args
+            )
+            self.upload_id = response["UploadId"]
+            self._executor = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix="s3-writer"
+            )
+        # backpressure: wait for a part upload before buffering another part
+        self._wait(self.max_pending - 1)
+        part_number = len(self._parts) + len(self._pending) + 1
+        future = self._executor.submit(self._put_part, part_number, part)
+        self._pending.add(future)
+
+    def _put_part(self, part_number: int, part: bytes) -> Dict:
+        response = self.client.upload_part(
+            Bucket=self.s3_object.bucket,
+            Key=self.s3_object.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=part,
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def _wait(self, max_pending: int):
+        """Wait until no more than max_pending parts are in progress"""
+        while len(self._pending) > max_pending:
+            done, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    self._parts.append(future.result())
+                except BaseException:
+                    self.abort()
+                    raise
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._pending = set()
+
+    def __enter__(self) -> "S3MultipartWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
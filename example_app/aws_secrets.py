@@ -9,10 +9,34 @@ AWS Secrets Manager
     secrets: Dict = get_aws_secret("app-secrets")
 
     # To use a different client in the same region as the secret:
-    import boto3
-    client = boto3.client(service_name="secretsmanager", region_name="us-east-1")
+    from example_app.aws_clients import boto_client
+    client = boto_client(service_name="secretsmanager", region_name="us-east-1")
     secrets: Dict = get_aws_secret("app-secrets", client)
 
+    # To prefetch several secrets concurrently, e.g. at container init:
+    batch = get_aws_secrets(["app-rds-readonly", "app-rds-write"])
+    for secret_id, error in batch.errors.items():
+        LOGGER.error("Failed to get %s: %s", secret_id, error)
+    ro_secrets: Dict = batch.secrets["app-rds-readonly"]
+
+Secrets are cached in memory by :data:`SECRETS_CACHE`; the cache is
+configured by env-vars:
+
+- ``APP_SECRETS_CACHE_TTL`` - seconds to cache a secret (default 300),
+  a TTL of 0 disables the cache
+- ``APP_SECRETS_CACHE_SIZE`` - the maximum number of cached secrets
+
+After a fraction of the TTL, the next cache hit starts a background refresh;
+the refresh only gets the secret value again when the version-id for the
+version-stage has changed (e.g. after a rotation).
+
+The GetSecretValue calls have a circuit breaker for each region, and they
+are retried after transient errors (see :mod:`example_app.resilience`):
+
+- ``APP_SECRETS_RETRY_ATTEMPTS`` - the attempts of a call (default 2);
+  botocore also retries within each attempt
+- ``APP_SECRETS_RETRY_BASE_DELAY`` - the backoff seconds (default 0.2)
+
 .. seealso::
     https://docs.aws.amazon.com/secretsmanager/latest/userguide/tutorials_basic.html
     https://github.com/aws/aws-secretsmanager-caching-python
@@ -21,49 +45,94 @@ AWS Secrets Manager
 """
 
 import base64
+import copy
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from dataclasses import dataclass
 
-import boto3
 from botocore.client import BaseClient
 from botocore.exceptions import ClientError
 
+from .aws_clients import boto_client
 from .logger import get_logger
+from .resilience import RetryPolicy
+from .resilience import circuit_breaker
+from .resilience import resilient_call
 
 LOGGER = get_logger(__name__)
 
+SECRETS_CACHE_TTL = float(os.getenv("APP_SECRETS_CACHE_TTL", "300"))
+SECRETS_CACHE_SIZE = int(os.getenv("APP_SECRETS_CACHE_SIZE", "64"))
+SECRETS_CACHE_REFRESH = 0.8  # fraction of the TTL before a background refresh
+SECRETS_PREFETCH_WORKERS = int(os.getenv("APP_SECRETS_PREFETCH_WORKERS", "8"))
+SECRETS_BATCH_SIZE = 20  # the limit for BatchGetSecretValue
+# botocore also retries each attempt, see example_app.aws_clients
+SECRETS_RETRY = RetryPolicy(
+    attempts=int(os.getenv("APP_SECRETS_RETRY_ATTEMPTS", "2")),
+    base_delay=float(os.getenv("APP_SECRETS_RETRY_BASE_DELAY", "0.2")),
+)
+
+AWSCURRENT = "AWSCURRENT"
+AWSPENDING = "AWSPENDING"
+
 
-def boto_default_client(
-    service_name: str, region_name: str = "us-west-2"
-) -> BaseClient:
-    region = region_name or os.getenv("AWS_DEFAULT_REGION", "us-west-2")
-    return boto3.client(service_name=service_name, region_name=region)
+def boto_default_client(service_name: str, region_name: str = None) -> BaseClient:
+    # clients are created once by the registry and reused
+    return boto_client(service_name=service_name, region_name=region_name)
 
 
-def get_aws_secret(secret_id: str, client: BaseClient = None) -> Dict:
+def fetch_aws_secret_value(
+    secret_id: str,
+    client: BaseClient,
+    version_stage: str = AWSCURRENT,
+    version_id: str = None,
+) -> Dict:
     """
-    Retrieve from AWS Secrets Manager
+    Retrieve a secret value from AWS Secrets Manager, without caching
 
     :param secret_id: secrets name in AWS Secrets Manager
-    :param client: an optional AWS botocore client for "secretsmanager";
-        a client is created if this is not given.
-    :returns: JSON dictionary of keys:values for the specified secret
+    :param client: an AWS botocore client for "secretsmanager"
+    :param version_stage: the version-stage of the secret
+    :param version_id: an optional version-id of the secret
+    :returns: the GetSecretValue response
     """
 
-    if client is None:
-        client = boto_default_client("secretsmanager")
-
     LOGGER.debug(
-        "Get secrets using key=%s; region=%s", secret_id, client.meta.config.region_name
+        "Get secrets using key=%s; stage=%s; region=%s",
+        secret_id,
+        version_stage,
+        client.meta.config.region_name,
     )
 
+    params = {"SecretId": secret_id}
+    if version_id:
+        params["VersionId"] = version_id
+    else:
+        params["VersionStage"] = version_stage
+
     # In this sample we only handle the specific exceptions for the 'GetSecretValue' API.
     # See https://docs.aws.amazon.com/secretsmanager/latest/apireference/API_GetSecretValue.html
     # We rethrow the exception by default.
 
+    # a breaker for each region, because an outage is usually regional
+    breaker = circuit_breaker(f"secretsmanager:{client.meta.config.region_name}")
     try:
-        secret_response = client.get_secret_value(SecretId=secret_id)
+        return resilient_call(
+            lambda: client.get_secret_value(**params),
+            breaker=breaker,
+            retry=SECRETS_RETRY,
+        )
     except ClientError as e:
         LOGGER.exception(e)
         if e.response["Error"]["Code"] == "DecryptionFailureException":
@@ -86,13 +155,332 @@ def get_aws_secret(secret_id: str, client: BaseClient = None) -> Dict:
             # We can't find the resource that you asked for.
             # Deal with the exception here, and/or rethrow at your discretion.
             raise e
+        raise e
+
+
+def parse_secret_response(secret_response: Dict) -> Dict:
+    """
+    :param secret_response: a GetSecretValue response
+    :returns: JSON dictionary of keys:values for the secret
+    """
+    # Depending on whether the secret is a string or binary, one of these fields will be
+    # populated.
+    if "SecretString" in secret_response:
+        secret = secret_response["SecretString"]
+        return json.loads(secret)
     else:
-        # Depending on whether the secret is a string or binary, one of these fields will be
-        # populated.
-        if "SecretString" in secret_response:
-            secret = secret_response["SecretString"]
-            return json.loads(secret)
-        else:
-            # Decrypts secret using the associated KMS CMK.
-            secret = base64.b64decode(secret_response["SecretBinary"])
-            return json.loads(secret)
+        # Decrypts secret using the associated KMS CMK.
+        secret = base64.b64decode(secret_response["SecretBinary"])
+        return json.loads(secret)
+
+
+@dataclass
+class CachedSecret:
+    secret: Dict
+    version_id: str
+    ttl: float
+    refresh_at: float
+    expires_at: float
+    client: BaseClient
+    refreshing: bool = False
+
+
+class SecretsCache:
+    """
+    An in-memory LRU cache of secrets, with a TTL for each secret
+
+    :param ttl: the default seconds to cache a secret
+    :param max_size: the maximum number of cached secrets
+    """
+
+    def __init__(
+        self, ttl: float = SECRETS_CACHE_TTL, max_size: int = SECRETS_CACHE_SIZE
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._secrets: Dict[Tuple, CachedSecret] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(secret_id: str, client: BaseClient, version_stage: str) -> Tuple:
+        return client.meta.region_name, secret_id, version_stage
+
+    def __len__(self) -> int:
+        return len(self._secrets)
+
+    def get(
+        self,
+        secret_id: str,
+        client: BaseClient,
+        version_stage: str = AWSCURRENT,
+        ttl: float = None,
+    ) -> Dict:
+        """
+        Get a secret from the cache, or from AWS Secrets Manager
+
+        :param secret_id: secrets name in AWS Secrets Manager
+        :param client: an AWS botocore client for "secretsmanager"
+        :param version_stage: the version-stage of the secret
+        :param ttl: an optional TTL for this secret
+        :returns: JSON dictionary of keys:values for the specified secret
+        """
+        key = self.cache_key(secret_id, client, version_stage)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._secrets.get(key)
+            if cached and now < cached.expires_at:
+                self._secrets.move_to_end(key)
+                if now >= cached.refresh_at and not cached.refreshing:
+                    cached.refreshing = True
+                    threading.Thread(
+                        target=self._refresh,
+                        args=(key, cached),
+                        name="secrets-refresh",
+                        daemon=True,
+                    ).start()
+                return copy.deepcopy(cached.secret)
+
+        secret_response = fetch_aws_secret_value(secret_id, client, version_stage)
+        secret = parse_secret_response(secret_response)
+        self.put(
+            secret_id,
+            client,
+            secret,
+            version_id=secret_response.get("VersionId"),
+            version_stage=version_stage,
+            ttl=ttl,
+        )
+        return copy.deepcopy(secret)
+
+    def put(
+        self,
+        secret_id: str,
+        client: BaseClient,
+        secret: Dict,
+        version_id: str = None,
+        version_stage: str = AWSCURRENT,
+        ttl: float = None,
+    ):
+        """Add a secret to the cache"""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        key = self.cache_key(secret_id, client, version_stage)
+        cached = CachedSecret(
+            secret=secret,
+            version_id=version_id,
+            ttl=ttl,
+            refresh_at=now + ttl * SECRETS_CACHE_REFRESH,
+            expires_at=now + ttl,
+            client=client,
+        )
+        with self._lock:
+            self._secrets[key] = cached
+            self._secrets.move_to_end(key)
+            while len(self._secrets) > self.max_size:
+                self._secrets.popitem(last=False)
+
+    def _refresh(self, key: Tuple, cached: CachedSecret):
+        _, secret_id, version_stage = key
+        client = cached.client
+        try:
+            version_id = self.current_version_id(secret_id, client, version_stage)
+            secret = cached.secret
+            if version_id is None or version_id != cached.version_id:
+                secret_response = fetch_aws_secret_value(
+                    secret_id, client, version_stage, version_id=version_id
+                )
+                secret = parse_secret_response(secret_response)
+                version_id = secret_response.get("VersionId")
+                LOGGER.info("Refreshed secret %s (%s)", secret_id, version_stage)
+            self.put(secret_id, client, secret, version_id, version_stage, cached.ttl)
+        except Exception as err:
+            LOGGER.error("Failed to refresh secret %s: %s", secret_id, err)
+            with self._lock:
+                cached.refreshing = False
+
+    @staticmethod
+    def current_version_id(
+        secret_id: str, client: BaseClient, version_stage: str
+    ) -> Optional[str]:
+        """The version-id of a version-stage, from DescribeSecret"""
+        response = client.describe_secret(SecretId=secret_id)
+        for version_id, stages in response.get("VersionIdsToStages", {}).items():
+            if version_stage in stages:
+                return version_id
+        return None
+
+    def invalidate(self, secret_id: str = None):
+        """Remove a secret, in all regions and version-stages, or all secrets"""
+        with self._lock:
+            if secret_id is None:
+                self._secrets.clear()
+                return
+            for key in [k for k in self._secrets if k[1] == secret_id]:
+                del self._secrets[key]
+
+
+SECRETS_CACHE = SecretsCache()
+
+
+def get_aws_secret(
+    secret_id: str,
+    client: BaseClient = None,
+    version_stage: str = AWSCURRENT,
+    ttl: float = None,
+) -> Dict:
+    """
+    Retrieve from AWS Secrets Manager, using the SECRETS_CACHE
+
+    :param secret_id: secrets name in AWS Secrets Manager
+    :param client: an optional AWS botocore client for "secretsmanager";
+        a client is created if this is not given.
+    :param version_stage: the version-stage of the secret, e.g.
+        "AWSCURRENT" or "AWSPENDING"
+    :param ttl: an optional TTL to cache this secret; the default is
+        the ``APP_SECRETS_CACHE_TTL`` and a TTL of 0 disables caching.
+    :returns: JSON dictionary of keys:values for the specified secret
+    """
+
+    if client is None:
+        client = boto_default_client("secretsmanager")
+
+    ttl = SECRETS_CACHE.ttl if ttl is None else ttl
+    if ttl <= 0:
+        secret_response = fetch_aws_secret_value(secret_id, client, version_stage)
+        return parse_secret_response(secret_response)
+
+    return SECRETS_CACHE.get(secret_id, client, version_stage, ttl)
+
+
+class SecretsBatch(NamedTuple):
+    """
+    :param secrets: the secrets that were retrieved, by secret-id
+    :param errors: the errors for secrets that were not retrieved, by secret-id
+    """
+
+    secrets: Dict[str, Dict]
+    errors: Dict[str, Exception]
+
+
+def batch_get_secret_values(
+    secret_ids: List[str], client: BaseClient
+) -> Tuple[Dict[str, Dict], Dict[str, Exception]]:
+    """
+    Retrieve AWSCURRENT secret values with BatchGetSecretValue
+
+    The secrets are requested in batches of ``SECRETS_BATCH_SIZE``; a failed
+    request is logged and its secrets are in neither the responses nor the
+    errors, so that they can be retrieved with GetSecretValue.
+
+    :param secret_ids: secret names in AWS Secrets Manager
+    :param client: an AWS botocore client for "secretsmanager"
+    :returns: GetSecretValue-like responses and errors, by secret-id
+    """
+    responses = {}
+    errors = {}
+    for start in range(0, len(secret_ids), SECRETS_BATCH_SIZE):
+        batch_ids = secret_ids[start : start + SECRETS_BATCH_SIZE]
+        try:
+            response = client.batch_get_secret_value(SecretIdList=batch_ids)
+        except ClientError as err:
+            LOGGER.warning("BatchGetSecretValue failed: %s", err)
+            continue
+        for secret_value in response.get("SecretValues", []):
+            for secret_id in batch_ids:
+                if secret_id in (secret_value.get("Name"), secret_value.get("ARN")):
+                    responses[secret_id] = secret_value
+        for error in response.get("Errors", []):
+            error_response = {
+                "Error": {
+                    "Code": error.get("ErrorCode"),
+                    "Message": error.get("Message"),
+                }
+            }
+            errors[error["SecretId"]] = ClientError(
+                error_response, "BatchGetSecretValue"
+            )
+    return responses, errors
+
+
+def get_aws_secrets(
+    secret_ids: Iterable[str],
+    client: BaseClient = None,
+    version_stage: str = AWSCURRENT,
+    ttl: float = None,
+    max_workers: int = SECRETS_PREFETCH_WORKERS,
+    batch: bool = False,
+) -> SecretsBatch:
+    """
+    Retrieve several secrets concurrently and add them to the SECRETS_CACHE
+
+    The secrets are retrieved by a bounded thread pool, so the time to get
+    them all is close to the time to get the slowest one.  Errors do not
+    stop the other secrets; they are reported for each secret.
+
+    :param secret_ids: secret names in AWS Secrets Manager
+    :param client: an optional AWS botocore client for "secretsmanager";
+        a client is created if this is not given.
+    :param version_stage: the version-stage of the secrets
+    :param ttl: an optional TTL to cache these secrets
+    :param max_workers: the maximum number of concurrent requests
+    :param batch: use BatchGetSecretValue for AWSCURRENT secrets; this
+        requires a recent botocore and the secretsmanager:BatchGetSecretValue
+        permission; any secrets that it does not return, e.g. for a failed
+        or throttled batch request, are retrieved concurrently
+    :returns: a SecretsBatch of secrets and errors
+    """
+
+    if client is None:
+        client = boto_default_client("secretsmanager")
+
+    secret_ids = list(dict.fromkeys(secret_ids))  # unique, in order
+    responses = {}
+    errors = {}
+
+    if batch and version_stage == AWSCURRENT and secret_ids:
+        try:
+            responses, errors = batch_get_secret_values(secret_ids, client)
+        except AttributeError as err:
+            LOGGER.warning("BatchGetSecretValue is not available: %s", err)
+
+    def fetch(secret_id: str):
+        try:
+            return fetch_aws_secret_value(secret_id, client, version_stage), None
+        except Exception as err:
+            return None, err
+
+    remaining = [s for s in secret_ids if s not in responses and s not in errors]
+    if remaining:
+        workers = max(1, min(max_workers, len(remaining)))
+        with ThreadPoolExecutor(workers, thread_name_prefix="secrets") as executor:
+            for secret_id, (response, error) in zip(
+                remaining, executor.map(fetch, remaining)
+            ):
+                if error is None:
+                    responses[secret_id] = response
+                else:
+                    errors[secret_id] = error
+
+    secrets = {}
+    for secret_id, response in responses.items():
+        try:
+            secrets[secret_id] = parse_secret_response(response)
+        except ValueError as err:
+            errors[secret_id] = err
+
+    ttl = SECRETS_CACHE.ttl if ttl is None else ttl
+    if ttl > 0:
+        for secret_id, secret in secrets.items():
+            SECRETS_CACHE.put(
+                secret_id,
+                client,
+                secret,
+                version_id=responses[secret_id].get("VersionId"),
+                version_stage=version_stage,
+                ttl=ttl,
+            )
+
+    return SecretsBatch(
+        secrets={s: copy.deepcopy(secrets[s]) for s in secret_ids if s in secrets},
+        errors={s: errors[s] for s in secret_ids if s in errors},
+    )
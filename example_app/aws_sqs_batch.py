@@ -0,0 +1,125 @@
+"""
+AWS SQS Batches of S3 Events
+----------------------------
+
+Process S3 event notifications that are delivered by SQS, with partial batch
+failure reporting.  When a Lambda function returns ``batchItemFailures``,
+only the failed messages are returned to the queue for a retry, instead
+of the whole batch.
+
+.. code-block::
+
+    @sqs_s3_batch_handler
+    def handler(s3_object: S3Object):
+        # raise an exception to fail the SQS message for this S3 object
+        ...
+
+The Lambda event source mapping must have ``ReportBatchItemFailures`` in
+its ``FunctionResponseTypes``.  For a FIFO queue, all the messages after
+a failed message are also reported as failures, to preserve the order of
+messages in a message group.
+
+.. seealso::
+    - https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html#services-sqs-batchfailurereporting
+"""
+
+import functools
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+
+from .aws_s3_event import S3Object
+from .aws_s3_event import iter_s3_objects
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+
+class SQSMessageResult(NamedTuple):
+    """
+    :param message_id: the SQS message-id
+    :param s3_objects: the S3 objects that were processed for the message
+    :param error: an error that failed the message
+    """
+
+    message_id: str
+    s3_objects: List[S3Object]
+    error: Exception = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def is_fifo_record(sqs_record: Dict) -> bool:
+    return sqs_record.get("eventSourceARN", "").endswith(".fifo")
+
+
+def process_sqs_s3_batch(
+    event: Dict, record_handler: Callable[[S3Object], Any]
+) -> List[SQSMessageResult]:
+    """
+    Process the S3 objects in each SQS message of an SQS event
+
+    :param event: an SQS event, with S3 event notifications in the messages
+    :param record_handler: a function to process an S3 object
+    :returns: the results for each SQS message
+    """
+    results = []
+    fifo_failed = False
+    for sqs_record in event.get("Records") or []:
+        message_id = sqs_record["messageId"]
+        if fifo_failed:
+            error = RuntimeError("Skipped after a failed message in a FIFO queue")
+            results.append(SQSMessageResult(message_id, [], error))
+            continue
+
+        s3_objects = []
+        try:
+            for s3_object in iter_s3_objects({"Records": [sqs_record]}):
+                s3_objects.append(s3_object)
+                record_handler(s3_object)
+            results.append(SQSMessageResult(message_id, s3_objects))
+        except Exception as err:
+            LOGGER.exception("Failed SQS message %s: %s", message_id, err)
+            results.append(SQSMessageResult(message_id, s3_objects, err))
+            fifo_failed = is_fifo_record(sqs_record)
+    return results
+
+
+def batch_item_failures(results: List[SQSMessageResult]) -> Dict:
+    """
+    :param results: the results for each SQS message
+    :returns: a Lambda partial batch response
+    """
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": result.message_id}
+            for result in results
+            if not result.ok
+        ]
+    }
+
+
+def sqs_s3_batch_handler(record_handler: Callable[[S3Object], Any]) -> Callable:
+    """
+    Decorate an S3 object handler to create an SQS Lambda handler
+
+    :param record_handler: a function to process an S3 object
+    :returns: a Lambda handler that returns a partial batch response
+    """
+
+    @functools.wraps(record_handler)
+    def handler(event: Dict, context) -> Dict:
+        results = process_sqs_s3_batch(event, record_handler)
+        response = batch_item_failures(results)
+        LOGGER.info(
+            "Processed %d SQS messages; %d failed",
+            len(results),
+            len(response["batchItemFailures"]),
+        )
+        return response
+
+    return handler
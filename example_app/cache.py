@@ -0,0 +1,186 @@
+"""
+In-process Cache
+----------------
+
+A thread-safe TTL and LRU cache, with hit-ratio stats.
+
+.. code-block::
+
+    cache = TTLCache(max_size=256, ttl=60)
+
+    value = cache.get(key)
+    if value is None:
+        value = compute(key)
+        cache.put(key, value)
+
+    cache.invalidate(key)
+    cache.invalidate(lambda key: key[0] == "items")  # keys that match
+    LOGGER.info("hit ratio: %.2f", cache.stats().hit_ratio)
+
+The cache is for a single process, e.g. a warm Lambda container; values
+are not copied, so they should be immutable (or treated as immutable).
+
+Use :func:`create_cache` for a cache that is shared by the workers of
+``example_app.server`` when ``APP_SHARED_CACHE_DIR`` is set (see
+:mod:`example_app.shared_cache`), and in-process otherwise.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import NamedTuple
+from typing import Tuple
+from typing import Union
+
+SHARED_CACHE_DIR = os.getenv("APP_SHARED_CACHE_DIR")
+SHARED_CACHE_SLOT_SIZE = int(os.getenv("APP_SHARED_CACHE_SLOT_SIZE", "4096"))
+
+
+class CacheStats(NamedTuple):
+    """
+    :param hits: the number of gets that found a value
+    :param misses: the number of gets that found no value, or an expired value
+    :param evictions: the number of values removed for the size bound
+    :param size: the number of cached values
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class TTLCache:
+    """
+    A thread-safe cache with a TTL for values and an LRU size bound
+
+    :param max_size: the maximum number of values
+    :param ttl: the default seconds to cache a value
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._values: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        :returns: the cached value, or the default for a missing or expired key
+        """
+        with self._lock:
+            item = self._values.get(key)
+            if item is not None:
+                value, expires_at = item
+                if time.monotonic() < expires_at:
+                    self._values.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._values[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, ttl: float = None):
+        """
+        :param key: a hashable key
+        :param value: the value to cache
+        :param ttl: optional seconds to cache this value, instead of the default
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + ttl)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+                self.evictions += 1
+
+    def update(
+        self, key: Hashable, func: Callable[[Any], Tuple[Any, Any]], ttl: float = None
+    ) -> Any:
+        """
+        Atomically replace a value, e.g. to update a counter
+
+        :param key: a hashable key
+        :param func: ``func(value) -> (new_value, result)``, where the value is
+            None for a missing or expired key
+        :param ttl: optional seconds to cache the new value, instead of the default
+        :returns: the result of the func
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            now = time.monotonic()
+            item = self._values.get(key)
+            value = item[0] if item is not None and now < item[1] else None
+            value, result = func(value)
+            self._values[key] = (value, now + ttl)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def invalidate(self, key: Union[Hashable, Callable[[Hashable], bool]] = None):
+        """
+        Remove cached values
+
+        :param key: a key, or a function that is True for the keys to remove;
+            the default removes all the values
+        """
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            elif callable(key):
+                for k in [k for k in self._values if key(k)]:
+                    del self._values[k]
+            else:
+                self._values.pop(key, None)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, len(self._values))
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+
+def create_cache(
+    name: str,
+    max_size: int = 256,
+    ttl: float = 60.0,
+    shared_dir: str = SHARED_CACHE_DIR,
+    slot_size: int = SHARED_CACHE_SLOT_SIZE,
+):
+    """
+    Create a TTLCache, or a SharedCache when there is a shared cache directory
+
+    :param name: the name of the cache, for the shared cache file
+    :param max_size: the maximum number of values
+    :param ttl: the default seconds to cache a value
+    :param shared_dir: a private directory for shared cache files, e.g. on
+        /dev/shm; it is created with mode 0700
+    :param slot_size: the bytes for each value in a shared cache
+    :returns: a cache with the TTLCache interface
+    """
+    if not shared_dir:
+        return TTLCache(max_size=max_size, ttl=ttl)
+
+    from .shared_cache import SharedCache  # pylint: disable=C0415
+
+    path = os.path.join(shared_dir, f"{name}.cache")
+    return SharedCache(path, slots=max_size, slot_size=slot_size, ttl=ttl)
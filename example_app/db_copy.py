@@ -0,0 +1,295 @@
+"""
+Postgres COPY Loader
+--------------------
+
+Bulk load CSV or NDJSON S3 objects into Postgres with ``COPY FROM STDIN``.
+The S3 object body is streamed into the COPY in chunks, so the object is
+never held in memory.
+
+.. code-block::
+
+    from example_app.db_pool import get_pg_pool
+
+    # load all the objects in an S3 event
+    for stats in load_s3_event(event, "app.items", ["id", "name", "price"]):
+        LOGGER.info("%d rows, %.0f rows/s", stats.rows, stats.rows_per_second)
+
+    # or load an object with an upsert on the primary key
+    with get_pg_pool().connection() as conn:
+        copy_s3_object(
+            s3_object, conn, "app.items", ["id", "name", "price"], upsert_keys=["id"]
+        )
+
+The format is taken from the key extension: ``.csv`` objects are copied
+as-is (with a header row by default); ``.ndjson``, ``.jsonl`` and ``.json``
+objects have a JSON object on each line, which is converted to a CSV row of
+the columns; a JSON null or a missing key is NULL, and an empty string is
+an empty string.  With ``upsert_keys``, the rows are copied into a
+temporary staging table and then merged into the table with ``INSERT ..
+ON CONFLICT .. DO UPDATE``, so a reloaded object updates the existing rows.
+When an object has several rows with the same keys, the last row wins.
+
+.. seealso::
+    - https://www.postgresql.org/docs/current/sql-copy.html
+    - https://www.psycopg.org/docs/cursor.html#cursor.copy_expert
+"""
+
+import io
+import json
+import os
+import time
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+
+from botocore.client import BaseClient
+
+from .aws_s3_event import S3Object
+from .aws_s3_event import parse_s3_event
+from .aws_s3_pipeline import iter_s3_body
+from .db_pool import PgPool
+from .db_pool import get_pg_pool
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+COPY_CHUNK_SIZE = int(os.getenv("APP_PG_COPY_CHUNK_SIZE", str(1024 * 1024)))
+
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl", ".json")
+
+#: the characters of a CSV field that is quoted
+CSV_SPECIAL_CHARS = ',"\r\n'
+
+#: a column of the staging table for the order of the copied rows
+STAGING_ROW = "_copy_row"
+
+
+class CopyStats(NamedTuple):
+    """
+    :param s3_object: the S3 object that was loaded
+    :param table: the table that was loaded
+    :param rows: the rows that were copied, or merged with an upsert
+    :param size: the bytes that were copied
+    :param seconds: the seconds to load the object
+    """
+
+    s3_object: S3Object
+    table: str
+    rows: int
+    size: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    A read-only file for an iterator of byte chunks, e.g. for copy_expert
+
+    :param chunks: an iterator of bytes
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._buffer = b""
+        self.size = 0  # the bytes read
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.size += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def csv_field(value: Any) -> str:
+    """
+    A CSV field for COPY: None is an unquoted empty field, which is NULL, an
+    empty string is quoted, and JSON values are JSON text
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    text = str(value)
+    # a quoted empty string is not NULL, and a quoted \. is not the end of data
+    if text in ("", "\\.") or any(c in text for c in CSV_SPECIAL_CHARS):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def ndjson_to_csv(chunks: Iterable[bytes], columns: List[str]) -> Iterator[bytes]:
+    """
+    Convert NDJSON chunks into CSV chunks, without a header row
+
+    :param chunks: an iterator of NDJSON bytes; lines can span chunks
+    :param columns: the JSON keys for the CSV columns; a missing key is NULL
+    :returns: an iterator of CSV bytes, a chunk for each NDJSON chunk with rows
+    """
+
+    def csv_row(line: bytes) -> str:
+        record = json.loads(line)
+        return ",".join(csv_field(record.get(col)) for col in columns) + "\n"
+
+    remainder = b""
+    for chunk in chunks:
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        rows = [csv_row(line) for line in lines if line.strip()]
+        if rows:
+            yield "".join(rows).encode()
+    if remainder.strip():
+        yield csv_row(remainder).encode()
+
+
+def quote_ident(name: str) -> str:
+    """Quote an identifier, which can be qualified by a schema"""
+    return ".".join('"' + part.replace('"', '""') + '"' for part in name.split("."))
+
+
+def copy_sql(table: str, columns: List[str], header: bool) -> str:
+    cols = ", ".join(quote_ident(col) for col in columns)
+    options = "FORMAT csv, HEADER true" if header else "FORMAT csv"
+    return f"COPY {quote_ident(table)} ({cols}) FROM STDIN WITH ({options})"
+
+
+def upsert_sql(
+    table: str, staging: str, columns: List[str], upsert_keys: List[str]
+) -> str:
+    """
+    Merge the staging table into the table; for the rows with the same keys,
+    the last copied row is merged, because a row cannot be updated twice in
+    an INSERT .. ON CONFLICT
+    """
+    cols = ", ".join(quote_ident(col) for col in columns)
+    keys = ", ".join(quote_ident(key) for key in upsert_keys)
+    updates = [
+        f"{quote_ident(col)} = EXCLUDED.{quote_ident(col)}"
+        for col in columns
+        if col not in upsert_keys
+    ]
+    action = f"DO UPDATE SET {', '.join(updates)}" if updates else "DO NOTHING"
+    return (
+        f"INSERT INTO {quote_ident(table)} ({cols}) "
+        f"SELECT DISTINCT ON ({keys}) {cols} FROM {quote_ident(staging)} "
+        f"ORDER BY {keys}, {quote_ident(STAGING_ROW)} DESC "
+        f"ON CONFLICT ({keys}) {action}"
+    )
+
+
+def is_ndjson(s3_object: S3Object) -> bool:
+    return s3_object.key.lower().endswith(NDJSON_EXTENSIONS)
+
+
+def copy_s3_object(
+    s3_object: S3Object,
+    conn: Any,
+    table: str,
+    columns: List[str],
+    upsert_keys: List[str] = None,
+    header: bool = True,
+    client: BaseClient = None,
+    chunk_size: int = COPY_CHUNK_SIZE,
+) -> CopyStats:
+    """
+    Copy a CSV or NDJSON S3 object into a table
+
+    The transaction is not committed; use a pool connection context.
+
+    :param s3_object: a CSV or NDJSON S3 object
+    :param conn: a Postgres connection
+    :param table: the table, which can be qualified by a schema
+    :param columns: the table columns, in the order of the CSV columns
+    :param upsert_keys: optional unique columns to merge rows on
+    :param header: whether a CSV object has a header row
+    :param client: an optional S3 client
+    :param chunk_size: the bytes in each chunk of the S3 object body
+    :returns: the copy stats
+    """
+    start = time.perf_counter()
+    chunks = iter_s3_body(s3_object, client=client, chunk_size=chunk_size)
+    if is_ndjson(s3_object):
+        chunks = ndjson_to_csv(chunks, columns)
+        header = False
+    reader = ChunkReader(chunks)
+
+    with conn.cursor() as cursor:
+        if upsert_keys:
+            staging = "_staging_" + table.rsplit(".", 1)[-1]
+            cursor.execute(
+                f"CREATE TEMP TABLE {quote_ident(staging)} "
+                f"(LIKE {quote_ident(table)} INCLUDING DEFAULTS, "
+                f"{quote_ident(STAGING_ROW)} bigserial) ON COMMIT DROP"
+            )
+            cursor.copy_expert(copy_sql(staging, columns, header), reader, chunk_size)
+            cursor.execute(upsert_sql(table, staging, columns, upsert_keys))
+            rows = cursor.rowcount
+            cursor.execute(f"DROP TABLE {quote_ident(staging)}")
+        else:
+            cursor.copy_expert(copy_sql(table, columns, header), reader, chunk_size)
+            rows = cursor.rowcount
+
+    stats = CopyStats(
+        s3_object=s3_object,
+        table=table,
+        rows=max(rows, 0),
+        size=reader.size,
+        seconds=time.perf_counter() - start,
+    )
+    LOGGER.info(
+        "Copied %s into %s: %d rows, %d bytes, %.0f rows/s",
+        s3_object.uri,
+        table,
+        stats.rows,
+        stats.size,
+        stats.rows_per_second,
+    )
+    return stats
+
+
+def load_s3_event(
+    event: Dict,
+    table: str,
+    columns: List[str],
+    upsert_keys: List[str] = None,
+    pool: PgPool = None,
+    **kwargs,
+) -> Iterator[CopyStats]:
+    """
+    Copy each S3 object in an S3 event into a table, with a transaction
+    for each object
+
+    :param event: an S3 event
+    :param table: the table, which can be qualified by a schema
+    :param columns: the table columns
+    :param upsert_keys: optional unique columns to merge rows on
+    :param pool: an optional connection pool; the default is get_pg_pool()
+    :param kwargs: other options for copy_s3_object
+    :returns: an iterator of the copy stats for each S3 object
+    """
+    pool = pool or get_pg_pool()
+    for s3_object in parse_s3_event(event):
+        with pool.connection() as conn:
+            yield copy_s3_object(
+                s3_object, conn, table, columns, upsert_keys=upsert_keys, **kwargs
+            )
@@ -0,0 +1,305 @@
+"""
+Postgres Connection Pool
+------------------------
+
+A small pool of Postgres connections that persist across warm Lambda
+invocations.  The pool is created on first use from the app settings and
+connections are only opened when they are needed.
+
+.. code-block::
+
+    from example_app.db_pool import get_pg_pool
+
+    with get_pg_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    # a FastAPI dependency
+    @router.get("/items")
+    def get_items(conn=Depends(pg_connection)):
+        ...
+
+The pool is configured by the settings:
+
+- ``APP_PG_DSN`` - the Postgres DSN
+- ``APP_PG_SECRET_ID`` - an optional secret with the database credentials,
+  which override the credentials in the DSN
+- ``APP_PG_POOL_SIZE`` - the maximum number of connections (default 2)
+- ``APP_PG_CONNECT_TIMEOUT`` - the connect timeout seconds (default 5)
+
+A connection that has been idle for longer than ``APP_PG_HEALTH_CHECK_IDLE``
+seconds (default 30) is checked with ``SELECT 1`` before it is handed out,
+because the database or an RDS Proxy can close idle connections while a
+Lambda container is frozen.  The ``psycopg2`` package is optional; it is
+only required to open connections, and it is installed by the ``postgres``
+extra, e.g. ``pip install serverless-fast-api[postgres]``.
+
+During a request with a deadline (see :mod:`example_app.deadline`), the
+pool waits for a connection and opens a connection until the deadline, and
+a pooled connection sets a ``statement_timeout`` for its transaction.
+
+.. seealso::
+    - https://www.psycopg.org/docs/module.html#psycopg2.connect
+    - https://docs.aws.amazon.com/AmazonRDS/latest/UserGuide/rds-proxy.html
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterator
+from typing import Tuple
+
+from .aws_secrets import get_aws_secret
+from .deadline import deadline_timeout
+from .logger import get_logger
+from .settings import Settings
+
+try:
+    import psycopg2
+except ImportError:  # pragma: no cover
+    psycopg2 = None
+
+LOGGER = get_logger(__name__)
+
+PG_HEALTH_CHECK_IDLE = float(os.getenv("APP_PG_HEALTH_CHECK_IDLE", "30"))
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+def pg_connect_params(settings: Settings = None, secret: Dict = None) -> Dict:
+    """
+    Connection parameters for psycopg2.connect
+
+    :param settings: the app settings, with the pg_dsn
+    :param secret: optional RDS credentials from Secrets Manager, with
+        {"username", "password"} and optional {"host", "port", "dbname"}
+    """
+    settings = settings or Settings()
+    dsn = settings.pg_dsn
+    params = {
+        "host": dsn.host,
+        "port": int(dsn.port or 5432),
+        "dbname": (dsn.path or "/").lstrip("/") or None,
+        "user": dsn.user,
+        "password": dsn.password,
+        "connect_timeout": settings.pg_connect_timeout,
+        "application_name": "example_app",
+    }
+    if secret:
+        params["user"] = secret.get("username", params["user"])
+        params["password"] = secret.get("password", params["password"])
+        params["host"] = secret.get("host", params["host"])
+        params["port"] = int(secret.get("port", params["port"]))
+        params["dbname"] = secret.get("dbname", params["dbname"])
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def pg_connect(**params) -> Any:
+    if psycopg2 is None:
+        raise RuntimeError("The psycopg2 package is required for Postgres connections")
+    return psycopg2.connect(**params)
+
+
+class PgPool:
+    """
+    A thread-safe pool of Postgres connections
+
+    :param params: the connection parameters
+    :param max_size: the maximum number of open connections
+    :param connect: a function to open a connection with the params;
+        the default is psycopg2.connect
+    :param health_check_idle: the idle seconds before a health check
+    """
+
+    def __init__(
+        self,
+        params: Dict,
+        max_size: int = 2,
+        connect: Callable[..., Any] = pg_connect,
+        health_check_idle: float = PG_HEALTH_CHECK_IDLE,
+    ):
+        self.params = params
+        self.max_size = max_size
+        self.connect = connect
+        self.health_check_idle = health_check_idle
+        self.size = 0  # the number of open connections
+        self.created = 0
+        self._idle: Deque[Tuple[Any, float]] = deque()
+        self._cond = threading.Condition()
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def acquire(self, timeout: float = None) -> Any:
+        """
+        Get a healthy connection, or open a new connection
+
+        :param timeout: the seconds to wait for a connection when all the
+            connections are in use; the default is to wait until the request
+            deadline, or indefinitely
+        :raises PoolTimeoutError: when no connection is available in time
+        :raises DeadlineExceeded: when the request deadline has passed
+        """
+        timeout = deadline_timeout(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while not self._idle and self.size >= self.max_size:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"No Postgres connection available in {timeout:.3f} seconds"
+                        )
+                    self._cond.wait(remaining)
+                if self._idle:
+                    # the most recently used connection is the most likely
+                    # to be alive, and unused connections can be closed
+                    conn, released = self._idle.pop()
+                else:
+                    conn, released = None, None
+                    self.size += 1
+
+            if conn is None:
+                try:
+                    conn = self.connect(**self.connect_params())
+                except BaseException:
+                    self._discard(None)
+                    raise
+                self.created += 1
+                LOGGER.debug("Opened a Postgres connection (%d open)", self.size)
+                return conn
+
+            if self._healthy(conn, time.monotonic() - released):
+                return conn
+            self._discard(conn)
+
+    def connect_params(self) -> Dict:
+        """The connection parameters, with a connect_timeout by the deadline"""
+        connect_timeout = self.params.get("connect_timeout") or None
+        timeout = deadline_timeout(connect_timeout)
+        if timeout is None or timeout == connect_timeout:
+            return self.params
+        # libpq takes integer seconds, and the minimum is 2 seconds
+        return dict(self.params, connect_timeout=max(2, math.ceil(timeout)))
+
+    def release(self, conn: Any, discard: bool = False):
+        """
+        Return a connection to the pool
+
+        :param conn: a connection from acquire
+        :param discard: close the connection, e.g. after an error
+        """
+        if discard or conn.closed:
+            self._discard(conn)
+            return
+        try:
+            conn.rollback()  # end any open transaction
+        except Exception as err:
+            LOGGER.warning("Discarded a Postgres connection: %s", err)
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None) -> Iterator[Any]:
+        """
+        A pooled connection, which is committed when the context exits
+        normally and rolled back when it raises.  The statements of the
+        transaction are cancelled at the request deadline.
+        """
+        conn = self.acquire(timeout=timeout)
+        try:
+            statement_timeout = deadline_timeout()
+            if statement_timeout is not None:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "SET LOCAL statement_timeout = %s",
+                        (max(1, int(statement_timeout * 1000)),),
+                    )
+            yield conn
+            conn.commit()
+        except BaseException:
+            # release rolls back, or discards a broken connection
+            self.release(conn)
+            raise
+        self.release(conn)
+
+    def close(self):
+        """Close the idle connections"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self.size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _healthy(self, conn: Any, idle_seconds: float) -> bool:
+        if conn.closed:
+            return False
+        if idle_seconds < self.health_check_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            conn.rollback()
+            return True
+        except Exception as err:
+            LOGGER.warning("Failed Postgres connection health check: %s", err)
+            return False
+
+    def _discard(self, conn: Any):
+        with self._cond:
+            self.size -= 1
+            self._cond.notify()
+        if conn is not None:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn: Any):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+PG_POOL: PgPool = None
+_PG_POOL_LOCK = threading.Lock()
+
+
+def get_pg_pool() -> PgPool:
+    """
+    The process-wide pool, which is created on first use from the settings
+    """
+    global PG_POOL
+    if PG_POOL is None:
+        with _PG_POOL_LOCK:
+            if PG_POOL is None:
+                settings = Settings()
+                secret = None
+                if settings.pg_secret_id:
+                    secret = get_aws_secret(settings.pg_secret_id)
+                params = pg_connect_params(settings, secret)
+                PG_POOL = PgPool(params, max_size=settings.pg_pool_size)
+    return PG_POOL
+
+
+def pg_connection() -> Iterator[Any]:
+    """A FastAPI dependency for a pooled Postgres connection"""
+    with get_pg_pool().connection() as conn:
+        yield conn
@@ -0,0 +1,171 @@
+"""
+Postgres Queries
+----------------
+
+Named read queries that are prepared once for each connection, with an
+optional in-process result cache.
+
+.. code-block::
+
+    ITEM_QUERY = Query(
+        name="get_item",
+        sql="SELECT id, name FROM app.items WHERE id = $1",
+        cache_ttl=30,
+        tables=("app.items",),
+    )
+
+    @router.get("/items/{item_id}")
+    def get_item(item_id: int, conn=Depends(pg_connection)):
+        rows = fetch_all(conn, ITEM_QUERY, (item_id,))
+        ...
+
+    # after a write to the table
+    invalidate_table("app.items")
+
+A query is prepared with ``PREPARE`` on the first use for a connection, and
+then run with ``EXECUTE``, so Postgres only plans it once for the pooled
+connection.  The query SQL uses ``$1, $2, ..`` parameters.  Note that an
+RDS Proxy pins a client connection to a database connection when it uses
+prepared statements.
+
+Results of queries with a ``cache_ttl`` are cached in :data:`QUERY_CACHE`,
+keyed by the query name and parameters; the cache is bounded by
+``APP_QUERY_CACHE_SIZE`` (default 256) and reports hit ratios in
+``QUERY_CACHE.stats()``.  It is shared by the server workers when
+``APP_SHARED_CACHE_DIR`` is set, and then only the results and parameters
+that are JSON values are cached, e.g. the results of queries with
+``numeric``, ``date``, ``timestamp``, ``uuid`` or ``bytea`` columns are not
+cached.  The cached rows are tuples, as the rows of a cursor.  Use
+:func:`invalidate_query` or :func:`invalidate_table` after writes.
+
+.. seealso::
+    - https://www.postgresql.org/docs/current/sql-prepare.html
+"""
+
+import os
+import threading
+import weakref
+from typing import Any
+from typing import List
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+
+from dataclasses import dataclass
+
+from .cache import create_cache
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+QUERY_CACHE_SIZE = int(os.getenv("APP_QUERY_CACHE_SIZE", "256"))
+
+QUERY_CACHE = create_cache("query", max_size=QUERY_CACHE_SIZE)
+
+_MISSING = object()
+
+#: the SQLSTATE of an EXECUTE for a statement that is not prepared
+INVALID_SQL_STATEMENT_NAME = "26000"
+
+
+@dataclass(frozen=True)
+class Query:
+    """
+    :param name: a unique name, which is the prepared statement name
+    :param sql: the query SQL, with $1, $2, .. parameters
+    :param cache_ttl: seconds to cache the results; 0 disables the cache
+    :param tables: the tables in the query, to invalidate cached results
+    """
+
+    name: str
+    sql: str
+    cache_ttl: float = 0
+    tables: Tuple[str, ...] = ()
+
+
+class PreparedStatements:
+    """The names of the statements prepared on each connection"""
+
+    def __init__(self):
+        self._prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def names(self, conn: Any) -> Set[str]:
+        with self._lock:
+            names = self._prepared.get(conn)
+            if names is None:
+                names = self._prepared[conn] = set()
+            return names
+
+    def discard(self, conn: Any, name: str):
+        self.names(conn).discard(name)
+
+
+PREPARED_STATEMENTS = PreparedStatements()
+
+
+def execute_prepared(conn: Any, query: Query, params: Sequence = ()) -> List[Tuple]:
+    """
+    Run a query as a prepared statement on a connection
+
+    :param conn: a Postgres connection
+    :param query: a query
+    :param params: the query parameters
+    :returns: the result rows
+    """
+    prepared = PREPARED_STATEMENTS.names(conn)
+    with conn.cursor() as cursor:
+        if query.name not in prepared:
+            cursor.execute(f"PREPARE {query.name} AS {query.sql}")
+            prepared.add(query.name)
+            LOGGER.debug("Prepared %s", query.name)
+        sql = f"EXECUTE {query.name}"
+        if params:
+            sql += f" ({', '.join(['%s'] * len(params))})"
+        try:
+            cursor.execute(sql, tuple(params) or None)
+        except Exception as err:
+            # a PREPARE lasts for the session, even when its transaction is
+            # rolled back, so it is only prepared again when the session no
+            # longer has it, e.g. after a DISCARD ALL by a connection proxy
+            if getattr(err, "pgcode", None) == INVALID_SQL_STATEMENT_NAME:
+                prepared.discard(query.name)
+            raise
+        return cursor.fetchall()
+
+
+def fetch_all(conn: Any, query: Query, params: Sequence = ()) -> List[Tuple]:
+    """
+    Run a query, or get the cached results for a query with a cache_ttl
+
+    :param conn: a Postgres connection
+    :param query: a query
+    :param params: the query parameters, which must be hashable
+    :returns: the result rows
+    """
+    if query.cache_ttl <= 0:
+        return execute_prepared(conn, query, params)
+
+    key = (query.name, query.tables, tuple(params))
+    rows = QUERY_CACHE.get(key, _MISSING)
+    if rows is _MISSING:
+        rows = execute_prepared(conn, query, params)
+        QUERY_CACHE.put(key, rows, ttl=query.cache_ttl)
+    # a shared cache has JSON values, with lists for the rows
+    return [tuple(row) for row in rows]
+
+
+def fetch_one(conn: Any, query: Query, params: Sequence = ()) -> Tuple:
+    """Run a query and return the first row, or None"""
+    rows = fetch_all(conn, query, params)
+    return rows[0] if rows else None
+
+
+def invalidate_query(query: Query):
+    """Remove the cached results of a query"""
+    QUERY_CACHE.invalidate(lambda key: key[0] == query.name)
+
+
+def invalidate_table(table: str):
+    """Remove the cached results of the queries on a table"""
+    QUERY_CACHE.invalidate(lambda key: table in key[1])
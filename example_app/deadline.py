@@ -0,0 +1,177 @@
+"""
+Request Deadlines
+=================
+
+A request-scoped deadline, so that the calls to slow dependencies fail
+fast instead of running past the end of a Lambda invocation.  The deadline
+is a ``time.monotonic()`` value in the :data:`REQUEST_DEADLINE` context
+variable; it is set:
+
+- by :func:`deadline_context` on a Lambda handler, from the remaining time
+  of the Lambda context, i.e. ``context.get_remaining_time_in_millis()``
+- by the :class:`DeadlineMiddleware` in uvicorn mode, from a time budget
+  for each request (see :func:`add_request_deadline`)
+
+The HTTP, boto3 and Postgres helpers get their timeouts from
+:func:`deadline_timeout`, which is the lesser of their own timeout and the
+remaining time, or it raises :class:`DeadlineExceeded` when the deadline
+has passed:
+
+.. code-block::
+
+    response = requests.get(url, timeout=deadline_timeout(5.0))
+
+The deadlines are configured with:
+
+- ``APP_DEADLINE_MARGIN_MS`` - the milliseconds to reserve before the end
+  of a Lambda invocation, to return an error response and flush the logs
+  (default 500)
+- ``APP_REQUEST_BUDGET_MS`` - the milliseconds for each request in uvicorn
+  mode; 0 has no deadline (default 0)
+
+There is no deadline outside of a request, e.g. for background threads, so
+:func:`deadline_timeout` returns the default timeout.
+"""
+
+import functools
+import os
+import time
+from contextvars import ContextVar
+from contextvars import Token
+from typing import Callable
+from typing import Optional
+
+from starlette.responses import JSONResponse
+
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+DEADLINE_MARGIN_MS = int(os.getenv("APP_DEADLINE_MARGIN_MS", "500"))
+REQUEST_BUDGET_MS = int(os.getenv("APP_REQUEST_BUDGET_MS", "0"))
+
+#: the time.monotonic() deadline of the current request, if any
+REQUEST_DEADLINE = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def set_deadline(seconds: float) -> Token:
+    """
+    Set the deadline of the current request
+
+    :param seconds: the seconds from now until the deadline
+    :returns: a token to reset the deadline
+    """
+    return REQUEST_DEADLINE.set(time.monotonic() + seconds)
+
+
+def remaining_time() -> Optional[float]:
+    """
+    :returns: the seconds until the deadline, which are negative when it has
+        passed, or None when there is no deadline
+    """
+    deadline = REQUEST_DEADLINE.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def deadline_timeout(timeout: float = None) -> Optional[float]:
+    """
+    A timeout for a call to a dependency, which ends by the deadline
+
+    :param timeout: the default seconds for the call; None has no timeout
+    :returns: the lesser of the timeout and the remaining time
+    :raises DeadlineExceeded: when the deadline has passed
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded(f"The request deadline passed {-remaining:.3f}s ago")
+    if timeout is None:
+        return remaining
+    return min(timeout, remaining)
+
+
+def check_deadline(**kwargs):
+    """
+    A botocore event handler that fails fast when the deadline has passed,
+    e.g. for ``before-send``, which is emitted for each attempt of a call
+    """
+    deadline_timeout()
+
+
+def deadline_context(handler: Callable) -> Callable:
+    """
+    Decorate a Lambda handler to set the request deadline from the
+    remaining time of the Lambda context, less ``APP_DEADLINE_MARGIN_MS``
+
+    :param handler: a Lambda handler, i.e. ``handler(event, context)``
+    :returns: the wrapped handler
+    """
+
+    @functools.wraps(handler, updated=())
+    def wrapper(event, context):
+        get_remaining_time = getattr(context, "get_remaining_time_in_millis", None)
+        remaining_ms = get_remaining_time() if callable(get_remaining_time) else None
+        if not isinstance(remaining_ms, (int, float)):
+            return handler(event, context)
+        token = set_deadline((remaining_ms - DEADLINE_MARGIN_MS) / 1000)
+        try:
+            return handler(event, context)
+        finally:
+            REQUEST_DEADLINE.reset(token)
+
+    return wrapper
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware to set a deadline for each request
+
+    The deadline is not changed if it was already set for the request,
+    e.g. by :func:`deadline_context` on the Lambda handler.
+
+    :param app: an ASGI application
+    :param budget_ms: the milliseconds for each request
+    """
+
+    def __init__(self, app, budget_ms: int = REQUEST_BUDGET_MS):
+        self.app = app
+        self.budget = budget_ms / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or REQUEST_DEADLINE.get() is not None:
+            await self.app(scope, receive, send)
+            return
+
+        token = set_deadline(self.budget)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUEST_DEADLINE.reset(token)
+
+
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    LOGGER.warning("%s %s: %s", request.method, request.url.path, exc)
+    return JSONResponse({"detail": "Gateway Timeout"}, status_code=504)
+
+
+def add_request_deadline(app) -> bool:
+    """
+    Respond to a DeadlineExceeded error with a ``504 Gateway Timeout``, and
+    add the DeadlineMiddleware to a FastAPI app, when there is a budget
+
+    :param app: a FastAPI app
+    :returns: True when the middleware is added
+    """
+    app.add_exception_handler(DeadlineExceeded, deadline_exceeded_handler)
+    if REQUEST_BUDGET_MS <= 0:
+        return False
+    app.add_middleware(DeadlineMiddleware, budget_ms=REQUEST_BUDGET_MS)
+    LOGGER.info("Request deadline enabled; budget=%sms", REQUEST_BUDGET_MS)
+    return True
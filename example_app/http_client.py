@@ -0,0 +1,340 @@
+"""
+HTTP Client
+-----------
+
+A process-wide HTTP client for outbound calls, with a pool of keep-alive
+connections for each host, so that warm invocations reuse the TCP and TLS
+connections to a dependency instead of opening a new connection for each
+request, as ``requests.get`` does.
+
+.. code-block::
+
+    from example_app.http_client import HTTP_CLIENT
+
+    response = HTTP_CLIENT.get(url, timeout=5.0)
+    response = HTTP_CLIENT.get(jwks_uri, cache=True)  # a cacheable GET
+
+    # in a coroutine, the request runs in a thread of the client
+    response = await HTTP_CLIENT.async_get(url)
+
+The client is configured by env-vars:
+
+- ``APP_HTTP_POOL_CONNECTIONS`` - the number of hosts with a connection
+  pool (default 10)
+- ``APP_HTTP_POOL_MAXSIZE`` - the maximum connections for each host, which
+  should be at least the number of threads that call a host (default 10)
+- ``APP_HTTP_CONNECT_TIMEOUT`` - the connect timeout seconds (default 3.05)
+- ``APP_HTTP_READ_TIMEOUT`` - the read timeout seconds (default 10)
+- ``APP_HTTP_CACHE_DIR`` - a directory for the response cache; the default
+  has no cache
+- ``APP_HTTP_CACHE_TTL`` - the seconds to cache a response without a
+  ``Cache-Control: max-age`` or ``Expires`` header (default 300)
+
+The async interface runs the requests in an executor with a thread for each
+connection of a pool, so concurrent requests reuse the pooled connections.
+The timeouts end by the request deadline (see :mod:`example_app.deadline`).
+The client does not retry; use :mod:`example_app.resilience` for retries.
+
+The response cache is for GET requests that opt-in with ``cache=True``, for
+responses that do not change often, like a JWKS.  It has a file for each
+URL, so it is shared by the server workers and it outlives a worker that
+is restarted.  Only ``200`` responses are cached, unless the response has
+``Cache-Control: no-store``, ``no-cache`` or ``private``.
+
+A forked process, e.g. a server worker, gets a new session, because the
+connections of the parent process must not be shared with a child.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import email.utils
+import functools
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .deadline import deadline_timeout
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("APP_HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("APP_HTTP_POOL_MAXSIZE", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("APP_HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("APP_HTTP_READ_TIMEOUT", "10"))
+HTTP_CACHE_DIR = os.getenv("APP_HTTP_CACHE_DIR")
+HTTP_CACHE_TTL = float(os.getenv("APP_HTTP_CACHE_TTL", "300"))
+
+#: the response headers that are cached with the content
+CACHED_HEADERS = ["cache-control", "content-type", "etag", "expires", "last-modified"]
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+def cache_ttl(headers: Dict, default: float = HTTP_CACHE_TTL) -> float:
+    """
+    The seconds to cache a response, from its Cache-Control and Expires
+    headers; 0 when it must not be cached
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    if re.search(r"\b(no-store|no-cache|private)\b", cache_control):
+        return 0.0
+    max_age = re.search(r"\bmax-age=(\d+)", cache_control)
+    if max_age:
+        return float(max_age.group(1))
+    expires = headers.get("expires")
+    if expires:
+        try:
+            expires_at = email.utils.parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return 0.0
+        return max(0.0, expires_at - time.time())
+    return default
+
+
+class ResponseCache:
+    """
+    A cache of GET responses, with a JSON file for each URL
+
+    :param directory: the cache directory, which is created if needed
+    :param ttl: the default seconds to cache a response
+    """
+
+    def __init__(self, directory: str, ttl: float = HTTP_CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def path(self, url: str) -> str:
+        name = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+    def get(self, url: str) -> Optional[requests.Response]:
+        """
+        :returns: a fresh cached response for the URL, or None
+        """
+        try:
+            with open(self.path(url)) as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if cached.get("url") != url or cached["expires_at"] <= time.time():
+            return None
+        response = requests.Response()
+        response.url = url
+        response.status_code = cached["status_code"]
+        response.headers = CaseInsensitiveDict(cached["headers"])
+        response.encoding = cached["encoding"]
+        response._content = cached["content"].encode("utf-8", "surrogateescape")
+        return response
+
+    def put(self, url: str, response: requests.Response) -> bool:
+        """
+        Cache a response, when it is cacheable
+
+        :param url: the URL of the request
+        :param response: the response, which can be from a redirect
+        :returns: True when the response is cached
+        """
+        if response.status_code != 200:
+            return False
+        ttl = cache_ttl(response.headers, self.ttl)
+        if ttl <= 0:
+            return False
+        cached = {
+            "url": url,
+            "status_code": response.status_code,
+            "headers": {
+                k: v for k, v in response.headers.items() if k.lower() in CACHED_HEADERS
+            },
+            "encoding": response.encoding,
+            "content": response.content.decode("utf-8", "surrogateescape"),
+            "expires_at": time.time() + ttl,
+        }
+        # write a temporary file and rename it, so that readers in other
+        # processes never get a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as cache_file:
+                json.dump(cached, cache_file)
+            os.replace(tmp_path, self.path(url))
+        except OSError as err:
+            LOGGER.warning("Failed to cache a response: %s", err)
+            os.unlink(tmp_path)
+            return False
+        return True
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                os.unlink(os.path.join(self.directory, name))
+
+
+class HttpClient:
+    """
+    A thread-safe HTTP client, with a requests session and a pool of
+    keep-alive connections for each host
+
+    :param pool_connections: the number of hosts with a connection pool
+    :param pool_maxsize: the maximum connections for each host
+    :param connect_timeout: the default connect timeout seconds
+    :param read_timeout: the default read timeout seconds
+    :param cache_dir: an optional directory for the response cache
+    :param verify: verify the TLS certificates, or a CA bundle path
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = HTTP_POOL_CONNECTIONS,
+        pool_maxsize: int = HTTP_POOL_MAXSIZE,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+        cache_dir: str = HTTP_CACHE_DIR,
+        verify: Union[bool, str] = True,
+    ):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.verify = verify
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self._session = None
+        self._session_pid = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    # a forked process does not close the connections of
+                    # the parent, it only drops them
+                    self._session = self.create_session()
+                    self._executor = None
+                    self._session_pid = pid
+        return self._session
+
+    @property
+    def executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """The threads for the async requests, which are not inherited by a fork"""
+        self.session  # a new executor after a fork
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.pool_maxsize, thread_name_prefix="http"
+                    )
+        return self._executor
+
+    def create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=0,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def timeout(self, timeout: Timeout = None) -> Timeout:
+        """
+        The timeout for a request, which ends by the request deadline
+
+        :param timeout: seconds, or (connect, read) seconds; the default is
+            the connect and read timeouts of the client
+        """
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        if isinstance(timeout, tuple):
+            return tuple(deadline_timeout(t) for t in timeout)
+        return deadline_timeout(timeout)
+
+    def request(
+        self, method: str, url: str, timeout: Timeout = None, **kwargs
+    ) -> requests.Response:
+        """
+        Send a request with the session
+
+        :param method: the HTTP method
+        :param url: the URL
+        :param timeout: seconds, or (connect, read) seconds
+        :param kwargs: the options of ``requests.Session.request``
+        """
+        timeout = self.timeout(timeout)
+        # a session.verify is replaced by a REQUESTS_CA_BUNDLE, this is not
+        kwargs.setdefault("verify", self.verify)
+        return self.session.request(method, url, timeout=timeout, **kwargs)
+
+    def get(
+        self, url: str, timeout: Timeout = None, cache: bool = False, **kwargs
+    ) -> requests.Response:
+        """
+        Send a GET request
+
+        :param url: the URL, including any query parameters when it is cached
+        :param timeout: seconds, or (connect, read) seconds
+        :param cache: use the response cache, when the client has one
+        :param kwargs: the options of ``requests.Session.request``
+        """
+        if not cache or self.cache is None:
+            return self.request("GET", url, timeout=timeout, **kwargs)
+        response = self.cache.get(url)
+        if response is not None:
+            LOGGER.debug("Cached response: %s", url)
+            return response
+        response = self.request("GET", url, timeout=timeout, **kwargs)
+        self.cache.put(url, response)
+        return response
+
+    async def async_request(
+        self, method: str, url: str, timeout: Timeout = None, **kwargs
+    ) -> requests.Response:
+        """
+        Send a request in the executor of the client, with the context of
+        the caller, e.g. the request deadline
+        """
+        func = functools.partial(self.request, method, url, timeout=timeout, **kwargs)
+        return await self._run_in_executor(func)
+
+    async def async_get(
+        self, url: str, timeout: Timeout = None, cache: bool = False, **kwargs
+    ) -> requests.Response:
+        """Send a GET request in the executor of the client, see :meth:`get`"""
+        func = functools.partial(self.get, url, timeout=timeout, cache=cache, **kwargs)
+        return await self._run_in_executor(func)
+
+    async def _run_in_executor(self, func: Callable) -> requests.Response:
+        loop = asyncio.get_event_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, context.run, func)
+
+    def close(self):
+        """Close the pooled connections, and the threads for async requests"""
+        with self._lock:
+            if self._session_pid == os.getpid():
+                if self._session is not None:
+                    self._session.close()
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+            self._session = None
+            self._executor = None
+
+
+HTTP_CLIENT = HttpClient()
@@ -0,0 +1,287 @@
+"""
+Warm-invocation Leak Detector
+=============================
+
+A diagnostic mode to find the module state that grows across warm Lambda
+invocations.  When ``APP_LEAK_DETECTOR_ENABLED`` is true, the handlers that
+are decorated with :func:`detect_leaks` start ``tracemalloc`` and take a
+snapshot after the first invocation and then every
+``APP_LEAK_SNAPSHOT_INTERVAL`` invocations.  Each snapshot is compared with
+the previous one by allocation site and the top ``APP_LEAK_TOP_N`` growers
+are logged as warnings, e.g.
+
+.. code-block::
+
+    Memory growth over 1000 invocations of handler: +524288 B, traced=2.1 MiB
+      +524288 B (+1000 blocks) example_app/aws_authorizer.py:95
+
+Tracing slows down every allocation, so only enable this to diagnose a
+leak; when it is not enabled, :func:`detect_leaks` returns the handler
+unchanged.  ``APP_LEAK_TRACE_FRAMES`` sets the traceback depth that is
+stored for each allocation (the sites are grouped by the most recent frame).
+
+In tests, use :func:`assert_bounded_growth` to replay events through a
+handler and assert that the memory retained after a warm-up is bounded.
+
+.. seealso::
+    - https://docs.python.org/3/library/tracemalloc.html
+"""
+
+import functools
+import gc
+import os
+import tracemalloc
+import uuid
+from types import SimpleNamespace
+from typing import Callable
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+LEAK_DETECTOR_ENABLED = os.getenv("APP_LEAK_DETECTOR_ENABLED", "false").lower() in [
+    "1",
+    "true",
+    "yes",
+]
+LEAK_SNAPSHOT_INTERVAL = int(os.getenv("APP_LEAK_SNAPSHOT_INTERVAL", "1000"))
+LEAK_TOP_N = int(os.getenv("APP_LEAK_TOP_N", "10"))
+LEAK_TRACE_FRAMES = int(os.getenv("APP_LEAK_TRACE_FRAMES", "1"))
+
+#: exclude the allocations of tracemalloc, the import system and this module
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+    tracemalloc.Filter(False, __file__),
+]
+
+
+class Grower(NamedTuple):
+    #: the allocation site, i.e. "filename:lineno"
+    site: str
+    #: the bytes allocated since the previous snapshot
+    size_diff: int
+    #: the memory blocks allocated since the previous snapshot
+    count_diff: int
+    #: the bytes allocated at the site
+    size: int
+
+    def __str__(self) -> str:
+        return f"{self.size_diff:+d} B ({self.count_diff:+d} blocks) {self.site}"
+
+
+class GrowthReport(NamedTuple):
+    #: the invocations after the warm-up
+    invocations: int
+    #: the bytes retained by the invocations
+    growth: int
+    #: the allocation sites that grew the most
+    growers: List[Grower]
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+
+def compare_snapshots(
+    old: tracemalloc.Snapshot, new: tracemalloc.Snapshot, top: int = LEAK_TOP_N
+) -> GrowthReport:
+    """
+    Compare snapshots by allocation site
+
+    :param old: a snapshot from :func:`take_snapshot`
+    :param new: a later snapshot from :func:`take_snapshot`
+    :param top: the number of growers to report
+    :returns: the net growth and the sites that grew the most
+    """
+    stats = new.compare_to(old, "lineno")
+    growers = [
+        Grower(
+            site=str(stat.traceback[0]),
+            size_diff=stat.size_diff,
+            count_diff=stat.count_diff,
+            size=stat.size,
+        )
+        for stat in stats
+        if stat.size_diff > 0
+    ]
+    growers.sort(key=lambda grower: grower.size_diff, reverse=True)
+    growth = sum(stat.size_diff for stat in stats)
+    return GrowthReport(invocations=0, growth=growth, growers=growers[:top])
+
+
+class LeakDetector:
+    """
+    Snapshot the traced memory every ``interval`` invocations of a handler
+
+    :param name: the name of the handler, for logs
+    :param interval: the invocations between snapshots
+    :param top: the number of growers to log
+    :param frames: the traceback depth for tracemalloc
+    """
+
+    def __init__(
+        self,
+        name: str,
+        interval: int = LEAK_SNAPSHOT_INTERVAL,
+        top: int = LEAK_TOP_N,
+        frames: int = LEAK_TRACE_FRAMES,
+    ):
+        self.name = name
+        self.interval = interval
+        self.top = top
+        self.frames = frames
+        self.invocations = 0
+        self.snapshot = None
+        self.reports = []
+        self._started = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started = True
+
+    def stop(self):
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+        self.snapshot = None
+
+    def invoked(self):
+        """
+        Count an invocation; the first invocation takes the baseline snapshot,
+        because it includes the lazy initialization of a cold start
+        """
+        self.invocations += 1
+        if self.invocations == 1:
+            self.snapshot = take_snapshot()
+        elif (self.invocations - 1) % self.interval == 0:
+            self.check()
+
+    def check(self) -> GrowthReport:
+        """Compare a new snapshot with the previous one and log the top growers"""
+        snapshot = take_snapshot()
+        report = compare_snapshots(self.snapshot, snapshot, self.top)
+        report = report._replace(invocations=self.interval)
+        self.snapshot = snapshot
+        self.reports.append(report)
+        traced, _ = tracemalloc.get_traced_memory()
+        LOGGER.warning(
+            "Memory growth over %d invocations of %s: %+d B, traced=%.1f MiB",
+            report.invocations,
+            self.name,
+            report.growth,
+            traced / 1024 / 1024,
+        )
+        for grower in report.growers:
+            LOGGER.warning("  %s", grower)
+        return report
+
+
+def detect_leaks(
+    handler: Callable,
+    enabled: bool = LEAK_DETECTOR_ENABLED,
+    interval: int = LEAK_SNAPSHOT_INTERVAL,
+    top: int = LEAK_TOP_N,
+) -> Callable:
+    """
+    Decorate a Lambda handler to log the memory growth of warm invocations
+
+    :param handler: a Lambda handler, i.e. ``handler(event, context)``
+    :param enabled: when False, the handler is returned unchanged
+    :param interval: the invocations between snapshots
+    :param top: the number of growers to log
+    :returns: the wrapped handler, with a ``leak_detector`` attribute
+    """
+    if not enabled:
+        return handler
+
+    detector = LeakDetector(
+        getattr(handler, "__name__", type(handler).__name__), interval, top
+    )
+    detector.start()
+
+    @functools.wraps(handler, updated=())
+    def wrapper(event, context):
+        try:
+            return handler(event, context)
+        finally:
+            detector.invoked()
+
+    wrapper.leak_detector = detector
+    LOGGER.info("Leak detector enabled for %s; interval=%d", detector.name, interval)
+    return wrapper
+
+
+def fake_context() -> SimpleNamespace:
+    return SimpleNamespace(aws_request_id=str(uuid.uuid4()))
+
+
+def measure_growth(
+    handler: Callable,
+    events: Iterable,
+    warmup: int = 100,
+    top: int = LEAK_TOP_N,
+    context_factory: Callable = fake_context,
+) -> GrowthReport:
+    """
+    Replay events through a handler and measure the memory it retains
+
+    Exceptions from the handler are ignored, so that error paths are also
+    checked for leaks (e.g. an authorizer raises for an invalid token).
+
+    :param handler: a Lambda handler, i.e. ``handler(event, context)``
+    :param events: the events to replay, including the warm-up events
+    :param warmup: the number of events to invoke before the baseline
+    :param top: the number of growers to report
+    :param context_factory: creates a Lambda context for each invocation
+    :returns: the growth after the warm-up
+    """
+    events = list(events)
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(LEAK_TRACE_FRAMES)
+    try:
+        for event in events[:warmup]:
+            invoke(handler, event, context_factory())
+        gc.collect()
+        baseline = take_snapshot()
+        for event in events[warmup:]:
+            invoke(handler, event, context_factory())
+        gc.collect()
+        report = compare_snapshots(baseline, take_snapshot(), top)
+    finally:
+        if started:
+            tracemalloc.stop()
+    return report._replace(invocations=len(events[warmup:]))
+
+
+def invoke(handler: Callable, event, context):
+    try:
+        handler(event, context)
+    except Exception:  # pylint: disable=broad-except
+        pass
+
+
+def assert_bounded_growth(
+    handler: Callable, events: Iterable, max_growth: int, **kwargs
+) -> GrowthReport:
+    """
+    Assert that replaying events through a handler retains at most
+    ``max_growth`` bytes; see :func:`measure_growth` for the kwargs
+
+    :raises AssertionError: with the top growers, when the growth is larger
+    """
+    report = measure_growth(handler, events, **kwargs)
+    if report.growth > max_growth:
+        growers = "\n".join(f"  {grower}" for grower in report.growers)
+        raise AssertionError(
+            f"Memory grew by {report.growth} B over {report.invocations} "
+            f"invocations (max {max_growth} B); top growers:\n{growers}"
+        )
+    return report
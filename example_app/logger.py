@@ -1,25 +1,364 @@
 """
 Custom logger
+
+The ``LOG_MODE`` env-var selects how log records are written:
+
+- ``stream`` (default) - each logger has a ``StreamHandler(sys.stdout)`` with a
+  text formatter; records are formatted and written on the calling thread.
+- ``queue`` - all loggers share a ``QueueHandler``; a background writer thread
+  formats records as JSON lines and writes them to stdout in batches.  A
+  forked process, e.g. a server worker, starts its own writer thread.
+
+Use :func:`logging_context` on Lambda handlers to add the request-id from the
+Lambda context to log records and to flush the log queue at the end of each
+invocation.  The queue is also flushed at exit.
+
+The ``LOG_LEVEL`` applies to all requests, but DEBUG logging can be enabled
+for selected requests, by:
+
+- ``LOG_DEBUG_SAMPLE_RATE`` - a fraction of requests to sample
+- ``LOG_DEBUG_HEADER`` - the name of a request header, e.g. ``X-Debug-Log: 1``
+- ``LOG_DEBUG_TRACE_SAMPLED`` - sample requests when the X-Ray trace header
+  has ``Sampled=1``
+
+The request log level is held in a contextvar that is checked by the
+``isEnabledFor`` method of the loggers from :func:`get_logger`, so debug
+calls are a cheap no-op on all other requests.
 """
+
+import atexit
+import copy
+import functools
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
 import sys
+import threading
 import time
+from contextvars import ContextVar
+from typing import Callable
+from typing import Mapping
+from typing import Optional
 
 logging.Formatter.converter = time.gmtime
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_MODE = os.environ.get("LOG_MODE", "stream").lower()
+LOG_BATCH_SIZE = int(os.environ.get("LOG_BATCH_SIZE", "100"))
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "0.0"))
+LOG_DEBUG_HEADER = os.environ.get("LOG_DEBUG_HEADER", "").lower()
+LOG_DEBUG_TRACE_SAMPLED = os.environ.get(
+    "LOG_DEBUG_TRACE_SAMPLED", "false"
+).lower() in ["1", "true", "yes"]
 LOG_FORMAT = "[%(levelname)s]  %(asctime)s.%(msecs)03dZ  %(name)s:%(funcName)s:%(lineno)d  %(message)s"
-LOG_FORMATTER = logging.Formatter(LOG_FORMAT, "%Y-%m-%dT%H:%M:%S")
+LOG_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+LOG_FORMATTER = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
+
+#: The request-id of the current invocation, see :func:`logging_context`
+REQUEST_ID = ContextVar("request_id", default=None)
+
+#: The log level of the current request, see :func:`request_log_level`
+REQUEST_LOG_LEVEL = ContextVar("request_log_level", default=None)
+
+TRUE_VALUES = ["1", "true", "yes", "on"]
+TRACE_HEADER = "x-amzn-trace-id"
+
+
+class RequestScopedLogger(logging.Logger):
+    """A Logger that is enabled for levels at or above the REQUEST_LOG_LEVEL"""
+
+    def isEnabledFor(self, level: int) -> bool:
+        request_level = REQUEST_LOG_LEVEL.get()
+        if request_level is not None and request_level <= level:
+            return not self.disabled and self.manager.disable < level
+        return super().isEnabledFor(level)
+
+
+def debug_sampling_enabled() -> bool:
+    return bool(
+        LOG_DEBUG_SAMPLE_RATE > 0 or LOG_DEBUG_HEADER or LOG_DEBUG_TRACE_SAMPLED
+    )
+
+
+def request_log_level(headers: Optional[Mapping[str, str]] = None) -> int:
+    """
+    Select the log level for a request
+
+    :param headers: optional request headers, with lower-case names
+    :returns: logging.DEBUG for a sampled request, otherwise the LOG_LEVEL
+    """
+    if headers:
+        if LOG_DEBUG_HEADER:
+            if headers.get(LOG_DEBUG_HEADER, "").lower() in TRUE_VALUES:
+                return logging.DEBUG
+        if LOG_DEBUG_TRACE_SAMPLED:
+            if "Sampled=1" in headers.get(TRACE_HEADER, ""):
+                return logging.DEBUG
+    if LOG_DEBUG_SAMPLE_RATE > 0 and random.random() < LOG_DEBUG_SAMPLE_RATE:
+        return logging.DEBUG
+    return logging.getLevelName(LOG_LEVEL)
+
+
+def event_headers(event) -> Optional[Mapping[str, str]]:
+    """The headers of an API-Gateway event, with lower-case names"""
+    if isinstance(event, dict) and isinstance(event.get("headers"), dict):
+        return {k.lower(): v for k, v in event["headers"].items()}
+    return None
+
+
+class RequestLogLevelMiddleware:
+    """
+    ASGI middleware to select a log level for each request
+
+    The log level is not changed if it was already selected for the
+    request, e.g. by :func:`logging_context` on the Lambda handler.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or REQUEST_LOG_LEVEL.get() is not None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {
+            name.decode("latin-1"): value.decode("latin-1")
+            for name, value in scope.get("headers", [])
+        }
+        token = REQUEST_LOG_LEVEL.set(request_log_level(headers))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUEST_LOG_LEVEL.reset(token)
+
+
+def add_request_log_level(app) -> bool:
+    """
+    Add the RequestLogLevelMiddleware to a FastAPI app, when it is enabled
+
+    :param app: a FastAPI app
+    :returns: True when the middleware is added
+    """
+    if not debug_sampling_enabled():
+        return False
+    app.add_middleware(RequestLogLevelMiddleware)
+    return True
+
+
+class RequestIdFilter(logging.Filter):
+    """Add the current REQUEST_ID to log records"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = REQUEST_ID.get()
+        return True
+
+
+REQUEST_ID_FILTER = RequestIdFilter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as JSON lines"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": "%s.%03dZ"
+            % (self.formatTime(record, LOG_DATE_FORMAT), record.msecs),
+            "level": record.levelname,
+            "logger": record.name,
+            "function": record.funcName,
+            "line": record.lineno,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that defers formatting to the writer thread
+
+    The message arguments are merged on the calling thread, so mutable
+    arguments are captured as they were when the record was logged, but
+    the JSON formatting and the I/O are done by the :class:`QueueLogWriter`.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = LOG_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class QueueLogWriter:
+    """
+    A background thread that writes queued log records in batches
+
+    :param stream: the output stream (default is sys.stdout)
+    :param formatter: the log formatter (default is JSON)
+    :param batch_size: the maximum number of records in one write
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        stream=None,
+        formatter: logging.Formatter = None,
+        batch_size: int = LOG_BATCH_SIZE,
+    ):
+        self.stream = stream or sys.stdout
+        self.formatter = formatter or JsonFormatter()
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.handler = LogQueueHandler(self.queue)
+        self.handler.addFilter(REQUEST_ID_FILTER)
+        self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def after_fork(self):
+        """
+        Start a writer thread in a forked child process, which only has the
+        thread that forked; the records queued by the parent are dropped,
+        because the parent writes them
+        """
+        self.queue = queue.Queue()
+        self.handler.queue = self.queue
+        self._start()
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                if record is self._STOP:
+                    stopped = True
+                    continue
+                try:
+                    lines.append(self.formatter.format(record))
+                except Exception:
+                    self.handler.handleError(record)
+            try:
+                if lines:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+            except Exception:
+                pass  # there is nowhere left to report a failed log write
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self):
+        """Block until all queued records are written"""
+        if self._thread.is_alive():
+            self.queue.join()
+
+    def stop(self):
+        """Write all queued records and stop the writer thread"""
+        if self._thread.is_alive():
+            self.queue.put(self._STOP)
+            self._thread.join()
+
+
+_QUEUE_WRITER: Optional[QueueLogWriter] = None
+_QUEUE_WRITER_LOCK = threading.Lock()
+
+
+def get_queue_writer() -> QueueLogWriter:
+    global _QUEUE_WRITER
+    with _QUEUE_WRITER_LOCK:
+        if _QUEUE_WRITER is None:
+            _QUEUE_WRITER = QueueLogWriter()
+            atexit.register(_QUEUE_WRITER.stop)
+    return _QUEUE_WRITER
+
+
+def _queue_writer_after_fork():
+    global _QUEUE_WRITER_LOCK
+    # the lock could be held by another thread of the parent at the fork
+    _QUEUE_WRITER_LOCK = threading.Lock()
+    if _QUEUE_WRITER is not None:
+        _QUEUE_WRITER.after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_queue_writer_after_fork)
+
+
+def get_stream_handler(stream=None) -> logging.Handler:
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.formatter = LOG_FORMATTER
+    handler.addFilter(REQUEST_ID_FILTER)
+    return handler
+
+
+def flush_logs():
+    """Block until all queued log records are written"""
+    if _QUEUE_WRITER is not None:
+        _QUEUE_WRITER.flush()
+
+
+def logging_context(handler: Callable) -> Callable:
+    """
+    Decorate a Lambda handler to log the request-id and flush logs
+
+    When debug sampling is enabled, this also selects the log level for
+    the invocation, using the headers of API-Gateway events.
+
+    :param handler: a Lambda handler, i.e. ``handler(event, context)``
+    :returns: the wrapped handler
+    """
+
+    @functools.wraps(handler, updated=())
+    def wrapper(event, context):
+        token = REQUEST_ID.set(getattr(context, "aws_request_id", None))
+        level_token = None
+        if debug_sampling_enabled():
+            level = request_log_level(event_headers(event))
+            level_token = REQUEST_LOG_LEVEL.set(level)
+        try:
+            return handler(event, context)
+        finally:
+            if level_token is not None:
+                REQUEST_LOG_LEVEL.reset(level_token)
+            REQUEST_ID.reset(token)
+            flush_logs()
+
+    return wrapper
 
 
 def get_logger(name) -> logging.Logger:
     logger = logging.getLogger(name)
+    if not isinstance(logger, RequestScopedLogger):
+        logger.__class__ = RequestScopedLogger
 
-    if not any(isinstance(h, logging.StreamHandler) for h in logger.handlers):
-        handler = logging.StreamHandler(sys.stdout)
-        handler.formatter = LOG_FORMATTER
-        logger.addHandler(handler)
+    log_handlers = (logging.StreamHandler, logging.handlers.QueueHandler)
+    if not any(isinstance(h, log_handlers) for h in logger.handlers):
+        if LOG_MODE == "queue":
+            logger.addHandler(get_queue_writer().handler)
+        else:
+            logger.addHandler(get_stream_handler())
 
     logger.setLevel(LOG_LEVEL)
     logger.propagate = False
@@ -1,4 +1,5 @@
 import os
+from typing import Callable
 from typing import Optional
 
 from fastapi import FastAPI
@@ -7,6 +8,13 @@ from mangum import Mangum
 from example_app.api.api_v1.api import router as api_router
 from example_app.core.config import API_V1_STR
 from example_app.core.config import PROJECT_NAME
+from example_app.deadline import add_request_deadline
+from example_app.deadline import deadline_context
+from example_app.leak_detector import detect_leaks
+from example_app.logger import add_request_log_level
+from example_app.logger import logging_context
+from example_app.profiler import add_profiler
+from example_app.rate_limit import add_rate_limiter
 from example_app.version import __version__
 
 VERSION = __version__
@@ -21,6 +29,12 @@ app.VERSION = VERSION
 
 app.include_router(api_router, prefix=API_V1_STR)
 
+add_profiler(app)
+add_request_log_level(app)
+add_request_deadline(app)
+# the last middleware is the first to handle a request
+add_rate_limiter(app)
+
 
 @app.get("/ping")
 def pong():
@@ -36,11 +50,22 @@ def pong():
     return {"ping": "pong!", "version": app.VERSION}
 
 
-def get_asgi_handler(fast_api: FastAPI) -> Optional[Mangum]:
+def create_asgi_handler(fast_api: FastAPI) -> Callable:
+    """Create an AWS Lambda ASGI handler, e.g. to invoke it in benchmarks"""
+
+    try:
+        asgi_handler = Mangum(fast_api, enable_lifespan=False)
+    except TypeError:
+        # mangum>=0.9 replaced the enable_lifespan option
+        asgi_handler = Mangum(fast_api, lifespan="off")
+    return detect_leaks(logging_context(deadline_context(asgi_handler)))
+
+
+def get_asgi_handler(fast_api: FastAPI) -> Optional[Callable]:
     """Initialize an AWS Lambda ASGI handler"""
 
     if os.getenv("AWS_EXECUTION_ENV"):
-        return Mangum(fast_api, enable_lifespan=False)
+        return create_asgi_handler(fast_api)
     return None
 
 
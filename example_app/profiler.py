@@ -0,0 +1,266 @@
+"""
+On-demand Request Profiler
+==========================
+
+An opt-in sampling profiler for production requests.  When it is enabled,
+an ASGI middleware wraps selected requests in a statistical stack sampler
+and writes the samples in the collapsed-stack format used by flame-graph
+tools, e.g.
+
+.. code-block::
+
+    flamegraph.pl /tmp/example_app_profiles/*.collapsed > profile.svg
+
+A request is profiled when:
+
+- ``APP_PROFILE_ENABLED`` is true and a random draw falls below
+  ``APP_PROFILE_SAMPLE_RATE``, or
+- ``APP_PROFILE_SECRET`` is set and the request has a valid signed
+  ``X-Profile-Token`` header (see :func:`profile_token`).
+
+When neither is configured, :func:`add_profiler` does not install the
+middleware at all, so there is no per-request overhead.
+
+A sampler is used instead of cProfile because cProfile only traces the
+thread that enables it, whereas sync routes run in a threadpool; the sampler
+walks the frames of all threads while the request is in flight.  Concurrent
+requests can appear in the same profile.
+
+The middleware is part of the ASGI app, so it also applies to the Lambda
+handler from ``example_app.main.get_asgi_handler``.
+
+.. seealso::
+    - https://github.com/brendangregg/FlameGraph
+    - https://docs.python.org/3/library/sys.html#sys._current_frames
+"""
+
+import hashlib
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+PROFILE_ENABLED = os.getenv("APP_PROFILE_ENABLED", "false").lower() in [
+    "1",
+    "true",
+    "yes",
+]
+PROFILE_SAMPLE_RATE = float(os.getenv("APP_PROFILE_SAMPLE_RATE", "0.0"))
+PROFILE_SECRET = os.getenv("APP_PROFILE_SECRET")
+PROFILE_DIR = os.getenv("APP_PROFILE_DIR", "/tmp/example_app_profiles")
+PROFILE_INTERVAL = float(os.getenv("APP_PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_BYTES = int(os.getenv("APP_PROFILE_MAX_BYTES", str(256 * 1024)))
+PROFILE_MAX_FILES = int(os.getenv("APP_PROFILE_MAX_FILES", "20"))
+
+PROFILE_HEADER = b"x-profile-token"
+PROFILE_TOKEN_MAX_AGE = 300  # seconds
+
+
+def profile_token(secret: str, method: str, path: str, timestamp: int = None) -> str:
+    """
+    Create a signed profile token for a request
+
+    The token is ``{timestamp}:{hex-hmac-sha256}``, where the HMAC signs
+    ``{timestamp}:{METHOD}:{path}``; it is valid for a few minutes.
+
+    :param secret: the value of ``APP_PROFILE_SECRET``
+    :param method: the HTTP method of the request to profile
+    :param path: the URL path of the request to profile
+    :param timestamp: an optional unix timestamp (default is now)
+    :returns: a value for the ``X-Profile-Token`` header
+    """
+    if timestamp is None:
+        timestamp = int(time.time())
+    message = f"{timestamp}:{method.upper()}:{path}".encode("utf-8")
+    digest = hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+    return f"{timestamp}:{digest}"
+
+
+def verify_profile_token(token: str, secret: str, method: str, path: str) -> bool:
+    try:
+        timestamp, _ = token.split(":", 1)
+        timestamp = int(timestamp)
+    except ValueError:
+        return False
+    if abs(time.time() - timestamp) > PROFILE_TOKEN_MAX_AGE:
+        return False
+    expected = profile_token(secret, method, path, timestamp)
+    return hmac.compare_digest(expected, token)
+
+
+class StackSampler:
+    """
+    A statistical profiler that samples the stacks of all threads
+
+    :param interval: seconds between samples
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                self.samples[self.collapse(frame)] += 1
+
+    @staticmethod
+    def collapse(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            filename = os.path.basename(code.co_filename)
+            stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def collapsed_lines(self, max_bytes: int = PROFILE_MAX_BYTES) -> List[str]:
+        """
+        The collapsed stacks, most frequent first, truncated to ``max_bytes``
+        """
+        lines = []
+        size = 0
+        for stack, count in self.samples.most_common():
+            line = f"{stack} {count}\n"
+            size += len(line)
+            if size > max_bytes:
+                break
+            lines.append(line)
+        return lines
+
+
+class ProfileWriter:
+    """
+    Write profiles to a directory with a size cap and rotation
+
+    :param profile_dir: where to write ``*.collapsed`` files
+    :param max_bytes: the size cap for each profile file
+    :param max_files: the oldest files are removed beyond this limit
+    """
+
+    def __init__(
+        self,
+        profile_dir: str = PROFILE_DIR,
+        max_bytes: int = PROFILE_MAX_BYTES,
+        max_files: int = PROFILE_MAX_FILES,
+    ):
+        self.profile_dir = Path(profile_dir)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+
+    def write(self, sampler: StackSampler, method: str, path: str) -> Path:
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^a-zA-Z0-9]+", "_", path).strip("_") or "root"
+        name = f"{time.time():.6f}-{method.lower()}-{slug}-{uuid.uuid4().hex[:8]}"
+        profile_path = self.profile_dir / f"{name}.collapsed"
+        profile_path.write_text("".join(sampler.collapsed_lines(self.max_bytes)))
+        self.rotate()
+        return profile_path
+
+    def rotate(self):
+        profiles = sorted(self.profile_dir.glob("*.collapsed"))
+        for profile_path in profiles[: max(0, len(profiles) - self.max_files)]:
+            try:
+                profile_path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware to profile sampled or signed requests
+
+    :param app: an ASGI application
+    :param sample_rate: the fraction of requests to profile
+    :param secret: a secret for signed ``X-Profile-Token`` headers
+    :param writer: a ProfileWriter for the profile output
+    """
+
+    def __init__(
+        self,
+        app,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        secret: Optional[str] = PROFILE_SECRET,
+        writer: ProfileWriter = None,
+    ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.writer = writer or ProfileWriter()
+
+    def should_profile(self, scope: Dict) -> bool:
+        if self.secret:
+            for name, value in scope.get("headers", []):
+                if name == PROFILE_HEADER:
+                    return verify_profile_token(
+                        value.decode("latin-1"),
+                        self.secret,
+                        scope["method"],
+                        scope["path"],
+                    )
+        return random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            sampler.stop()
+            try:
+                profile_path = self.writer.write(
+                    sampler, scope["method"], scope["path"]
+                )
+                LOGGER.info("Request profile: %s", profile_path)
+            except OSError as err:
+                LOGGER.error("Request profile failed: %s", err)
+
+
+def add_profiler(app) -> bool:
+    """
+    Add the ProfilerMiddleware to a FastAPI app, when it is enabled
+
+    :param app: a FastAPI app
+    :returns: True when the middleware is added
+    """
+    sample_rate = PROFILE_SAMPLE_RATE if PROFILE_ENABLED else 0.0
+    if sample_rate <= 0 and not PROFILE_SECRET:
+        return False
+    app.add_middleware(
+        ProfilerMiddleware, sample_rate=sample_rate, secret=PROFILE_SECRET
+    )
+    LOGGER.info("Request profiler enabled; sample_rate=%s", sample_rate)
+    return True
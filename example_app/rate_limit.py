@@ -0,0 +1,244 @@
+"""
+Admission Control
+=================
+
+An ASGI middleware that limits the request rate of each client with token
+buckets, so that one noisy client cannot use all the function concurrency.
+A client is the authenticated principal from the API-Gateway authorizer
+context, when there is one, or the source IP of the request.
+
+A bucket has ``burst`` tokens and it refills at ``rate`` tokens per second;
+a request takes a token or it is rejected with a ``429 Too Many Requests``
+response and a ``Retry-After`` header.  Each client has a bucket for the
+default limit, and a bucket for each route that has its own limit.
+
+The limits are configured with:
+
+- ``APP_RATE_LIMIT_ENABLED`` - add the middleware to the app
+- ``APP_RATE_LIMIT_RATE``, ``APP_RATE_LIMIT_BURST`` - the default limit
+- ``APP_RATE_LIMIT_ROUTES`` - limits for path prefixes, where the longest
+  prefix applies, e.g. ``/api/v1/example=5:10,/ping=0``; a rate of 0 means
+  the route is not limited
+- ``APP_RATE_LIMIT_MAX_KEYS`` - the maximum number of buckets
+- ``APP_RATE_LIMIT_SHARED`` - share the buckets between the server workers,
+  in a shared-memory cache (this also needs ``APP_SHARED_CACHE_DIR``)
+
+The buckets are kept in a cache from :func:`example_app.cache.create_cache`,
+so the state is bounded (LRU) and a bucket expires when it would be full
+again, which is the same as a new bucket.  Each request is one O(1) cache
+update.  When the middleware is not enabled, :func:`add_rate_limiter` does
+not install it, so there is no per-request overhead.
+
+Note that in a Lambda function, each concurrent execution environment has
+its own buckets, so the limits apply to each environment.
+"""
+
+import math
+import os
+import time
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from .cache import create_cache
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("APP_RATE_LIMIT_ENABLED", "false").lower() in [
+    "1",
+    "true",
+    "yes",
+]
+RATE_LIMIT_RATE = float(os.getenv("APP_RATE_LIMIT_RATE", "10"))
+RATE_LIMIT_BURST = float(os.getenv("APP_RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_ROUTES = os.getenv("APP_RATE_LIMIT_ROUTES", "")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("APP_RATE_LIMIT_MAX_KEYS", "10000"))
+RATE_LIMIT_SHARED = os.getenv("APP_RATE_LIMIT_SHARED", "false").lower() in [
+    "1",
+    "true",
+    "yes",
+]
+
+#: a bucket is (tokens, updated at)
+Bucket = Tuple[float, float]
+
+
+class RateLimit(NamedTuple):
+    #: tokens per second; 0 is not limited
+    rate: float
+    #: the bucket size, i.e. the requests allowed in a burst
+    burst: float
+
+    @property
+    def refill_seconds(self) -> float:
+        return self.burst / self.rate
+
+
+def parse_route_limits(routes: str) -> Dict[str, RateLimit]:
+    """
+    :param routes: e.g. "/api/v1/example=5:10,/ping=0"
+    :returns: the rate limits for path prefixes
+    """
+    limits = {}
+    for route in routes.split(","):
+        if not route.strip():
+            continue
+        prefix, _, limit = route.strip().partition("=")
+        rate, _, burst = limit.partition(":")
+        rate = float(rate)
+        limits[prefix] = RateLimit(rate, float(burst) if burst else max(1.0, rate))
+    return limits
+
+
+def take_token(bucket: Optional[Bucket], limit: RateLimit, now: float):
+    """
+    Take a token from a bucket
+
+    :param bucket: the bucket, or None for a new (full) bucket
+    :param limit: the rate limit of the bucket
+    :param now: the time in seconds
+    :returns: (bucket, retry_after), where retry_after is 0 when a token was
+        taken, or the seconds until a token is available
+    """
+    if bucket is None:
+        tokens = limit.burst
+    else:
+        tokens, updated_at = bucket
+        elapsed = max(0.0, now - updated_at)
+        tokens = min(limit.burst, tokens + elapsed * limit.rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0.0
+    return (tokens, now), (1 - tokens) / limit.rate
+
+
+def request_principal(scope: Dict) -> str:
+    """
+    The key of the client of a request, i.e. the authorizer principal of an
+    API-Gateway event, or the source IP
+    """
+    event = scope.get("aws.event")
+    if isinstance(event, dict):
+        authorizer = (event.get("requestContext") or {}).get("authorizer") or {}
+        principal = authorizer.get("principalId")
+        if not principal:
+            # an HTTP API (v2) JWT or lambda authorizer
+            claims = (authorizer.get("jwt") or {}).get("claims") or {}
+            principal = claims.get("username") or claims.get("sub")
+        if not principal:
+            principal = (authorizer.get("lambda") or {}).get("principalId")
+        if principal:
+            return f"principal:{principal}"
+    client = scope.get("client")
+    if client:
+        return f"ip:{client[0]}"
+    return "anonymous"
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware to limit the request rate of each client
+
+    :param app: an ASGI application
+    :param rate: the default tokens per second
+    :param burst: the default bucket size
+    :param routes: rate limits for path prefixes
+    :param buckets: a cache for the buckets, with an ``update`` method
+    :param key_func: gets the client key for an ASGI scope
+    """
+
+    def __init__(
+        self,
+        app,
+        rate: float = RATE_LIMIT_RATE,
+        burst: float = RATE_LIMIT_BURST,
+        routes: Dict[str, RateLimit] = None,
+        buckets=None,
+        key_func: Callable[[Dict], str] = request_principal,
+    ):
+        self.app = app
+        self.limit = RateLimit(rate, burst)
+        self.routes: List[Tuple[str, RateLimit]] = sorted(
+            (routes or {}).items(), key=lambda route: len(route[0]), reverse=True
+        )
+        if buckets is None:
+            buckets = create_cache(
+                "rate_limit", max_size=RATE_LIMIT_MAX_KEYS, shared_dir=None
+            )
+        self.buckets = buckets
+        self.key_func = key_func
+
+    def route_limit(self, path: str) -> Tuple[str, RateLimit]:
+        """The path prefix and rate limit for a path"""
+        for prefix, limit in self.routes:
+            if path.startswith(prefix):
+                return prefix, limit
+        return "", self.limit
+
+    def admit(self, scope: Dict) -> float:
+        """
+        :returns: 0 when the request is admitted, or the seconds to retry after
+        """
+        prefix, limit = self.route_limit(scope["path"])
+        if limit.rate <= 0:
+            return 0.0
+        key = (self.key_func(scope), prefix)
+        now = time.time()
+        return self.buckets.update(
+            key,
+            lambda bucket: take_token(bucket, limit, now),
+            ttl=limit.refill_seconds,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = self.admit(scope)
+        if not retry_after:
+            await self.app(scope, receive, send)
+            return
+
+        LOGGER.info("Rate limited: %s %s", self.key_func(scope), scope["path"])
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(math.ceil(retry_after)).encode()),
+                ],
+            }
+        )
+        await send(
+            {"type": "http.response.body", "body": b'{"detail":"Too Many Requests"}'}
+        )
+
+
+def add_rate_limiter(app) -> bool:
+    """
+    Add the RateLimitMiddleware to a FastAPI app, when it is enabled
+
+    :param app: a FastAPI app
+    :returns: True when the middleware is added
+    """
+    if not RATE_LIMIT_ENABLED:
+        return False
+    buckets = None
+    if RATE_LIMIT_SHARED:
+        buckets = create_cache("rate_limit", max_size=RATE_LIMIT_MAX_KEYS)
+    app.add_middleware(
+        RateLimitMiddleware,
+        rate=RATE_LIMIT_RATE,
+        burst=RATE_LIMIT_BURST,
+        routes=parse_route_limits(RATE_LIMIT_ROUTES),
+        buckets=buckets,
+    )
+    LOGGER.info(
+        "Rate limiter enabled; rate=%s, burst=%s", RATE_LIMIT_RATE, RATE_LIMIT_BURST
+    )
+    return True
@@ -0,0 +1,394 @@
+"""
+Resilience
+==========
+
+Circuit breakers, retries and hedged requests for the calls to external
+dependencies, e.g. the Cognito JWKS and Secrets Manager, so that a brief
+outage of a dependency does not make every invocation hang or fail.
+
+.. code-block::
+
+    from example_app.resilience import resilient
+
+    @resilient("jwks", hedge_delay=0.2)
+    def fetch_jwks(uri: str) -> Dict:
+        response = requests.get(uri, timeout=deadline_timeout(5.0))
+        response.raise_for_status()
+        return response.json()
+
+    fetch_jwks.breaker.stats()  # the breaker state and counts
+
+A call to a dependency:
+
+- is rejected with :class:`CircuitOpenError` while the circuit breaker of
+  the dependency is open, i.e. after ``APP_BREAKER_FAILURES`` consecutive
+  transient failures, until ``APP_BREAKER_RESET_TIMEOUT`` seconds have
+  passed; then one trial call is allowed (half-open), which closes the
+  breaker when it succeeds, or opens it again when it fails
+- is retried up to ``APP_RETRY_ATTEMPTS`` attempts for transient errors,
+  with an exponential backoff and full jitter, i.e. a random delay up to
+  ``min(APP_RETRY_MAX_DELAY, APP_RETRY_BASE_DELAY * 2 ** attempt)``; there
+  is no retry when the delay would pass the request deadline (see
+  :mod:`example_app.deadline`)
+- is optionally hedged: when an attempt has not completed after a hedge
+  delay, a second attempt is started and the first result is used; only
+  hedge idempotent calls, because both attempts can complete
+
+Transient errors are connection errors, timeouts, throttling and server
+(5xx) errors, see :func:`is_transient`.  Other errors, e.g. a missing
+secret, are raised without a retry and they are not failures of the
+dependency.  The breakers are process-wide and :func:`breaker_stats` has
+the metrics of all of them; the state changes are logged.
+"""
+
+import concurrent.futures
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import NamedTuple
+
+import requests
+from botocore.exceptions import ClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+from botocore.exceptions import HTTPClientError
+
+from .deadline import DeadlineExceeded
+from .deadline import remaining_time
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+BREAKER_FAILURES = int(os.getenv("APP_BREAKER_FAILURES", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("APP_BREAKER_RESET_TIMEOUT", "30"))
+RETRY_ATTEMPTS = int(os.getenv("APP_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("APP_RETRY_BASE_DELAY", "0.1"))
+RETRY_MAX_DELAY = float(os.getenv("APP_RETRY_MAX_DELAY", "2"))
+HEDGE_WORKERS = int(os.getenv("APP_HEDGE_WORKERS", "4"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+#: the error codes of AWS throttling errors, which are transient
+THROTTLING_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "SlowDown",
+}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_transient(err: BaseException) -> bool:
+    """
+    :returns: True for an error that a retry could resolve, which is also
+        a failure of the dependency for its circuit breaker
+    """
+    if isinstance(err, (DeadlineExceeded, CircuitOpenError)):
+        return False
+    if isinstance(err, requests.HTTPError):
+        status = err.response.status_code if err.response is not None else 0
+        return status >= 500 or status == 429
+    if isinstance(err, ClientError):
+        status = err.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        code = err.response.get("Error", {}).get("Code")
+        return status >= 500 or code in THROTTLING_CODES
+    return isinstance(
+        err,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            BotoConnectionError,
+            HTTPClientError,
+            ConnectionError,
+            TimeoutError,
+        ),
+    )
+
+
+class BreakerStats(NamedTuple):
+    """
+    :param state: "closed", "open" or "half_open"
+    :param failures: the consecutive transient failures
+    :param successes: the number of successful calls
+    :param rejections: the number of calls rejected while the breaker is open
+    :param opened: the number of times the breaker opened
+    """
+
+    state: str
+    failures: int
+    successes: int
+    rejections: int
+    opened: int
+
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker for a dependency
+
+    :param name: the name of the dependency
+    :param failure_threshold: the consecutive failures that open the breaker
+    :param reset_timeout: the seconds until an open breaker allows a trial call
+    :param clock: a monotonic clock, e.g. a fake clock for tests
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURES,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.successes = 0
+        self.rejections = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial = False  # a half-open trial call is in progress
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        :returns: True when a call is allowed; an allowed call must end with
+            record_success, record_failure or release
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if self.clock() - self._opened_at < self.reset_timeout:
+                    self.rejections += 1
+                    return False
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._trial:
+                    self.rejections += 1
+                    return False
+                self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self.failures = 0
+            self._trial = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                self._opened_at = self.clock()
+                self._set_state(OPEN)
+
+    def release(self):
+        """End an allowed call without a result, e.g. for a client error"""
+        with self._lock:
+            self._trial = False
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            LOGGER.warning(
+                "Circuit breaker %s is %s (%d failures)",
+                self.name,
+                state,
+                self.failures,
+            )
+        self.state = state
+
+    def stats(self) -> BreakerStats:
+        with self._lock:
+            return BreakerStats(
+                self.state, self.failures, self.successes, self.rejections, self.opened
+            )
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = self.successes = self.rejections = self.opened = 0
+            self._trial = False
+
+
+CIRCUIT_BREAKERS: Dict[str, CircuitBreaker] = {}
+_CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+
+def circuit_breaker(name: str) -> CircuitBreaker:
+    """Get or create the process-wide circuit breaker for a dependency"""
+    breaker = CIRCUIT_BREAKERS.get(name)
+    if breaker is None:
+        with _CIRCUIT_BREAKERS_LOCK:
+            breaker = CIRCUIT_BREAKERS.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def breaker_stats() -> Dict[str, BreakerStats]:
+    """The metrics of all the circuit breakers, by dependency name"""
+    return {name: breaker.stats() for name, breaker in list(CIRCUIT_BREAKERS.items())}
+
+
+class RetryPolicy(NamedTuple):
+    """
+    :param attempts: the maximum attempts, including the first call
+    :param base_delay: the seconds of the backoff for the first retry
+    :param max_delay: the maximum seconds of the backoff
+    """
+
+    attempts: int = RETRY_ATTEMPTS
+    base_delay: float = RETRY_BASE_DELAY
+    max_delay: float = RETRY_MAX_DELAY
+
+    def delay(self, attempt: int, rng: random.Random = None) -> float:
+        """
+        The backoff with full jitter before a retry
+
+        :param attempt: the number of the failed attempt, from 0
+        :param rng: an optional random generator
+        """
+        cap = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return (rng or random).uniform(0, cap)
+
+
+_HEDGE_EXECUTOR: concurrent.futures.ThreadPoolExecutor = None
+_HEDGE_EXECUTOR_LOCK = threading.Lock()
+
+
+def hedge_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _HEDGE_EXECUTOR
+    if _HEDGE_EXECUTOR is None:
+        with _HEDGE_EXECUTOR_LOCK:
+            if _HEDGE_EXECUTOR is None:
+                _HEDGE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=HEDGE_WORKERS, thread_name_prefix="hedge"
+                )
+    return _HEDGE_EXECUTOR
+
+
+def hedged_call(func: Callable[[], Any], delay: float) -> Any:
+    """
+    Call a function, and call it again when it has not completed after a
+    delay; the first result is returned, or the error of the last attempt
+    when both fail.  The attempts run in the hedge executor, with the
+    context of the caller, e.g. the request deadline.
+
+    :param func: an idempotent function without arguments
+    :param delay: the seconds before the hedged attempt
+    """
+    executor = hedge_executor()
+    first = executor.submit(contextvars.copy_context().run, func)
+    done, _ = concurrent.futures.wait([first], timeout=delay)
+    if done:
+        return first.result()
+    LOGGER.debug("Hedged a call after %ss", delay)
+    pending = {first, executor.submit(contextvars.copy_context().run, func)}
+    error = None
+    while pending:
+        done, pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def resilient_call(
+    func: Callable[[], Any],
+    breaker: CircuitBreaker = None,
+    retry: RetryPolicy = RetryPolicy(),
+    transient: Callable[[BaseException], bool] = is_transient,
+    hedge_delay: float = 0.0,
+) -> Any:
+    """
+    Call a dependency with a circuit breaker, retries and optional hedging
+
+    :param func: a function without arguments that calls the dependency
+    :param breaker: an optional circuit breaker of the dependency
+    :param retry: the retry policy
+    :param transient: whether an error is transient, i.e. a failure of the
+        dependency that is retried
+    :param hedge_delay: the seconds before a hedged attempt; 0 to disable
+    :raises CircuitOpenError: when the breaker does not allow a call
+    """
+    for attempt in range(max(1, retry.attempts)):
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(f"The circuit breaker is open: {breaker.name}")
+        try:
+            if hedge_delay > 0:
+                result = hedged_call(func, hedge_delay)
+            else:
+                result = func()
+        except Exception as err:
+            if not transient(err):
+                if breaker is not None:
+                    breaker.release()
+                raise
+            if breaker is not None:
+                breaker.record_failure()
+                if breaker.state == OPEN:
+                    raise
+            if attempt + 1 >= retry.attempts:
+                raise
+            delay = retry.delay(attempt)
+            remaining = remaining_time()
+            if remaining is not None and delay >= remaining:
+                raise
+            LOGGER.info("Retry in %.3fs after: %r", delay, err)
+            time.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+def resilient(
+    name: str,
+    retry: RetryPolicy = RetryPolicy(),
+    transient: Callable[[BaseException], bool] = is_transient,
+    hedge_delay: float = 0.0,
+) -> Callable:
+    """
+    Decorate a function that calls a dependency, see :func:`resilient_call`;
+    the wrapped function has the ``breaker`` of the dependency.
+
+    :param name: the name of the dependency, for its circuit breaker
+    """
+
+    def decorator(func: Callable) -> Callable:
+        breaker = circuit_breaker(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return resilient_call(
+                lambda: func(*args, **kwargs),
+                breaker=breaker,
+                retry=retry,
+                transient=transient,
+                hedge_delay=hedge_delay,
+            )
+
+        wrapper.breaker = breaker
+        return wrapper
+
+    return decorator
@@ -0,0 +1,342 @@
+"""
+Multi-worker Server
+===================
+
+A production entry point to serve the app in a container, on all the CPUs
+it is allowed to use:
+
+.. code-block::
+
+    python -m example_app.server --port 8000
+
+The supervisor process:
+
+- picks the number of workers from the CPU quota of the container's cgroup
+  (v2 ``cpu.max`` or v1 ``cpu.cfs_quota_us``) and the CPU affinity, unless
+  ``APP_SERVER_WORKERS`` (or ``--workers``) is set
+- preloads ``example_app.main.app`` (and the Cognito JWKS, when a pool is
+  configured), then calls ``gc.freeze`` before it forks the workers, so the
+  imported modules are shared as copy-on-write memory and the garbage
+  collector of a worker does not touch (and copy) the pages of the preloaded
+  objects
+- binds the listening socket once; all the workers accept connections on it
+- restarts a worker that exits, e.g. after ``APP_SERVER_MAX_REQUESTS``
+  requests, which recycles the workers to bound any memory growth
+- on ``SIGHUP``, replaces the workers one at a time; on ``SIGTERM`` or
+  ``SIGINT``, stops the workers gracefully and kills any worker that is
+  still running after ``APP_SERVER_GRACEFUL_TIMEOUT`` seconds
+
+Each worker runs a uvicorn server, with uvloop and httptools when they are
+installed.
+
+.. seealso::
+    - https://docs.python.org/3/library/gc.html#gc.freeze
+    - https://www.kernel.org/doc/Documentation/scheduler/sched-bwc.txt
+"""
+
+import argparse
+import gc
+import math
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from .logger import flush_logs
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+SERVER_HOST = os.getenv("APP_SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("APP_SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("APP_SERVER_WORKERS", "0"))
+SERVER_MAX_REQUESTS = int(os.getenv("APP_SERVER_MAX_REQUESTS", "0"))
+SERVER_GRACEFUL_TIMEOUT = float(os.getenv("APP_SERVER_GRACEFUL_TIMEOUT", "30"))
+SERVER_BACKLOG = int(os.getenv("APP_SERVER_BACKLOG", "2048"))
+
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_CPU_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_CPU_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+def read_text(path: str) -> str:
+    with open(path) as text_file:
+        return text_file.read().strip()
+
+
+def cpu_quota(
+    cpu_max: str = CGROUP_V2_CPU_MAX,
+    quota_path: str = CGROUP_V1_CPU_QUOTA,
+    period_path: str = CGROUP_V1_CPU_PERIOD,
+) -> Optional[float]:
+    """
+    The CPU quota of the cgroup, e.g. 1.5 for ``docker run --cpus 1.5``
+
+    :returns: the quota in CPUs, or None when there is no quota
+    """
+    try:
+        quota, period = read_text(cpu_max).split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int(read_text(quota_path))
+        period = int(read_text(period_path))
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def worker_count(workers: int = SERVER_WORKERS) -> int:
+    """
+    :param workers: an explicit number of workers; 0 to use the CPU limits
+    :returns: the number of workers for the CPUs this process can use
+    """
+    if workers > 0:
+        return workers
+    cpus = available_cpus()
+    quota = cpu_quota()
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+def event_loop() -> str:
+    try:
+        import uvloop  # noqa: F401 pylint: disable=C0415,W0611
+
+        return "uvloop"
+    except ImportError:
+        return "asyncio"
+
+
+def http_protocol() -> str:
+    try:
+        import httptools  # noqa: F401 pylint: disable=C0415,W0611
+
+        return "httptools"
+    except ImportError:
+        return "h11"
+
+
+def preload():
+    """
+    Import the app and fetch the JWKS in the supervisor, to share them
+    with the workers as copy-on-write memory
+    """
+    from .main import app  # pylint: disable=C0415
+    from .aws_authorizer import COGNITO_POOL  # pylint: disable=C0415
+
+    if COGNITO_POOL.id:
+        try:
+            assert COGNITO_POOL.jwks
+        except Exception as err:  # pylint: disable=broad-except
+            # the workers fetch it on demand
+            LOGGER.warning("Failed to preload the JWKS: %s", err)
+
+    # move the preloaded objects to a permanent generation, so that
+    # collections in the workers do not write to their pages
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+def bind_socket(host: str, port: int, backlog: int = SERVER_BACKLOG) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # accepted sockets inherit TCP_NODELAY, so small responses are not
+    # delayed by Nagle's algorithm waiting for a delayed ACK
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """
+    Fork and supervise uvicorn workers that share a listening socket
+
+    :param app: an ASGI app, preloaded in this process
+    :param sock: a bound, listening socket
+    :param workers: the number of workers
+    :param max_requests: restart a worker after this many requests; 0 to disable
+    :param graceful_timeout: seconds to wait for a worker to stop
+    """
+
+    def __init__(
+        self,
+        app,
+        sock: socket.socket,
+        workers: int,
+        max_requests: int = SERVER_MAX_REQUESTS,
+        graceful_timeout: float = SERVER_GRACEFUL_TIMEOUT,
+    ):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.pids: Dict[int, float] = {}
+        self._stopping = False
+        self._reload = False
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = time.monotonic()
+            LOGGER.info("Started worker %d", pid)
+            return pid
+        # the worker process
+        exit_code = 0
+        try:
+            for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            self.serve()
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.error("Worker %d failed: %s", os.getpid(), err)
+            exit_code = 1
+        finally:
+            # os._exit does not run the atexit flush of the log queue
+            flush_logs()
+            os._exit(exit_code)  # pylint: disable=protected-access
+
+    def serve(self):
+        import uvicorn  # pylint: disable=C0415
+
+        config = uvicorn.Config(
+            self.app,
+            loop=event_loop(),
+            http=http_protocol(),
+            lifespan="auto",
+            access_log=False,
+            limit_max_requests=self.max_requests or None,
+        )
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def reap(self) -> List[int]:
+        """Collect the workers that exited"""
+        exited = []
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if self.pids.pop(pid, None) is not None:
+                LOGGER.info("Worker %d exited with status %d", pid, status)
+                exited.append(pid)
+        return exited
+
+    def stop_worker(self, pid: int, timeout: float) -> bool:
+        """
+        :returns: True when the worker stopped within the timeout
+        """
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + timeout
+        while pid in self.pids and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        if pid in self.pids:
+            LOGGER.warning("Killing worker %d after %ss", pid, timeout)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            os.waitpid(pid, 0)
+            self.pids.pop(pid, None)
+            return False
+        return True
+
+    def restart_workers(self):
+        """Replace the workers one at a time, so some are always serving"""
+        for pid in list(self.pids):
+            self.spawn()
+            self.stop_worker(pid, self.graceful_timeout)
+
+    def stop(self):
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.pids and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in list(self.pids):
+            self.stop_worker(pid, 0)
+
+    def handle_stop(self, signum, frame):  # pylint: disable=unused-argument
+        self._stopping = True
+
+    def handle_reload(self, signum, frame):  # pylint: disable=unused-argument
+        self._reload = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        LOGGER.info(
+            "Starting %d workers; loop=%s, http=%s",
+            self.workers,
+            event_loop(),
+            http_protocol(),
+        )
+        for _ in range(self.workers):
+            self.spawn()
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                LOGGER.info("Restarting the workers")
+                self.restart_workers()
+            self.reap()
+            while len(self.pids) < self.workers and not self._stopping:
+                self.spawn()
+            time.sleep(0.1)
+        LOGGER.info("Stopping the workers")
+        self.stop()
+        self.sock.close()
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the app with workers")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=SERVER_WORKERS,
+        help="the number of workers; the default is the CPU limit",
+    )
+    args = parser.parse_args(argv)
+
+    app = preload()
+    sock = bind_socket(args.host, args.port)
+    LOGGER.info("Listening on %s:%d", args.host, args.port)
+    Supervisor(app, sock, worker_count(args.workers)).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
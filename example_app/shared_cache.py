@@ -0,0 +1,406 @@
+"""
+Shared-memory Cache
+-------------------
+
+A TTL cache in a memory-mapped file, shared by all the processes that open
+the same file, e.g. the workers of ``example_app.server``.  It has the same
+interface as :class:`example_app.cache.TTLCache`, so a cache from
+:func:`example_app.cache.create_cache` is a shared cache when
+``APP_SHARED_CACHE_DIR`` is set (use a tmpfs, like ``/dev/shm``).
+
+.. code-block::
+
+    cache = SharedCache("/dev/shm/example_app/auth.cache", slots=1024, ttl=300)
+    cache.put(("jwks", uri), jwks)
+    jwks = cache.get(("jwks", uri))
+
+The file has a header and a fixed number of fixed-size slots.  The slots
+are grouped in sets of ``ways`` slots, and a key hashes to one set (a
+set-associative cache, like a CPU cache):
+
+- a ``get`` scans the slots of its set and updates the last-used time of
+  the slot it hits
+- a ``put`` writes to the slot of the same key, an empty or expired slot,
+  or evicts the least recently used slot of the set (so the eviction is
+  LRU within a set, not for the whole cache)
+
+Each set is locked with a POSIX record lock (``fcntl.lockf``) on its byte
+range, so processes only contend for the same set; record locks do not
+exclude the threads of a process, so a thread lock is also used.  A slot is
+updated by clearing its key hash, writing the data and then writing the
+hash, so a process that dies in a write leaves an empty slot.
+
+Keys and values are JSON; keys should be simple values (str, int or
+tuples of them), so that equal keys have equal JSON, and tuples are lists
+in the cached values.  A key or a value that is not JSON, e.g. a Decimal
+or a datetime, or a value that does not fit in a slot, is not cached.
+As with the in-process cache, only cache data that any process can trust,
+never per-request state.  The hit and miss stats are for this process.
+
+The cache must only be writable by the user of the processes, because the
+cached values are trusted, e.g. the verified claims of a token: the
+directory of the file is created with mode 0700, the file with mode 0600,
+and a directory or a file that another user can access, or a symlink, is
+refused with a ``PermissionError``.
+"""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import stat
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from .cache import CacheStats
+from .logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+MAGIC = b"EXSHMC02"
+#: magic, slots, slot_size, ways
+HEADER = struct.Struct("<8sIII")
+HEADER_SIZE = 64
+#: key hash, expires at, last used, key length, value length
+SLOT_HEADER = struct.Struct("<QddII")
+
+
+def dumps(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), sort_keys=True).encode()
+
+
+def loads(data: bytes) -> Any:
+    return json.loads(data)
+
+
+def load_key(data: bytes) -> Hashable:
+    """A key from its JSON, with tuples for the lists"""
+
+    def to_tuple(value):
+        if isinstance(value, list):
+            return tuple(to_tuple(item) for item in value)
+        return value
+
+    return to_tuple(json.loads(data))
+
+
+def private_directory(directory: str):
+    """
+    Create a directory that only the user can access, or check that an
+    existing directory is one
+
+    :raises PermissionError: for a symlink, or a directory of another user
+        or that the group or others can access
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"The shared cache directory is not owned: {directory}")
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        raise PermissionError(f"The shared cache directory is not private: {directory}")
+
+
+def open_private_file(path: str) -> int:
+    """
+    Open or create a file that only the user can access, without following
+    a symlink
+
+    :returns: the file descriptor
+    :raises PermissionError: for a file of another user, or that is not 0600
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW | os.O_CLOEXEC, 0o600)
+    st = os.fstat(fd)
+    if (
+        not stat.S_ISREG(st.st_mode)
+        or st.st_uid != os.getuid()
+        or stat.S_IMODE(st.st_mode) != 0o600
+    ):
+        os.close(fd)
+        raise PermissionError(f"The shared cache file is not private: {path}")
+    return fd
+
+
+class SharedCache:
+    """
+    A TTL cache in a memory-mapped file, shared by processes
+
+    :param path: the cache file; it is created or re-initialized when it
+        does not match the slots, slot_size and ways, and its directory is
+        created when it does not exist
+    :param slots: the number of slots, i.e. the maximum number of values
+    :param slot_size: the bytes for each slot, including the JSON key and value
+    :param ttl: the default seconds to cache a value
+    :param ways: the number of slots in each set
+    """
+
+    def __init__(
+        self,
+        path: str,
+        slots: int = 1024,
+        slot_size: int = 4096,
+        ttl: float = 60.0,
+        ways: int = 16,
+    ):
+        self.path = path
+        self.ways = min(ways, slots)
+        self.sets = max(1, slots // self.ways)
+        self.slots = self.sets * self.ways
+        self.slot_size = slot_size
+        self.max_size = self.slots
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        private_directory(os.path.dirname(os.path.abspath(path)))
+        self._fd = open_private_file(path)
+        self._size = HEADER_SIZE + self.slots * self.slot_size
+        self._init_file()
+        self._map = mmap.mmap(self._fd, self._size)
+
+    def _init_file(self):
+        header = HEADER.pack(MAGIC, self.slots, self.slot_size, self.ways)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+        try:
+            current = os.pread(self._fd, HEADER.size, 0)
+            if current != header or os.fstat(self._fd).st_size != self._size:
+                LOGGER.info("Initializing the shared cache: %s", self.path)
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self._size)
+                os.pwrite(self._fd, header, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    def _key(self, key: Hashable) -> Tuple[bytes, int, int]:
+        """
+        :returns: the JSON key, a hash and the set index of the key
+        """
+        key_bytes = dumps(key)
+        digest = hashlib.blake2b(key_bytes, digest_size=8).digest()
+        key_hash = int.from_bytes(digest, "little")
+        # a zero hash is an empty slot; the set index is from the other bits
+        return key_bytes, key_hash | 1, (key_hash >> 1) % self.sets
+
+    def _offset(self, set_index: int, way: int = 0) -> int:
+        return HEADER_SIZE + (set_index * self.ways + way) * self.slot_size
+
+    @contextmanager
+    def _locked(self, set_index: int):
+        length = self.ways * self.slot_size
+        start = self._offset(set_index)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def _find(self, set_index: int, key_hash: int, key_bytes: bytes) -> Optional[int]:
+        for way in range(self.ways):
+            offset = self._offset(set_index, way)
+            slot_hash, _, _, key_len, _ = SLOT_HEADER.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                start = offset + SLOT_HEADER.size
+                if self._map[start : start + key_len] == key_bytes:
+                    return offset
+        return None
+
+    def _clear(self, offset: int):
+        SLOT_HEADER.pack_into(self._map, offset, 0, 0.0, 0.0, 0, 0)
+
+    def __len__(self) -> int:
+        now = time.time()
+        size = 0
+        for slot in range(self.slots):
+            offset = HEADER_SIZE + slot * self.slot_size
+            slot_hash, expires_at, _, _, _ = SLOT_HEADER.unpack_from(self._map, offset)
+            if slot_hash and expires_at > now:
+                size += 1
+        return size
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        :returns: the cached value, or the default for a missing or expired key
+        """
+        try:
+            key_bytes, key_hash, set_index = self._key(key)
+        except (TypeError, ValueError):
+            with self._lock:
+                self.misses += 1  # a key that is not JSON is never cached
+            return default
+        data = None
+        with self._locked(set_index):
+            offset = self._find(set_index, key_hash, key_bytes)
+            if offset is not None:
+                _, expires_at, _, key_len, value_len = SLOT_HEADER.unpack_from(
+                    self._map, offset
+                )
+                now = time.time()
+                if now < expires_at:
+                    SLOT_HEADER.pack_into(
+                        self._map, offset, key_hash, expires_at, now, key_len, value_len
+                    )
+                    start = offset + SLOT_HEADER.size + key_len
+                    data = self._map[start : start + value_len]
+                else:
+                    self._clear(offset)
+            if data is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return loads(data)
+
+    def put(self, key: Hashable, value: Any, ttl: float = None) -> bool:
+        """
+        :param key: a simple key, e.g. a str or a tuple of str and int
+        :param value: a JSON value
+        :param ttl: optional seconds to cache this value, instead of the default
+        :returns: False when the key or the value is not JSON, or the value
+            is too large for a slot
+        """
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            key_bytes, key_hash, set_index = self._key(key)
+            value_bytes = dumps(value)
+        except (TypeError, ValueError) as err:
+            LOGGER.debug("The value is not JSON for the shared cache: %s", err)
+            return False
+        if SLOT_HEADER.size + len(key_bytes) + len(value_bytes) > self.slot_size:
+            LOGGER.debug("The value is too large for the shared cache: %s", key)
+            return False
+        with self._locked(set_index):
+            self._write(set_index, key_hash, key_bytes, value_bytes, ttl)
+        return True
+
+    def update(
+        self, key: Hashable, func: Callable[[Any], Tuple[Any, Any]], ttl: float = None
+    ) -> Any:
+        """
+        Atomically replace a value, for all the processes, e.g. to update a
+        counter; the new value is not cached when it is not JSON or it is too
+        large for a slot
+
+        :param key: a simple key, e.g. a str or a tuple of str and int
+        :param func: ``func(value) -> (new_value, result)``, where the value is
+            None for a missing or expired key
+        :param ttl: optional seconds to cache the new value, instead of the default
+        :returns: the result of the func
+        """
+        ttl = self.ttl if ttl is None else ttl
+        key_bytes, key_hash, set_index = self._key(key)
+        with self._locked(set_index):
+            value = None
+            offset = self._find(set_index, key_hash, key_bytes)
+            if offset is not None:
+                _, expires_at, _, key_len, value_len = SLOT_HEADER.unpack_from(
+                    self._map, offset
+                )
+                if time.time() < expires_at:
+                    start = offset + SLOT_HEADER.size + key_len
+                    value = loads(self._map[start : start + value_len])
+            value, result = func(value)
+            try:
+                value_bytes = dumps(value)
+            except (TypeError, ValueError) as err:
+                LOGGER.debug("The value is not JSON for the shared cache: %s", err)
+                return result
+            if SLOT_HEADER.size + len(key_bytes) + len(value_bytes) <= self.slot_size:
+                self._write(set_index, key_hash, key_bytes, value_bytes, ttl)
+        return result
+
+    def _write(
+        self,
+        set_index: int,
+        key_hash: int,
+        key_bytes: bytes,
+        value_bytes: bytes,
+        ttl: float,
+    ):
+        """Write a value to the slot of its key, or a victim slot; needs the lock"""
+        offset = self._find(set_index, key_hash, key_bytes)
+        if offset is None:
+            offset = self._victim(set_index)
+        self._clear(offset)
+        start = offset + SLOT_HEADER.size
+        self._map[start : start + len(key_bytes)] = key_bytes
+        start += len(key_bytes)
+        self._map[start : start + len(value_bytes)] = value_bytes
+        now = time.time()
+        SLOT_HEADER.pack_into(
+            self._map,
+            offset,
+            key_hash,
+            now + ttl,
+            now,
+            len(key_bytes),
+            len(value_bytes),
+        )
+
+    def _victim(self, set_index: int) -> int:
+        """An empty or expired slot, or the least recently used slot of a set"""
+        now = time.time()
+        victim = None
+        victim_used = None
+        for way in range(self.ways):
+            offset = self._offset(set_index, way)
+            slot_hash, expires_at, used, _, _ = SLOT_HEADER.unpack_from(
+                self._map, offset
+            )
+            if slot_hash == 0 or expires_at <= now:
+                return offset
+            if victim_used is None or used < victim_used:
+                victim, victim_used = offset, used
+        self.evictions += 1
+        return victim
+
+    def invalidate(self, key: Union[Hashable, Callable[[Hashable], bool]] = None):
+        """
+        Remove cached values, for all the processes
+
+        :param key: a key, or a function that is True for the keys to remove;
+            the default removes all the values
+        """
+        if key is not None and not callable(key):
+            try:
+                key_bytes, key_hash, set_index = self._key(key)
+            except (TypeError, ValueError):
+                return  # a key that is not JSON is never cached
+            with self._locked(set_index):
+                offset = self._find(set_index, key_hash, key_bytes)
+                if offset is not None:
+                    self._clear(offset)
+            return
+        for set_index in range(self.sets):
+            with self._locked(set_index):
+                for way in range(self.ways):
+                    offset = self._offset(set_index, way)
+                    slot_hash, _, _, key_len, _ = SLOT_HEADER.unpack_from(
+                        self._map, offset
+                    )
+                    if not slot_hash:
+                        continue
+                    if key is not None:
+                        start = offset + SLOT_HEADER.size
+                        if not key(load_key(self._map[start : start + key_len])):
+                            continue
+                    self._clear(offset)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(self.hits, self.misses, self.evictions, len(self))
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import base64
+import functools
 import json
 import logging
 import os
@@ -84,7 +85,14 @@ class StackConfig:
 
 def boto_client(service_name: str, region_name: str = None) -> BaseClient:
     region = region_name or os.getenv("AWS_DEFAULT_REGION", "us-west-2")
-    return boto3.client(service_name=service_name, region_name=region)
+    return _boto_client(service_name, region)
+
+
+@functools.lru_cache(maxsize=None)
+def _boto_client(service_name: str, region_name: str) -> BaseClient:
+    # create one client per service and region; this CLI script does not
+    # depend on the example_app package, so it does not use its registry
+    return boto3.client(service_name=service_name, region_name=region_name)
 
 
 def bucket_create(config: StackConfig) -> bool:
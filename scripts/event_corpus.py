@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+"""
+Generate a corpus of synthetic API Gateway events, as NDJSON.
+
+The events are for the routes of the example app and the authorizer:
+
+- REST API (v1) proxy events and HTTP API (v2) events for ``GET /ping``,
+  ``GET /api/v1/example`` and ``POST /api/v1/example``
+- authorizer ``TOKEN`` events, with JWT-shaped tokens that are not signed
+  by Cognito, so the authorizer rejects them after it parses them
+
+The events vary the number and size of headers, the query strings, cookies,
+the body size and the base64-encoding of bodies, so that benchmarks can find
+the event shapes that are slow in the Mangum translation.  The corpus is
+reproducible for a seed, e.g.
+
+.. code-block::
+
+    python scripts/event_corpus.py --count 10000 --seed 42 --output events.ndjson
+    python scripts/runtime_api.py example_app.main.handler --events events.ndjson
+
+Use :func:`event_shape` to group the events (or benchmark results) by shape.
+"""
+
+import argparse
+import base64
+import copy
+import json
+import random
+import sys
+import uuid
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+
+from mangum_http_event import mock_http_event
+
+KINDS = ("v1", "v2", "authorizer")
+
+ROUTES = [("GET", "/ping"), ("GET", "/api/v1/example"), ("POST", "/api/v1/example")]
+
+#: body padding sizes, to find the cost of larger bodies
+BODY_PAD_SIZES = [0, 0, 0, 64, 1024, 16 * 1024, 256 * 1024]
+
+#: the number of extra headers, to find the cost of many headers
+EXTRA_HEADER_COUNTS = [0, 0, 2, 8, 32, 96]
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15",
+    "curl/7.68.0",
+    "python-requests/2.31.0",
+    "PostmanRuntime/7.26.8",
+]
+
+ACCOUNT_ID = "123456789012"
+API_ID = "abcdef1234"
+REGION = "us-west-2"
+STAGE = "dev"
+
+
+def random_ip(rng: random.Random) -> str:
+    return ".".join(str(rng.randint(1, 254)) for _ in range(4))
+
+
+def random_headers(rng: random.Random) -> Dict[str, str]:
+    trace_id = uuid.UUID(int=rng.getrandbits(128)).hex[:24]
+    headers = {
+        "Accept": "application/json",
+        "Host": f"{API_ID}.execute-api.{REGION}.amazonaws.com",
+        "User-Agent": rng.choice(USER_AGENTS),
+        "X-Amzn-Trace-Id": f"Root=1-5f84c7a9-{trace_id}",
+        "X-Forwarded-For": random_ip(rng),
+        "X-Forwarded-Port": "443",
+        "X-Forwarded-Proto": "https",
+    }
+    for i in range(rng.choice(EXTRA_HEADER_COUNTS)):
+        size = rng.choice([8, 32, 256])
+        headers[f"X-Custom-Header-{i}"] = "".join(
+            rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(size)
+        )
+    return headers
+
+
+def random_query(rng: random.Random) -> Dict[str, List[str]]:
+    shape = rng.choice(["none", "none", "single", "multi"])
+    if shape == "none":
+        return {}
+    query = {"q": [f"term{rng.randint(0, 999)}"], "page": [str(rng.randint(1, 50))]}
+    if shape == "multi":
+        query["tag"] = [f"tag{i}" for i in range(rng.randint(2, 6))]
+    return query
+
+
+def random_body(rng: random.Random, method: str) -> Dict:
+    """
+    :returns: {"body", "isBase64Encoded"} for a request body
+    """
+    if method != "POST":
+        return {"body": None, "isBase64Encoded": False}
+    data = {"a": rng.randint(-1000, 1000), "b": rng.randint(-1000, 1000)}
+    pad = rng.choice(BODY_PAD_SIZES)
+    if pad:
+        data["padding"] = "x" * pad  # ignored by the InputExample model
+    body = json.dumps(data)
+    if rng.random() < 0.3:
+        body = base64.b64encode(body.encode()).decode()
+        return {"body": body, "isBase64Encoded": True}
+    return {"body": body, "isBase64Encoded": False}
+
+
+def rest_v1_event(rng: random.Random) -> Dict:
+    """A REST API (v1) proxy event"""
+    method, path = rng.choice(ROUTES)
+    headers = random_headers(rng)
+    body = random_body(rng, method)
+    if body["body"] is not None:
+        headers["Content-Type"] = "application/json"
+    query = random_query(rng)
+
+    event = copy.deepcopy(mock_http_event)
+    event.update(
+        {
+            "path": path,
+            "httpMethod": method,
+            "resource": "/{proxy+}",
+            "pathParameters": {"proxy": path.lstrip("/")},
+            "headers": headers,
+            "multiValueHeaders": {k: [v] for k, v in headers.items()},
+            "queryStringParameters": {k: v[-1] for k, v in query.items()} or None,
+            "multiValueQueryStringParameters": query or None,
+            "body": body["body"],
+            "isBase64Encoded": body["isBase64Encoded"],
+        }
+    )
+    context = event["requestContext"]
+    context.update(
+        {
+            "httpMethod": method,
+            "path": f"/{STAGE}{path}",
+            "requestId": str(uuid.UUID(int=rng.getrandbits(128))),
+            "stage": STAGE,
+            "apiId": API_ID,
+            "accountId": ACCOUNT_ID,
+        }
+    )
+    context["identity"]["sourceIp"] = headers["X-Forwarded-For"]
+    context["identity"]["userAgent"] = headers["User-Agent"]
+    return event
+
+
+def http_v2_event(rng: random.Random) -> Dict:
+    """An HTTP API (v2) event"""
+    method, path = rng.choice(ROUTES)
+    headers = {k.lower(): v for k, v in random_headers(rng).items()}
+    body = random_body(rng, method)
+    if body["body"] is not None:
+        headers["content-type"] = "application/json"
+    query = random_query(rng)
+    raw_query = "&".join(f"{k}={v}" for k, values in query.items() for v in values)
+    cookies = [f"cookie{i}=value{i}" for i in range(rng.choice([0, 0, 1, 4]))]
+
+    event = {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": raw_query,
+        "headers": headers,
+        "requestContext": {
+            "accountId": ACCOUNT_ID,
+            "apiId": API_ID,
+            "domainName": headers["host"],
+            "domainPrefix": API_ID,
+            "http": {
+                "method": method,
+                "path": path,
+                "protocol": "HTTP/1.1",
+                "sourceIp": headers["x-forwarded-for"],
+                "userAgent": headers["user-agent"],
+            },
+            "requestId": str(uuid.UUID(int=rng.getrandbits(128))),
+            "routeKey": "$default",
+            "stage": "$default",
+            "time": "12/Mar/2020:19:03:58 +0000",
+            "timeEpoch": 1583348638390,
+        },
+        "isBase64Encoded": body["isBase64Encoded"],
+    }
+    if cookies:
+        event["cookies"] = cookies
+    if query:
+        event["queryStringParameters"] = {k: ",".join(v) for k, v in query.items()}
+    if body["body"] is not None:
+        event["body"] = body["body"]
+    return event
+
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def authorizer_event(rng: random.Random) -> Dict:
+    """An authorizer TOKEN event, with an unsigned JWT-shaped token"""
+    method, path = rng.choice(ROUTES)
+    header = {"kid": uuid.UUID(int=rng.getrandbits(128)).hex, "alg": "RS256"}
+    claims = {
+        "sub": str(uuid.UUID(int=rng.getrandbits(128))),
+        "iss": f"https://cognito-idp.{REGION}.amazonaws.com/{REGION}_example",
+        "token_use": rng.choice(["id", "access"]),
+        "email": f"user{rng.randint(0, 9999)}@example.com",
+        "exp": 1600000000 + rng.randint(0, 10 ** 8),
+        "groups": [f"group-{i}" for i in range(rng.choice([0, 1, 8, 64]))],
+    }
+    signature = bytes(rng.getrandbits(8) for _ in range(256))
+    token = ".".join(
+        [
+            b64url(json.dumps(header).encode()),
+            b64url(json.dumps(claims).encode()),
+            b64url(signature),
+        ]
+    )
+    shape = rng.choice(["bearer", "bearer", "raw", "missing", "malformed"])
+    event = {
+        "type": "TOKEN",
+        "methodArn": (
+            f"arn:aws:execute-api:{REGION}:{ACCOUNT_ID}:{API_ID}/{STAGE}/{method}{path}"
+        ),
+    }
+    if shape == "bearer":
+        event["authorizationToken"] = f"Bearer {token}"
+    elif shape == "raw":
+        event["authorizationToken"] = token
+    elif shape == "malformed":
+        event["authorizationToken"] = "Bearer " + token.replace(".", "", 1)
+    return event
+
+
+GENERATORS: Dict[str, Callable[[random.Random], Dict]] = {
+    "v1": rest_v1_event,
+    "v2": http_v2_event,
+    "authorizer": authorizer_event,
+}
+
+
+def generate_events(
+    count: int, kinds: List[str] = KINDS, seed: int = None
+) -> Iterator[Dict]:
+    """
+    :param count: the number of events
+    :param kinds: the kinds of events, in "v1", "v2" and "authorizer"
+    :param seed: a random seed, for a reproducible corpus
+    :returns: an iterator of events
+    """
+    rng = random.Random(seed)
+    generators = [GENERATORS[kind] for kind in kinds]
+    for _ in range(count):
+        yield rng.choice(generators)(rng)
+
+
+def size_class(size: int) -> str:
+    if size < 4 * 1024:
+        return "S"
+    if size < 64 * 1024:
+        return "M"
+    return "L"
+
+
+def event_shape(event: Dict) -> str:
+    """
+    A label for the shape of an event, e.g. "v2 POST /api/v1/example b64 M"
+    """
+    size = size_class(len(json.dumps(event)))
+    if event.get("type") == "TOKEN":
+        return f"authorizer TOKEN {size}"
+    if event.get("version") == "2.0":
+        kind = "v2"
+        method = event["requestContext"]["http"]["method"]
+        path = event["rawPath"]
+    else:
+        kind = "v1"
+        method = event.get("httpMethod")
+        path = event.get("path")
+    encoding = "b64" if event.get("isBase64Encoded") else "text"
+    return f"{kind} {method} {path} {encoding} {size}"
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--count", type=int, default=1000, help="the number of events")
+    parser.add_argument(
+        "--kinds", nargs="+", choices=KINDS, default=list(KINDS), help="event kinds"
+    )
+    parser.add_argument("--seed", type=int, default=None, help="a random seed")
+    parser.add_argument("--output", help="an NDJSON file; the default is stdout")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for event in generate_events(args.count, args.kinds, args.seed):
+            output.write(json.dumps(event) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmarks of the Lambda handler, through Mangum.
+
+The Mangum handler is created with ``create_asgi_handler`` and invoked
+in-process with API Gateway events, from an NDJSON corpus (see
+``scripts/event_corpus.py``), and a fake Lambda context.  The results are
+grouped by the shape of the events:
+
+- ``rps`` - the invocations per second
+- ``p50_ms``, ``p99_ms`` - the latency percentiles
+- ``peak_kb`` - the mean peak of memory allocated in an invocation
+- ``retained_b`` - the mean memory retained after an invocation
+
+The allocations are measured with ``tracemalloc`` in a separate pass, so
+that tracing does not affect the latency.  Results can be saved as a
+baseline and compared with a baseline; a metric that is worse than the
+baseline by more than the threshold is a regression, e.g.
+
+.. code-block::
+
+    python scripts/event_corpus.py --count 2000 --seed 1 --kinds v1 v2 \\
+        --output /tmp/events.ndjson
+    python scripts/handler_benchmark.py --events /tmp/events.ndjson --save
+    # after a change
+    python scripts/handler_benchmark.py --events /tmp/events.ndjson --compare
+
+Authorizer events are skipped, because the authorizer gets the JWKS for the
+Cognito pool over the network.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from event_corpus import event_shape
+from event_corpus import generate_events
+from runtime_api import FakeLambdaContext
+from runtime_api import percentile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from example_app import logger as app_logger  # noqa: E402 pylint: disable=C0413
+from example_app import main as app_main  # noqa: E402 pylint: disable=C0413
+
+BASELINE_PATH = "tests/benchmarks/baselines/handler.json"
+
+#: metrics where a larger value is a regression; rps is the reverse
+METRICS = ["p50_ms", "p99_ms", "peak_kb", "retained_b"]
+
+
+def fake_context() -> FakeLambdaContext:
+    return FakeLambdaContext(
+        str(uuid.uuid4()),
+        int(time.time() * 1000) + 30000,
+        "arn:aws:lambda:us-west-2:123456789012:function:example-app",
+    )
+
+
+def load_events(path: str = None, count: int = 1000, seed: int = 1) -> List[Dict]:
+    """Load the HTTP events from an NDJSON corpus, or generate them"""
+    if path:
+        with open(path) as corpus:
+            events = [json.loads(line) for line in corpus if line.strip()]
+    else:
+        events = list(generate_events(count, ["v1", "v2"], seed))
+    return [event for event in events if event.get("type") != "TOKEN"]
+
+
+def time_invocations(
+    handler: Callable, events: List[Dict], rounds: int
+) -> Dict[str, List[float]]:
+    """The latency of each invocation, in seconds, by event shape"""
+    latencies = defaultdict(list)
+    shapes = [event_shape(event) for event in events]
+    for _ in range(rounds):
+        for shape, event in zip(shapes, events):
+            context = fake_context()
+            start = time.perf_counter()
+            handler(event, context)
+            latencies[shape].append(time.perf_counter() - start)
+    return latencies
+
+
+def trace_invocations(handler: Callable, events: List[Dict]) -> Dict[str, List]:
+    """The (peak, retained) bytes of each invocation, by event shape"""
+    allocations = defaultdict(list)
+    tracemalloc.start()
+    try:
+        for event in events:
+            context = fake_context()
+            tracemalloc.clear_traces()
+            handler(event, context)
+            current, peak = tracemalloc.get_traced_memory()
+            allocations[event_shape(event)].append((peak, current))
+    finally:
+        tracemalloc.stop()
+    return allocations
+
+
+def run_benchmark(events: List[Dict], rounds: int = 3, warmup: int = 50) -> Dict:
+    """
+    :param events: API Gateway events
+    :param rounds: the number of times to invoke the events for latency
+    :param warmup: the number of warm-up invocations
+    :returns: the metrics for each event shape
+    """
+    handler = app_main.create_asgi_handler(app_main.app)
+    for event in events[:warmup]:
+        handler(event, fake_context())
+    app_logger.flush_logs()
+
+    latencies = time_invocations(handler, events, rounds)
+    allocations = trace_invocations(handler, events)
+    app_logger.flush_logs()
+
+    results = {}
+    for shape in sorted(latencies):
+        seconds = latencies[shape]
+        peaks = [peak for peak, _ in allocations[shape]]
+        retained = [current for _, current in allocations[shape]]
+        results[shape] = {
+            "count": len(seconds),
+            "rps": len(seconds) / sum(seconds),
+            "p50_ms": percentile(seconds, 50) * 1000,
+            "p99_ms": percentile(seconds, 99) * 1000,
+            "peak_kb": sum(peaks) / len(peaks) / 1024,
+            "retained_b": sum(retained) / len(retained),
+        }
+    return results
+
+
+def regressions(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    :param results: the benchmark results
+    :param baseline: the baseline results
+    :param threshold: the fraction that a metric can be worse than the baseline
+    :returns: a description of each regression
+    """
+    found = []
+    for shape, metrics in results.items():
+        base = baseline.get(shape)
+        if base is None:
+            continue
+        for metric in METRICS:
+            if metric == "p99_ms" and metrics["count"] < 100:
+                continue  # too few invocations for a stable p99
+            # ignore tiny absolute values, which are noise
+            if base[metric] > 1e-3 and metrics[metric] > base[metric] * (1 + threshold):
+                found.append(
+                    f"{shape}: {metric} {metrics[metric]:.3f} > {base[metric]:.3f}"
+                )
+        if metrics["rps"] < base["rps"] * (1 - threshold):
+            found.append(f"{shape}: rps {metrics['rps']:.1f} < {base['rps']:.1f}")
+    return found
+
+
+def print_results(results: Dict):
+    print(
+        f"{'shape':<40} {'count':>6} {'rps':>9} {'p50_ms':>8} {'p99_ms':>8} "
+        f"{'peak_kb':>9} {'retained_b':>10}"
+    )
+    for shape, m in results.items():
+        print(
+            f"{shape:<40} {m['count']:>6} {m['rps']:>9.1f} {m['p50_ms']:>8.3f} "
+            f"{m['p99_ms']:>8.3f} {m['peak_kb']:>9.1f} {m['retained_b']:>10.0f}"
+        )
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--events", help="an NDJSON event corpus")
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=1000,
+        help="the events to generate, without a corpus",
+    )
+    parser.add_argument("--rounds", type=int, default=3, help="rounds of invocations")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="a baseline file")
+    parser.add_argument("--save", action="store_true", help="save as the baseline")
+    parser.add_argument(
+        "--compare", action="store_true", help="compare to the baseline"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="the regression threshold"
+    )
+    args = parser.parse_args(argv)
+
+    events = load_events(args.events, args.count)
+    results = run_benchmark(events, rounds=args.rounds)
+    print_results(results)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f"Saved the baseline: {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; save one with --save")
+            return 2
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        found = regressions(results, baseline, args.threshold)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        if found:
+            return 1
+        print(f"No regressions above {args.threshold:.0%} of the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+Load test the multi-worker server, to show how throughput scales with cores.
+
+For each worker count, this starts ``python -m example_app.server`` and
+runs client processes that send keep-alive requests to a path for a fixed
+duration, then reports the requests per second, the latency percentiles
+and the scaling relative to the first worker count, e.g.
+
+.. code-block::
+
+    python scripts/load_test.py --workers 1 2 4 --clients 8 --duration 10
+
+Run it on a host with at least as many cores as the largest worker count
+plus the clients, or the clients compete with the workers for the CPUs.
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from runtime_api import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port: int, path: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", path)
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"The server did not start on port {port}")
+
+
+def run_client(args: Tuple[int, str, float]) -> Tuple[int, int, List[float]]:
+    """
+    :returns: (requests, errors, latencies) of one keep-alive client
+    """
+    port, path, duration = args
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    return len(latencies), errors, latencies
+
+
+def load_test(workers: int, clients: int, duration: float, path: str) -> Dict:
+    port = free_port()
+    env = dict(os.environ, LOG_LEVEL="WARNING")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "example_app.server"]
+        + ["--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=REPO_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_server(port, path)
+        with multiprocessing.Pool(clients) as pool:
+            # warm up every worker before the measurement
+            pool.map(run_client, [(port, path, 1.0)] * clients)
+            start = time.perf_counter()
+            results = pool.map(run_client, [(port, path, duration)] * clients)
+            seconds = time.perf_counter() - start
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    latencies = [latency for _, _, client in results for latency in client]
+    requests = sum(count for count, _, _ in results)
+    return {
+        "workers": workers,
+        "requests": requests,
+        "errors": sum(errors for _, errors, _ in results),
+        "rps": requests / seconds,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def print_results(results: List[Dict]):
+    print(
+        f"{'workers':>7} {'requests':>9} {'errors':>6} {'rps':>9} "
+        f"{'p50_ms':>8} {'p99_ms':>8} {'scaling':>7}"
+    )
+    base_rps = results[0]["rps"]
+    for r in results:
+        print(
+            f"{r['workers']:>7} {r['requests']:>9} {r['errors']:>6} {r['rps']:>9.1f} "
+            f"{r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['rps'] / base_rps:>6.2f}x"
+        )
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="the worker counts to test",
+    )
+    parser.add_argument("--clients", type=int, default=8, help="client processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--path", default="/ping", help="the URL path to request")
+    args = parser.parse_args(argv)
+
+    print(f"CPUs: {os.cpu_count()}")
+    results = [
+        load_test(workers, args.clients, args.duration, args.path)
+        for workers in args.workers
+    ]
+    print_results(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+"""
+A local AWS Lambda Runtime API emulator, for warm-path load tests.
+
+The emulator serves a queue of events on the Runtime API endpoints:
+
+- GET  /2018-06-01/runtime/invocation/next
+- POST /2018-06-01/runtime/invocation/{request_id}/response
+- POST /2018-06-01/runtime/invocation/{request_id}/error
+- POST /2018-06-01/runtime/init/error
+
+It starts one runtime process, which imports the handler once and then
+loops on the invocations, like a warm Lambda container.  The init time of
+the runtime process (from its start to the first request for an event) and
+the duration of every invocation are recorded, e.g.
+
+.. code-block::
+
+    # replay an NDJSON file of events, 1000 times, and save the records
+    python scripts/runtime_api.py example_app.main.handler \\
+        --events events.ndjson --repeat 1000 --output invocations.ndjson
+
+    # invoke the handler with a single event
+    python scripts/runtime_api.py example_app.main.handler --events events/event.json
+
+When there are no more events, the next invocation request gets a
+'410 Gone' response and the runtime process exits; this is only in the
+emulator, the AWS Lambda service would freeze the runtime.
+
+.. seealso::
+    - https://docs.aws.amazon.com/lambda/latest/dg/runtimes-api.html
+"""
+
+import argparse
+import importlib
+import json
+import os
+import queue
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+
+RUNTIME_PATH = "/2018-06-01/runtime"
+
+FUNCTION_NAME = os.getenv("AWS_LAMBDA_FUNCTION_NAME", "example-app")
+FUNCTION_VERSION = os.getenv("AWS_LAMBDA_FUNCTION_VERSION", "$LATEST")
+FUNCTION_MEMORY_SIZE = int(os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "1536"))
+FUNCTION_TIMEOUT = int(os.getenv("AWS_LAMBDA_FUNCTION_TIMEOUT", "30"))
+REGION = os.getenv("AWS_REGION", os.getenv("AWS_DEFAULT_REGION", "us-west-2"))
+FUNCTION_ARN = f"arn:aws:lambda:{REGION}:123456789012:function:{FUNCTION_NAME}"
+
+
+@dataclass
+class Invocation:
+    request_id: str
+    event: bytes = field(repr=False)
+    cold: bool = False
+    init_ms: float = None
+    started: float = None
+    finished: float = None
+    duration_ms: float = None
+    response_size: int = 0
+    error: str = None
+
+    def record(self) -> Dict:
+        record = asdict(self)
+        for key in ["event", "started", "finished"]:
+            record.pop(key)
+        return record
+
+
+class RuntimeAPI:
+    """
+    The state of the emulator: a queue of invocations and their records
+
+    :param events: the JSON events to invoke
+    """
+
+    def __init__(self, events: Iterator[bytes]):
+        self.pending: "queue.Queue[Optional[Invocation]]" = queue.Queue()
+        self.invocations: Dict[str, Invocation] = {}
+        self.completed: List[Invocation] = []
+        self.runtime_started: float = None
+        self.init_error: str = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        for event in events:
+            invocation = Invocation(request_id=str(uuid.uuid4()), event=event)
+            self.invocations[invocation.request_id] = invocation
+            self.pending.put(invocation)
+        self.total = len(self.invocations)
+        self.pending.put(None)  # no more events
+        if not self.total:
+            self.done.set()
+
+    def next_invocation(self) -> Optional[Invocation]:
+        invocation = self.pending.get()
+        if invocation is None:
+            self.pending.put(None)
+            return None
+        invocation.started = time.perf_counter()
+        if not self.completed and self.runtime_started is not None:
+            invocation.cold = True
+            invocation.init_ms = (invocation.started - self.runtime_started) * 1000
+            self.runtime_started = None
+        return invocation
+
+    def complete(self, request_id: str, body: bytes, error: str = None):
+        invocation = self.invocations[request_id]
+        invocation.finished = time.perf_counter()
+        invocation.duration_ms = (invocation.finished - invocation.started) * 1000
+        invocation.response_size = len(body)
+        invocation.error = error
+        with self._lock:
+            self.completed.append(invocation)
+            if len(self.completed) == self.total:
+                self.done.set()
+
+    def fail_init(self, body: bytes):
+        self.init_error = body.decode(errors="replace")
+        self.done.set()
+
+
+class RuntimeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the Lambda service
+    disable_nagle_algorithm = True  # the headers and body are separate writes
+    runtime_api: RuntimeAPI = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        return
+
+    def send(self, status: int, body: bytes = b"", headers: Dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        size = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(size) if size else b""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path != f"{RUNTIME_PATH}/invocation/next":
+            self.send(404)
+            return
+        invocation = self.runtime_api.next_invocation()
+        if invocation is None:
+            self.send(410, b'{"errorMessage": "No more events"}')
+            return
+        deadline_ms = int(time.time() * 1000) + FUNCTION_TIMEOUT * 1000
+        trace_id = f"Root=1-{int(time.time()):08x}-{uuid.uuid4().hex[:24]};Sampled=0"
+        self.send(
+            200,
+            invocation.event,
+            {
+                "Content-Type": "application/json",
+                "Lambda-Runtime-Aws-Request-Id": invocation.request_id,
+                "Lambda-Runtime-Deadline-Ms": str(deadline_ms),
+                "Lambda-Runtime-Invoked-Function-Arn": FUNCTION_ARN,
+                "Lambda-Runtime-Trace-Id": trace_id,
+            },
+        )
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = self.read_body()
+        parts = self.path[len(RUNTIME_PATH) :].strip("/").split("/")
+        if parts == ["init", "error"]:
+            self.runtime_api.fail_init(body)
+        elif len(parts) == 3 and parts[0] == "invocation":
+            _, request_id, result = parts
+            if request_id not in self.runtime_api.invocations:
+                self.send(400)
+                return
+            error = None
+            if result == "error":
+                error = self.headers.get("Lambda-Runtime-Function-Error-Type", "Error")
+            self.runtime_api.complete(request_id, body, error)
+        else:
+            self.send(404)
+            return
+        self.send(202, b'{"status": "OK"}', {"Content-Type": "application/json"})
+
+
+def start_server(runtime_api: RuntimeAPI, port: int = 0) -> ThreadingHTTPServer:
+    handler = type("Handler", (RuntimeAPIHandler,), {"runtime_api": runtime_api})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+#
+# The runtime process
+#
+
+
+class FakeLambdaContext:
+    """A Lambda context for the runtime process"""
+
+    def __init__(self, request_id: str, deadline_ms: int, function_arn: str):
+        self.aws_request_id = request_id
+        self.invoked_function_arn = function_arn
+        self.function_name = FUNCTION_NAME
+        self.function_version = FUNCTION_VERSION
+        self.memory_limit_in_mb = FUNCTION_MEMORY_SIZE
+        self.log_group_name = f"/aws/lambda/{FUNCTION_NAME}"
+        self.log_stream_name = f"local/[{FUNCTION_VERSION}]{uuid.uuid4().hex}"
+        self.identity = None
+        self.client_context = None
+        self._deadline_ms = deadline_ms
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(self._deadline_ms - int(time.time() * 1000), 0)
+
+
+def error_body(err: BaseException) -> bytes:
+    return json.dumps(
+        {
+            "errorMessage": str(err),
+            "errorType": type(err).__name__,
+            "stackTrace": traceback.format_tb(err.__traceback__),
+        }
+    ).encode()
+
+
+def run_runtime(handler_name: str, api: str):
+    """
+    The runtime loop: get an event, invoke the handler, post the result
+
+    :param handler_name: a handler, e.g. "example_app.main.handler"
+    :param api: the Runtime API host:port
+    """
+    host, port = api.split(":")
+    conn = HTTPConnection(host, int(port))
+
+    try:
+        module_name, function_name = handler_name.rsplit(".", 1)
+        handler = getattr(importlib.import_module(module_name), function_name)
+        if handler is None:
+            raise RuntimeError(f"The handler {handler_name} is None")
+    except Exception as err:
+        conn.request("POST", f"{RUNTIME_PATH}/init/error", error_body(err))
+        conn.getresponse().read()
+        sys.exit(1)
+
+    while True:
+        conn.request("GET", f"{RUNTIME_PATH}/invocation/next")
+        resp = conn.getresponse()
+        event = resp.read()
+        if resp.status != 200:
+            return
+        request_id = resp.getheader("Lambda-Runtime-Aws-Request-Id")
+        os.environ["_X_AMZN_TRACE_ID"] = resp.getheader("Lambda-Runtime-Trace-Id", "")
+        context = FakeLambdaContext(
+            request_id,
+            int(resp.getheader("Lambda-Runtime-Deadline-Ms")),
+            resp.getheader("Lambda-Runtime-Invoked-Function-Arn"),
+        )
+        try:
+            result = json.dumps(handler(json.loads(event), context)).encode()
+            path, headers = "response", {}
+        except Exception as err:
+            result = error_body(err)
+            path = "error"
+            headers = {"Lambda-Runtime-Function-Error-Type": type(err).__name__}
+        conn.request(
+            "POST", f"{RUNTIME_PATH}/invocation/{request_id}/{path}", result, headers
+        )
+        conn.getresponse().read()
+
+
+#
+# The emulator process
+#
+
+
+def read_events(paths: List[str], repeat: int = 1) -> Iterator[bytes]:
+    """
+    Read the events in JSON files, with one event, or NDJSON files, with
+    one event on each line
+
+    :param paths: the event files
+    :param repeat: the number of times to repeat the events
+    """
+    events = []
+    for path in paths:
+        with open(path, "rb") as event_file:
+            text = event_file.read()
+        try:
+            events.append(json.dumps(json.loads(text)).encode())
+        except ValueError:
+            events.extend(line for line in text.splitlines() if line.strip())
+    for _ in range(repeat):
+        yield from events
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summary(runtime_api: RuntimeAPI) -> Dict:
+    completed = runtime_api.completed
+    cold = [inv for inv in completed if inv.cold]
+    warm = [inv.duration_ms for inv in completed if not inv.cold]
+    return {
+        "invocations": len(completed),
+        "errors": sum(1 for inv in completed if inv.error),
+        "init_ms": cold[0].init_ms if cold else None,
+        "cold_duration_ms": cold[0].duration_ms if cold else None,
+        "warm_mean_ms": statistics.mean(warm) if warm else None,
+        "warm_p50_ms": percentile(warm, 50),
+        "warm_p99_ms": percentile(warm, 99),
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("handler", help="a handler, e.g. example_app.main.handler")
+    parser.add_argument(
+        "--events",
+        nargs="+",
+        default=["events/event.json"],
+        help="JSON or NDJSON event files",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="repeat the events")
+    parser.add_argument("--output", help="an NDJSON file for the invocation records")
+    parser.add_argument("--port", type=int, default=0, help="the Runtime API port")
+    parser.add_argument("--runtime", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.runtime:
+        run_runtime(args.handler, os.environ["AWS_LAMBDA_RUNTIME_API"])
+        return 0
+
+    runtime_api = RuntimeAPI(read_events(args.events, args.repeat))
+    server = start_server(runtime_api, args.port)
+    env = dict(os.environ)
+    env.update(
+        {
+            "AWS_LAMBDA_RUNTIME_API": "127.0.0.1:%d" % server.server_address[1],
+            "AWS_EXECUTION_ENV": "AWS_Lambda_python3.7",
+            "AWS_LAMBDA_FUNCTION_NAME": FUNCTION_NAME,
+            "AWS_LAMBDA_FUNCTION_MEMORY_SIZE": str(FUNCTION_MEMORY_SIZE),
+            "_HANDLER": args.handler,
+            "PYTHONPATH": os.pathsep.join([os.getcwd(), env.get("PYTHONPATH", "")]),
+        }
+    )
+    runtime_api.runtime_started = time.perf_counter()
+    runtime = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), args.handler, "--runtime"], env=env
+    )
+    while not runtime_api.done.wait(0.1):
+        if runtime.poll() is not None:
+            break
+    runtime.wait()
+    server.shutdown()
+
+    if runtime_api.init_error:
+        print(f"Init error: {runtime_api.init_error}", file=sys.stderr)
+        return 1
+    if args.output:
+        with open(args.output, "w") as output:
+            for invocation in runtime_api.completed:
+                output.write(json.dumps(invocation.record()) + "\n")
+    print(json.dumps(summary(runtime_api), indent=2))
+    return 0 if len(runtime_api.completed) == runtime_api.total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
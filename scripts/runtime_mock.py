@@ -24,8 +24,9 @@ except ImportError:
 ORIG_STDOUT = sys.stdout
 ORIG_STDERR = sys.stderr
 
-LOGS = ""
 LOG_TAIL = False
+LOG_TAIL_SIZE = 4096  # Lambda returns the last 4 KB of the log
+LOG_SPOOL = os.environ.get("DOCKER_LAMBDA_LOG_SPOOL", "")
 
 STAY_OPEN = os.environ.get("DOCKER_LAMBDA_STAY_OPEN", "")
 
@@ -117,6 +118,48 @@ MOCKSERVER_PROCESS.stdin.close()
 MOCKSERVER_CONN = HTTPConnection("127.0.0.1", 9001)
 
 
+class LogBuffer(object):
+    """
+    A ring buffer for the tail of the log of an invocation, with an
+    optional spool file for the full log of all invocations
+    """
+
+    def __init__(self, size=LOG_TAIL_SIZE, spool_path=None):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.length = 0  # the bytes written since the last clear
+        self.spool = open(spool_path, "ab") if spool_path else None
+
+    def clear(self):
+        self.length = 0
+
+    def write(self, data):
+        if self.spool is not None:
+            self.spool.write(data)
+        view = memoryview(data)
+        if len(view) > self.size:
+            self.length += len(view) - self.size
+            view = view[-self.size :]
+        start = self.length % self.size
+        head = min(len(view), self.size - start)
+        self.buffer[start : start + head] = view[:head]
+        self.buffer[: len(view) - head] = view[head:]
+        self.length += len(view)
+
+    def getvalue(self):
+        if self.length <= self.size:
+            return bytes(self.buffer[: self.length])
+        start = self.length % self.size
+        return bytes(self.buffer[start:] + self.buffer[:start])
+
+    def flush(self):
+        if self.spool is not None:
+            self.spool.flush()
+
+
+LOGS = LogBuffer(spool_path=LOG_SPOOL)
+
+
 def sighup_handler(signum, frame):
     eprint("SIGHUP received, exiting runtime...")
     sys.exit(2)
@@ -182,7 +225,6 @@ def receive_invoke():
     global XRAY_TRACE_ID
     global EVENT_BODY
     global CONTEXT_OBJS
-    global LOGS
     global LOG_TAIL
     global RECEIVED_INVOKE_AT
 
@@ -193,7 +235,7 @@ def receive_invoke():
         RECEIVED_INVOKE_AT = time.time()
         INVOKED = True
     else:
-        LOGS = ""
+        LOGS.clear()
 
     try:
         MOCKSERVER_CONN.request("GET", "/2018-06-01/runtime/invocation/next")
@@ -258,7 +300,8 @@ def report_done(invokeid, errortype, result, is_fatal):
 
     headers = {}
     if LOG_TAIL:
-        headers["Docker-Lambda-Log-Result"] = base64.b64encode(LOGS.encode())
+        headers["Docker-Lambda-Log-Result"] = base64.b64encode(LOGS.getvalue())
+    LOGS.flush()
     if not INIT_END_SENT:
         headers["Docker-Lambda-Invoke-Wait"] = int(RECEIVED_INVOKE_AT * 1000)
         headers["Docker-Lambda-Init-End"] = int(INIT_END * 1000)
@@ -282,11 +325,9 @@ def report_xray_exception(xray_json):
 
 
 def log_bytes(msg, fileno):
-    global LOGS
-
     if STAY_OPEN:
-        if LOG_TAIL:
-            LOGS += msg
+        if LOG_TAIL or LOGS.spool is not None:
+            LOGS.write(msg.encode())
         (ORIG_STDOUT if fileno == 1 else ORIG_STDERR).write(msg)
     else:
         ORIG_STDERR.write(msg)
@@ -0,0 +1,27 @@
+"""
+Builders of AWS Lambda events for tests
+"""
+
+import json
+import uuid
+from typing import Dict
+
+
+def sqs_event(*messages: Dict) -> Dict:
+    """An SQS event for messages, e.g. S3 events in an SQS queue"""
+    return {
+        "Records": [
+            {
+                "messageId": str(uuid.uuid4()),
+                "receiptHandle": "receipt-handle",
+                "body": json.dumps(message),
+                "attributes": {"ApproximateReceiveCount": "1"},
+                "messageAttributes": {},
+                "md5OfBody": "md5-of-body",
+                "eventSource": "aws:sqs",
+                "eventSourceARN": "arn:aws:sqs:us-west-2:123456789012:app-queue",
+                "awsRegion": "us-west-2",
+            }
+            for message in messages
+        ]
+    }
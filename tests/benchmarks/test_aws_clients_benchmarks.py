@@ -0,0 +1,42 @@
+"""
+Cold and warm paths to get a secret, with and without the client registry
+
+Run with 'pytest tests/benchmarks --benchmark-only'
+"""
+import json
+
+import boto3
+import pytest
+
+from example_app.aws_clients import BotoClientRegistry
+
+
+@pytest.fixture
+def moto_secret(secrets_moto_client) -> str:
+    secret_name = "app-benchmark"
+    secrets_moto_client.create_secret(
+        Name=secret_name, SecretString=json.dumps({"password": "secret"})
+    )
+    return secret_name
+
+
+@pytest.mark.benchmark(group="boto-clients")
+def test_secret_with_new_client(benchmark, moto_secret, aws_region):
+    # the cold path; this is what boto_default_client did for every call
+    def get_secret():
+        client = boto3.client("secretsmanager", region_name=aws_region)
+        return client.get_secret_value(SecretId=moto_secret)
+
+    benchmark(get_secret)
+
+
+@pytest.mark.benchmark(group="boto-clients")
+def test_secret_with_registry_client(benchmark, moto_secret, aws_region):
+    registry = BotoClientRegistry()
+
+    def get_secret():
+        client = registry.client("secretsmanager", region_name=aws_region)
+        return client.get_secret_value(SecretId=moto_secret)
+
+    benchmark(get_secret)
+    assert registry.created["secretsmanager"] == 1
@@ -0,0 +1,74 @@
+"""
+Parse S3 events with 10k records, as a list or as a stream
+
+Run with 'pytest tests/benchmarks --benchmark-only'
+"""
+
+import json
+import tracemalloc
+from copy import deepcopy
+from typing import Dict
+
+import pytest
+
+from example_app.aws_s3_event import iter_s3_objects
+from example_app.aws_s3_event import parse_s3_event
+
+N_RECORDS = 10000
+
+
+@pytest.fixture(scope="module")
+def large_s3_event(fixture_path) -> Dict:
+    event = json.loads((fixture_path / "s3_event.json").read_text())
+    record = event["Records"][0]
+    records = []
+    for i in range(N_RECORDS):
+        s3_record = deepcopy(record)
+        s3_record["s3"]["object"]["key"] = f"foo/bar+{i:05d}.csv"
+        s3_record["s3"]["object"]["versionId"] = f"version-{i}"
+        records.append(s3_record)
+    return {"Records": records}
+
+
+def consume(s3_objects) -> int:
+    count = 0
+    for _ in s3_objects:
+        count += 1
+    return count
+
+
+def peak_memory(func, *args) -> int:
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.benchmark(group="s3-events")
+def test_parse_s3_event_list(benchmark, large_s3_event):
+    s3_objects = benchmark(parse_s3_event, large_s3_event)
+    assert len(s3_objects) == N_RECORDS
+
+
+@pytest.mark.benchmark(group="s3-events")
+def test_iter_s3_objects(benchmark, large_s3_event):
+    count = benchmark(
+        lambda e: consume(iter_s3_objects(e, dedup=False)), large_s3_event
+    )
+    assert count == N_RECORDS
+
+
+@pytest.mark.benchmark(group="s3-events")
+def test_iter_s3_objects_dedup(benchmark, large_s3_event):
+    count = benchmark(lambda e: consume(iter_s3_objects(e)), large_s3_event)
+    assert count == N_RECORDS
+
+
+def test_iter_s3_objects_memory(large_s3_event):
+    list_peak = peak_memory(lambda e: consume(parse_s3_event(e)), large_s3_event)
+    stream_peak = peak_memory(
+        lambda e: consume(iter_s3_objects(e, dedup=False)), large_s3_event
+    )
+    assert stream_peak * 10 < list_peak, f"list={list_peak} stream={stream_peak}"
@@ -0,0 +1,34 @@
+"""
+The latency of a GET to a local HTTPS server, with a new connection for
+each request (requests.get) and with the pooled connections of the client
+
+Run with 'pytest tests/benchmarks --benchmark-only'
+"""
+import pytest
+import requests
+
+from example_app.http_client import HttpClient
+from tests.https_stub import HttpsStub
+
+
+@pytest.fixture
+def https_stub(tmp_path) -> HttpsStub:
+    with HttpsStub(tmp_path) as stub:
+        yield stub
+
+
+@pytest.mark.benchmark(group="http-get")
+def test_requests_get(benchmark, https_stub):
+    def get():
+        return requests.get(https_stub.url, verify=https_stub.cert_path, timeout=5)
+
+    assert benchmark(get).status_code == 200
+    assert https_stub.connections == https_stub.requests
+
+
+@pytest.mark.benchmark(group="http-get")
+def test_http_client_get(benchmark, https_stub):
+    client = HttpClient(verify=https_stub.cert_path)
+    assert benchmark(client.get, https_stub.url).status_code == 200
+    assert https_stub.connections == 1
+    client.close()
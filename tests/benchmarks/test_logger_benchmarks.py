@@ -0,0 +1,71 @@
+"""
+Request-path cost of logging with the stream and queue log handlers
+
+Run with 'pytest tests/benchmarks --benchmark-only'
+"""
+import logging
+import os
+import time
+
+import pytest
+
+from example_app.logger import QueueLogWriter
+from example_app.logger import get_stream_handler
+
+
+class BlockingStream:
+    """A stream with a fixed cost for each write, like a busy stdout pipe"""
+
+    def __init__(self, stream, write_delay: float):
+        self.stream = stream
+        self.write_delay = write_delay
+
+    def write(self, s):
+        time.sleep(self.write_delay)
+        return self.stream.write(s)
+
+    def flush(self):
+        self.stream.flush()
+
+
+@pytest.fixture(params=[0.0, 0.0001], ids=["devnull", "blocking"])
+def log_stream(request):
+    with open(os.devnull, "w") as stream:
+        yield BlockingStream(stream, request.param)
+
+
+@pytest.fixture
+def bench_logger():
+    logger = logging.getLogger("tests.benchmarks.logger")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger
+    logger.handlers = []
+
+
+EVENT = {
+    "type": "TOKEN",
+    "authorizationToken": "Bearer a.b.c",
+    "methodArn": "arn:aws:execute-api:us-west-2:123456789012:api-id/dev/GET/api",
+}
+
+
+def log_request(logger):
+    logger.info("Method ARN: %s", EVENT["methodArn"])
+    logger.info("event: %s", EVENT)
+
+
+@pytest.mark.benchmark(group="logging")
+def test_stream_handler_logging(benchmark, bench_logger, log_stream):
+    bench_logger.addHandler(get_stream_handler(log_stream))
+    benchmark(log_request, bench_logger)
+
+
+@pytest.mark.benchmark(group="logging")
+def test_queue_handler_logging(benchmark, bench_logger, log_stream):
+    writer = QueueLogWriter(stream=log_stream)
+    bench_logger.addHandler(writer.handler)
+    try:
+        benchmark(log_request, bench_logger)
+    finally:
+        writer.stop()
@@ -0,0 +1,59 @@
+"""
+The overhead of the rate limiter on the ping route, through the ASGI app
+
+Run with 'pytest tests/benchmarks --benchmark-only'
+"""
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+
+from example_app.rate_limit import RateLimitMiddleware
+
+
+def ping_app(rate_limit: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    def ping():
+        return {"ping": "pong!"}
+
+    if rate_limit:
+        app.add_middleware(RateLimitMiddleware, rate=1e9, burst=1e9)
+    return app
+
+
+def asgi_ping(app: FastAPI):
+    loop = asyncio.new_event_loop()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/ping",
+        "raw_path": b"/ping",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("192.168.100.1", 1234),
+        "server": ("localhost", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200
+
+    def ping():
+        loop.run_until_complete(app(scope, receive, send))
+
+    return ping
+
+
+@pytest.mark.benchmark(group="rate-limit")
+@pytest.mark.parametrize("rate_limit", [False, True])
+def test_ping_rate_limit(benchmark, rate_limit):
+    benchmark(asgi_ping(ping_app(rate_limit)))
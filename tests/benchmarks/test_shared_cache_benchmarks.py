@@ -0,0 +1,100 @@
+"""
+Get and put latency of the in-process and shared-memory caches, and the
+hit ratio of each across 4 and 8 worker processes
+
+Run with 'pytest tests/benchmarks --benchmark-only'; the hit ratios are in
+the 'extra_info' of the results, e.g. with '--benchmark-json'.
+"""
+import multiprocessing
+import random
+
+import pytest
+
+from example_app.cache import TTLCache
+from example_app.shared_cache import SharedCache
+
+#: a JWKS-like value, about 1 KB
+VALUE = {"keys": [{"kid": str(i), "n": "x" * 400, "e": "AQAB"} for i in range(2)]}
+
+#: the keys fit in the cache, with room for the collisions of the sets of the
+#: shared cache, so the misses are mostly the first lookup of a key
+KEY_SPACE = 500
+CACHE_SIZE = 1024
+LOOKUPS = 5000
+
+
+@pytest.fixture
+def shared_cache(tmp_path) -> SharedCache:
+    cache = SharedCache(str(tmp_path / "bench.cache"), slots=CACHE_SIZE)
+    yield cache
+    cache.close()
+
+
+@pytest.mark.benchmark(group="cache-get")
+def test_ttl_cache_get(benchmark):
+    cache = TTLCache(max_size=CACHE_SIZE)
+    cache.put(("jwks", "uri"), VALUE)
+    assert benchmark(cache.get, ("jwks", "uri")) == VALUE
+
+
+@pytest.mark.benchmark(group="cache-get")
+def test_shared_cache_get(benchmark, shared_cache):
+    shared_cache.put(("jwks", "uri"), VALUE)
+    assert benchmark(shared_cache.get, ("jwks", "uri")) == VALUE
+
+
+@pytest.mark.benchmark(group="cache-put")
+def test_ttl_cache_put(benchmark):
+    cache = TTLCache(max_size=CACHE_SIZE)
+    benchmark(cache.put, ("jwks", "uri"), VALUE)
+
+
+@pytest.mark.benchmark(group="cache-put")
+def test_shared_cache_put(benchmark, shared_cache):
+    assert benchmark(shared_cache.put, ("jwks", "uri"), VALUE)
+
+
+def worker_lookups(backend: str, path: str, seed: int, results):
+    if backend == "shared":
+        cache = SharedCache(path, slots=CACHE_SIZE)
+    else:
+        cache = TTLCache(max_size=CACHE_SIZE)
+    rng = random.Random(seed)
+    for _ in range(LOOKUPS):
+        key = ("claims", rng.randrange(KEY_SPACE))
+        if cache.get(key) is None:
+            cache.put(key, VALUE)
+    results.put((cache.hits, cache.misses))
+
+
+def run_workers(backend: str, path: str, workers: int) -> float:
+    """
+    :returns: the hit ratio of all the workers
+    """
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker_lookups, args=(backend, path, seed, results))
+        for seed in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    counts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    hits = sum(hit for hit, _ in counts)
+    return hits / (hits + sum(miss for _, miss in counts))
+
+
+@pytest.mark.parametrize("workers", [4, 8])
+@pytest.mark.parametrize("backend", ["local", "shared"])
+@pytest.mark.benchmark(group="cache-workers")
+def test_cache_hit_ratio_workers(benchmark, tmp_path, backend, workers):
+    paths = iter(str(tmp_path / f"bench-{i}.cache") for i in range(1000))
+
+    def run():
+        return run_workers(backend, next(paths), workers)
+
+    hit_ratio = benchmark.pedantic(run, rounds=3)
+    benchmark.extra_info["hit_ratio"] = hit_ratio
+    assert 0 < hit_ratio < 1
@@ -14,8 +14,12 @@ from moto import mock_cognitoidp
 from moto import mock_s3
 from moto import mock_secretsmanager
 
+from example_app.aws_secrets import SECRETS_CACHE
 from example_app.aws_secrets import get_aws_secret
+from example_app.deadline import REQUEST_DEADLINE
+from example_app.deadline import set_deadline
 from example_app.settings import Settings
+from tests.aws_events import sqs_event
 
 
 @pytest.fixture(scope="session")
@@ -30,6 +34,15 @@ def s3_event_json(fixture_path):
     return json.loads(json_text)
 
 
+@pytest.fixture
+def request_deadline():
+    """Set a request deadline, which is reset after a test"""
+    tokens = []
+    yield lambda seconds: tokens.append(set_deadline(seconds))
+    for token in reversed(tokens):
+        REQUEST_DEADLINE.reset(token)
+
+
 @pytest.fixture
 def aws_region() -> str:
     return "us-west-2"
@@ -65,6 +78,8 @@ def aws_moto_credentials(aws_region, monkeypatch):
     monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
     monkeypatch.setenv("AWS_SECURITY_TOKEN", "testing")
     monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+    # moto does not decode the aws-chunked uploads with default checksums
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
     yield
 
 
@@ -155,10 +170,18 @@ def mock_s3_event_complete_multipart_upload(mock_s3_event) -> Dict:
     return event
 
 
+@pytest.fixture
+def mock_sqs_s3_event(mock_s3_event_put) -> Dict:
+    return sqs_event(mock_s3_event_put)
+
+
 @pytest.fixture
 def secrets_moto_client(aws_moto_credentials, aws_region):
+    # each moto mock is a new secrets backend, so clear any cached secrets
+    SECRETS_CACHE.invalidate()
     with mock_secretsmanager():
         yield boto3.client("secretsmanager", region_name=aws_region)
+    SECRETS_CACHE.invalidate()
 
 
 @pytest.fixture
@@ -232,7 +255,7 @@ def mock_app_ro_secrets(
     secrets = get_aws_secret(secret_id=app_ro_secrets_name, client=secrets_moto_client)
     assert secrets
     mocker.patch(
-        "example_app.aws_secrets.boto3.client", return_value=secrets_moto_client
+        "example_app.aws_secrets.boto_client", return_value=secrets_moto_client
     )
     yield secrets
 
@@ -247,6 +270,6 @@ def mock_app_rw_secrets(
     secrets = get_aws_secret(secret_id=app_rw_secrets_name, client=secrets_moto_client)
     assert secrets
     mocker.patch(
-        "example_app.aws_secrets.boto3.client", return_value=secrets_moto_client
+        "example_app.aws_secrets.boto_client", return_value=secrets_moto_client
     )
     yield secrets
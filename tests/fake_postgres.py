@@ -0,0 +1,127 @@
+"""
+An in-process fake for psycopg2 connections, for tests without a database
+"""
+
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+
+class FakePgError(Exception):
+    """An error with a Postgres SQLSTATE code, like psycopg2.Error"""
+
+    def __init__(self, message: str, pgcode: str):
+        super().__init__(message)
+        self.pgcode = pgcode
+
+
+class FakePgCursor:
+    def __init__(self, conn: "FakePgConnection"):
+        self.conn = conn
+        self.rows: List[Tuple] = []
+        self.rowcount = -1
+        self.closed = False
+
+    def execute(self, sql: str, params=None):
+        if self.conn.closed:
+            raise ConnectionError("connection already closed")
+        if self.conn.broken:
+            raise ConnectionError("server closed the connection unexpectedly")
+        self.conn.executed.append((sql, params))
+        # prepared statements last for the session, not the transaction
+        words = sql.split()
+        if words[0] == "PREPARE":
+            if words[1] in self.conn.prepared:
+                raise FakePgError(
+                    f'prepared statement "{words[1]}" already exists', "42P05"
+                )
+            self.conn.prepared.add(words[1])
+        elif words[0] == "EXECUTE" and words[1] not in self.conn.prepared:
+            raise FakePgError(
+                f'prepared statement "{words[1]}" does not exist', "26000"
+            )
+        self.rows = list(self.conn.query(sql, params) or [])
+        self.rowcount = len(self.rows)
+
+    def copy_expert(self, sql: str, file, size: int = 8192):
+        if self.conn.broken:
+            raise ConnectionError("server closed the connection unexpectedly")
+        self.conn.executed.append((sql, None))
+        copied = []
+        for chunk in iter(lambda: file.read(size), b""):
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if not chunk:
+                break
+            copied.append(chunk)
+        self.conn.copied.extend(copied)
+        # psycopg2 reports the rows for a COPY
+        rows = b"".join(copied).count(b"\n")
+        self.rowcount = rows - 1 if "HEADER true" in sql and rows else rows
+
+    def fetchone(self) -> Optional[Tuple]:
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self) -> List[Tuple]:
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self) -> "FakePgCursor":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakePgConnection:
+    """
+    A fake connection; the query function returns the rows for
+    each (sql, params) that is executed.
+    """
+
+    def __init__(self, query: Callable = None, **params):
+        self.params = params
+        self.query = query or (lambda sql, params: [(1,)])
+        self.closed = 0
+        self.broken = False
+        self.commits = 0
+        self.rollbacks = 0
+        self.executed: List[Tuple] = []
+        self.copied: List[bytes] = []
+        self.prepared: Set[str] = set()
+
+    def cursor(self) -> FakePgCursor:
+        if self.closed:
+            raise ConnectionError("connection already closed")
+        return FakePgCursor(self)
+
+    def commit(self):
+        if self.broken:
+            raise ConnectionError("server closed the connection unexpectedly")
+        self.commits += 1
+
+    def rollback(self):
+        if self.broken:
+            raise ConnectionError("server closed the connection unexpectedly")
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePgConnect:
+    """A fake connect function that records the connections it opens"""
+
+    def __init__(self, query: Callable = None):
+        self.query = query
+        self.connections: List[FakePgConnection] = []
+
+    def __call__(self, **params) -> FakePgConnection:
+        conn = FakePgConnection(self.query, **params)
+        self.connections.append(conn)
+        return conn
@@ -25,9 +25,12 @@ from typing import Dict
 import jwcrypto.jwk as jwk
 import jwcrypto.jwt as jwt
 import pytest
+import requests
 import requests_mock
 
 from example_app import aws_authorizer
+from example_app.resilience import CircuitOpenError
+from example_app.resilience import RetryPolicy
 
 
 # WARNING: moto provides python-jose as a dev-dep, which is not part of
@@ -341,3 +344,93 @@ def test_aws_auth_handler_for_jwt_access(
     assert isinstance(policy_statement, list)
     # this test could be fragile when policies get more specific
     assert [s["Effect"] for s in policy_statement] == ["Allow", "Deny"]
+
+
+def test_cognito_pool_jwks_cache(cognito_pool, cognito_pool_public_keys):
+    assert cognito_pool.jwks
+    # another pool object, e.g. in another worker, gets the cached JWKS
+    other_pool = aws_authorizer.CognitoPool(
+        region=cognito_pool.region, id=cognito_pool.id, client_id="other"
+    )
+    with requests_mock.Mocker() as request_mock:
+        assert other_pool.jwks == cognito_pool.jwks
+        assert request_mock.call_count == 0
+
+
+def test_cognito_pool_jwt_claims_cache(
+    cognito_pool, jwt_token_id, jwt_payload_id, mocker
+):
+    public_key = mocker.spy(cognito_pool, "jwt_public_key")
+    claims = cognito_pool.jwt_claims(jwt_token_id)
+    assert cognito_pool.jwt_claims(jwt_token_id) == claims
+    assert public_key.call_count == 1
+
+
+def test_cognito_pool_jwt_claims_cache_expired(
+    cognito_pool, jwt_token_id, jwt_payload_id, mocker
+):
+    cognito_pool.jwt_claims(jwt_token_id)
+    # the cached claims are not used after the token expires (jwcrypto
+    # also verifies the expiry, with a leeway of a minute)
+    mocker.patch(
+        "example_app.aws_authorizer.time.time",
+        return_value=jwt_payload_id["exp"] + 120,
+    )
+    with pytest.raises(aws_authorizer.AuthError):
+        cognito_pool.jwt_claims(jwt_token_id)
+
+
+@pytest.fixture
+def jwks_breaker(mocker):
+    mocker.patch.object(RetryPolicy, "delay", return_value=0.0)
+    breaker = aws_authorizer.fetch_jwks.breaker
+    breaker.reset()
+    yield breaker
+    breaker.reset()
+
+
+def test_fetch_jwks_retries(jwks_breaker, cognito_pool_public_keys):
+    uri = "https://cognito-idp.us-west-2.amazonaws.com/retry/.well-known/jwks.json"
+    with requests_mock.Mocker() as request_mock:
+        request_mock.get(
+            uri,
+            [
+                {"status_code": 503},
+                {"exc": requests.ConnectTimeout},
+                {"json": cognito_pool_public_keys},
+            ],
+        )
+        jwks = aws_authorizer.fetch_jwks(uri)
+        assert request_mock.call_count == 3
+    assert sorted(key["kid"] for key in jwks["keys"]) == sorted(
+        key["kid"] for key in cognito_pool_public_keys["keys"]
+    )
+    assert jwks_breaker.stats() == ("closed", 0, 1, 0, 0)
+
+
+def test_fetch_jwks_breaker(jwks_breaker):
+    uri = "https://cognito-idp.us-west-2.amazonaws.com/outage/.well-known/jwks.json"
+    with requests_mock.Mocker() as request_mock:
+        request_mock.get(uri, status_code=503)
+        # the breaker opens after 5 failures, in the 2nd call of 3 attempts
+        for _ in range(2):
+            with pytest.raises(requests.HTTPError):
+                aws_authorizer.fetch_jwks(uri)
+        assert request_mock.call_count == 5
+        with pytest.raises(CircuitOpenError):
+            aws_authorizer.fetch_jwks(uri)
+        assert request_mock.call_count == 5
+    assert jwks_breaker.state == "open"
+
+
+def test_cognito_pool_jwks_timeout(cognito_pool_public_keys, request_deadline):
+    cognito_pool = aws_authorizer.CognitoPool(
+        region="us-west-2", id="us-west-2_deadline", client_id="deadline"
+    )
+    request_deadline(2.0)
+    with requests_mock.Mocker() as request_mock:
+        request_mock.get(cognito_pool.jwks_uri, json=cognito_pool_public_keys)
+        assert cognito_pool.jwks
+        # the timeout is less than API_JWKS_TIMEOUT, at the request deadline
+        assert 1.9 < request_mock.last_request.timeout <= 2.0
+    aws_authorizer.AUTH_CACHE.invalidate(cognito_pool.jwks_uri)
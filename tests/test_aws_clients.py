@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+from botocore.config import Config
+from moto import mock_secretsmanager
+
+from example_app.aws_clients import BotoClientRegistry
+from example_app.aws_clients import boto_config
+from example_app.aws_secrets import boto_default_client
+from example_app.deadline import DeadlineExceeded
+
+
+@pytest.fixture
+def boto_registry(aws_moto_credentials) -> BotoClientRegistry:
+    return BotoClientRegistry(config=boto_config(max_pool_connections=4))
+
+
+def test_boto_config():
+    config = boto_config(max_attempts=5, connect_timeout=1, read_timeout=2)
+    assert config.retries == {"max_attempts": 5, "mode": "standard"}
+    assert config.connect_timeout == 1
+    assert config.read_timeout == 2
+
+
+def test_registry_reuses_clients(boto_registry, aws_region):
+    s3_client = boto_registry.client("s3")
+    assert boto_registry.client("s3") is s3_client
+    assert boto_registry.client("s3", region_name=aws_region) is s3_client
+    assert s3_client.meta.region_name == aws_region
+    assert s3_client.meta.config.max_pool_connections == 4
+    assert boto_registry.client("s3", region_name="us-east-1") is not s3_client
+    assert boto_registry.client("secretsmanager") is not s3_client
+    assert boto_registry.created == {"s3": 2, "secretsmanager": 1}
+
+
+def test_registry_client_config(boto_registry):
+    s3_client = boto_registry.client("s3")
+    config = Config(read_timeout=1)
+    s3_fast = boto_registry.client("s3", config=config)
+    assert s3_fast is not s3_client
+    assert s3_fast.meta.config.read_timeout == 1
+    # the default config options are merged with the client config
+    assert s3_fast.meta.config.max_pool_connections == 4
+    assert boto_registry.client("s3", config=Config(read_timeout=1)) is s3_fast
+    assert boto_registry.created["s3"] == 2
+
+
+def test_registry_threads(boto_registry):
+    clients = []
+
+    def get_client():
+        clients.append(boto_registry.client("s3"))
+
+    threads = [threading.Thread(target=get_client) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(map(id, clients))) == 1
+    assert boto_registry.created["s3"] == 1
+
+
+def test_registry_clear(boto_registry):
+    s3_client = boto_registry.client("s3")
+    boto_registry.clear()
+    assert not boto_registry.created
+    assert boto_registry.client("s3") is not s3_client
+
+
+def test_boto_default_client_region(aws_moto_credentials, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-1")
+    client = boto_default_client("secretsmanager")
+    assert client.meta.region_name == "eu-west-1"
+    assert boto_default_client("secretsmanager") is client
+
+
+@mock_secretsmanager
+def test_registry_client_deadline(boto_registry, request_deadline):
+    client = boto_registry.client("secretsmanager")
+    assert client.list_secrets()["SecretList"] == []
+    # the calls fail fast after the request deadline
+    request_deadline(-0.1)
+    with pytest.raises(DeadlineExceeded):
+        client.list_secrets()
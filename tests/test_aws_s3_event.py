@@ -1,5 +1,13 @@
-from example_app.aws_s3_event import parse_s3_event
+import json
+from copy import deepcopy
+
+import pytest
+
+from example_app.aws_s3_event import RecentKeys
 from example_app.aws_s3_event import S3Object
+from example_app.aws_s3_event import iter_s3_objects
+from example_app.aws_s3_event import parse_s3_event
+from tests.aws_events import sqs_event
 
 
 def test_parse_s3_event(s3_event_json):
@@ -19,3 +27,78 @@ def test_parse_s3_event(s3_event_json):
     assert s3_obj.key == key
     assert s3_obj.uri == f"s3://{bucket}/{key}"
     assert s3_obj.region == region
+    assert s3_obj.version_id == record["s3"]["object"]["versionId"]
+    assert s3_obj.sequencer == record["s3"]["object"]["sequencer"]
+
+
+def test_parse_s3_event_missing_records():
+    with pytest.raises(ValueError):
+        parse_s3_event({})
+
+
+def test_parse_s3_event_decodes_keys(mock_s3_event_put):
+    record = mock_s3_event_put["Records"][0]
+    record["s3"]["object"]["key"] = "foo/a+b%2Bc%20%C3%A9.csv"
+    s3_obj = parse_s3_event(mock_s3_event_put)[0]
+    assert s3_obj.key == "foo/a b+c é.csv"
+
+
+def test_iter_s3_objects_sqs(mock_sqs_s3_event, mock_s3_event_put):
+    s3_objects = iter_s3_objects(mock_sqs_s3_event)
+    assert not isinstance(s3_objects, list)
+    assert list(s3_objects) == parse_s3_event(mock_s3_event_put)
+
+
+def test_iter_s3_objects_sns(mock_s3_event_put):
+    sns_event = {
+        "Records": [
+            {
+                "EventSource": "aws:sns",
+                "Sns": {
+                    "Type": "Notification",
+                    "Message": json.dumps(mock_s3_event_put),
+                },
+            }
+        ]
+    }
+    assert list(iter_s3_objects(sns_event)) == parse_s3_event(mock_s3_event_put)
+
+    # SNS notifications delivered to an SQS queue
+    sns_sqs_event = sqs_event(sns_event["Records"][0]["Sns"])
+    assert list(iter_s3_objects(sns_sqs_event)) == parse_s3_event(mock_s3_event_put)
+
+
+def test_iter_s3_objects_test_event():
+    test_event = {"Service": "Amazon S3", "Event": "s3:TestEvent", "Bucket": "bucket"}
+    assert list(iter_s3_objects(sqs_event(test_event))) == []
+    assert list(iter_s3_objects({"Records": [{"eventSource": "aws:other"}]})) == []
+
+
+def test_iter_s3_objects_dedup(mock_s3_event_put):
+    event = deepcopy(mock_s3_event_put)
+    record = event["Records"][0]
+    other_version = deepcopy(record)
+    other_version["s3"]["object"]["versionId"] = "other-version"
+    event["Records"] = [record, record, other_version]
+
+    s3_objects = list(iter_s3_objects(event))
+    assert [s.version_id for s in s3_objects] == [
+        record["s3"]["object"]["versionId"],
+        "other-version",
+    ]
+    assert len(list(iter_s3_objects(event, dedup=False))) == 3
+
+    # duplicates across events
+    recent_keys = RecentKeys()
+    assert len(list(iter_s3_objects(event, recent_keys=recent_keys))) == 2
+    assert len(list(iter_s3_objects(event, recent_keys=recent_keys))) == 0
+
+
+def test_recent_keys_bounded():
+    recent_keys = RecentKeys(max_size=2)
+    assert recent_keys.add("a")
+    assert recent_keys.add("b")
+    assert not recent_keys.add("a")
+    assert recent_keys.add("c")  # discards "b"
+    assert len(recent_keys) == 2
+    assert recent_keys.add("b")
@@ -0,0 +1,118 @@
+import threading
+import time
+from typing import Iterator
+from typing import List
+
+import pytest
+from botocore.exceptions import ClientError
+
+from example_app.aws_s3_event import S3Object
+from example_app.aws_s3_pipeline import S3Result
+from example_app.aws_s3_pipeline import iter_s3_body
+from example_app.aws_s3_pipeline import process_s3_objects
+
+
+@pytest.fixture
+def mock_s3_objects(s3_moto_client, mock_app_bucket, aws_region) -> List[S3Object]:
+    s3_objects = []
+    for i in range(10):
+        key = f"pipeline/object-{i}.txt"
+        body = "\n".join(f"line {n}" for n in range(i + 1)).encode()
+        s3_moto_client.put_object(Bucket=mock_app_bucket, Key=key, Body=body)
+        s3_objects.append(S3Object(bucket=mock_app_bucket, key=key, region=aws_region))
+    return s3_objects
+
+
+def count_lines(s3_object: S3Object, body: Iterator[bytes]) -> int:
+    return b"".join(body).count(b"\n") + 1
+
+
+def test_iter_s3_body(s3_moto_client, mock_s3_objects):
+    s3_object = mock_s3_objects[-1]
+    chunks = list(iter_s3_body(s3_object, s3_moto_client, chunk_size=8))
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 8 for chunk in chunks)
+    assert b"".join(chunks).startswith(b"line 0\nline 1")
+
+
+def test_process_s3_objects(s3_moto_client, mock_s3_objects):
+    results = list(
+        process_s3_objects(mock_s3_objects, count_lines, client=s3_moto_client)
+    )
+    assert all(isinstance(r, S3Result) and r.ok for r in results)
+    lines = {r.s3_object.key: r.result for r in results}
+    assert lines == {s.key: i + 1 for i, s in enumerate(mock_s3_objects)}
+
+
+def test_process_s3_objects_registry_client(mock_s3_objects):
+    # without a client, a registry client is used for the region of each object
+    results = list(process_s3_objects(mock_s3_objects[:2], count_lines))
+    assert [r.ok for r in results] == [True, True]
+
+
+def test_process_s3_objects_failures(s3_moto_client, mock_s3_objects):
+    missing = mock_s3_objects[0]._replace(key="pipeline/missing.txt")
+
+    def fail_on_first(s3_object: S3Object, body: Iterator[bytes]) -> int:
+        if s3_object == mock_s3_objects[0]:
+            raise ValueError("bad object")
+        return count_lines(s3_object, body)
+
+    s3_objects = [missing] + mock_s3_objects[:3]
+    results = {
+        r.s3_object: r
+        for r in process_s3_objects(s3_objects, fail_on_first, client=s3_moto_client)
+    }
+    assert len(results) == 4
+    assert isinstance(results[missing].error, ClientError)
+    assert isinstance(results[mock_s3_objects[0]].error, ValueError)
+    assert results[mock_s3_objects[1]].ok
+    assert results[mock_s3_objects[2]].ok
+
+
+def test_process_s3_objects_concurrency(s3_moto_client, mock_s3_objects):
+    lock = threading.Lock()
+    active = []
+    max_active = []
+
+    def slow_count(s3_object: S3Object, body: Iterator[bytes]) -> int:
+        with lock:
+            active.append(s3_object)
+            max_active.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(s3_object)
+        return count_lines(s3_object, body)
+
+    start = time.monotonic()
+    results = list(
+        process_s3_objects(
+            mock_s3_objects, slow_count, client=s3_moto_client, max_workers=4
+        )
+    )
+    elapsed = time.monotonic() - start
+    assert len(results) == len(mock_s3_objects)
+    assert max(max_active) <= 4
+    assert elapsed < 0.05 * len(mock_s3_objects)
+
+
+def test_process_s3_objects_backpressure(s3_moto_client, mock_s3_objects):
+    taken = []
+
+    def s3_object_source():
+        for s3_object in mock_s3_objects:
+            taken.append(s3_object)
+            yield s3_object
+
+    results = process_s3_objects(
+        s3_object_source(),
+        count_lines,
+        client=s3_moto_client,
+        max_workers=2,
+        max_pending=3,
+    )
+    assert next(results).ok
+    # no more than max_pending objects are taken before results are consumed
+    assert len(taken) <= 4
+    results.close()
+    assert len(taken) < len(mock_s3_objects)
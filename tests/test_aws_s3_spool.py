@@ -0,0 +1,155 @@
+import os
+import tracemalloc
+
+import pytest
+
+from example_app.aws_s3_event import S3Object
+from example_app.aws_s3_spool import DiskBudget
+from example_app.aws_s3_spool import SpoolBudgetError
+from example_app.aws_s3_spool import byte_ranges
+from example_app.aws_s3_spool import spool_s3_object
+
+MB = 1024 * 1024
+
+
+def synthetic_body(size: int) -> bytes:
+    pattern = bytes(range(256))
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+class SyntheticBody:
+    """A streaming body that generates the bytes of a synthetic object"""
+
+    def __init__(self, start: int, end: int):
+        self.offset = start
+        self.end = end + 1
+
+    def read(self, size: int) -> bytes:
+        size = min(size, self.end - self.offset)
+        chunk = synthetic_body(self.offset % 256 + size)[self.offset % 256 :]
+        self.offset += size
+        return chunk
+
+    def close(self):
+        pass
+
+
+class SyntheticS3Client:
+    """An S3 client stub for a synthetic object, without any object in memory"""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def head_object(self, **params):
+        return {"ContentLength": self.size, "ETag": '"synthetic"'}
+
+    def get_object(self, Range: str, **params):
+        start, end = Range[len("bytes=") :].split("-")
+        return {"Body": SyntheticBody(int(start), int(end))}
+
+
+@pytest.fixture
+def put_s3_object(s3_moto_client, mock_app_bucket, aws_region):
+    def put(key: str, size: int) -> S3Object:
+        s3_moto_client.put_object(
+            Bucket=mock_app_bucket, Key=key, Body=synthetic_body(size)
+        )
+        return S3Object(bucket=mock_app_bucket, key=key, region=aws_region)
+
+    return put
+
+
+@pytest.fixture
+def spool_budget() -> DiskBudget:
+    return DiskBudget(max_bytes=20 * MB)
+
+
+def test_byte_ranges():
+    assert byte_ranges(0, 10) == []
+    assert byte_ranges(10, 10) == [(0, 9)]
+    assert byte_ranges(25, 10) == [(0, 9), (10, 19), (20, 24)]
+
+
+def test_spool_s3_object(s3_moto_client, put_s3_object, spool_budget, tmp_path):
+    size = 5 * MB + 123
+    s3_object = put_s3_object("spool/large.bin", size)
+    with spool_s3_object(
+        s3_object,
+        client=s3_moto_client,
+        spool_dir=str(tmp_path),
+        part_size=MB,
+        budget=spool_budget,
+    ) as spooled:
+        assert spooled.size == size
+        assert spool_budget.used == size
+        assert os.path.dirname(spooled.path) == str(tmp_path)
+        view = spooled.mmap()
+        assert view.readonly
+        assert view[:256].tobytes() == bytes(range(256))
+        assert view[-123:].tobytes() == synthetic_body(size)[-123:]
+        assert spooled.file.read() == synthetic_body(size)
+        del view
+    assert not os.path.exists(spooled.path)
+    assert spool_budget.used == 0
+
+
+def test_spool_s3_object_empty(s3_moto_client, put_s3_object, spool_budget, tmp_path):
+    s3_object = put_s3_object("spool/empty.bin", 0)
+    with spool_s3_object(
+        s3_object, client=s3_moto_client, spool_dir=str(tmp_path), budget=spool_budget
+    ) as spooled:
+        assert spooled.size == 0
+        assert spooled.mmap().tobytes() == b""
+
+
+def test_spool_s3_object_budget(s3_moto_client, put_s3_object, tmp_path):
+    s3_object = put_s3_object("spool/large.bin", 2 * MB)
+    budget = DiskBudget(max_bytes=MB)
+    with pytest.raises(SpoolBudgetError):
+        spool_s3_object(
+            s3_object, client=s3_moto_client, spool_dir=str(tmp_path), budget=budget
+        )
+    assert budget.used == 0
+    assert not list(tmp_path.iterdir())
+
+
+def test_spool_s3_object_missing(
+    s3_moto_client, mock_app_bucket, spool_budget, tmp_path
+):
+    s3_object = S3Object(bucket=mock_app_bucket, key="spool/missing.bin")
+    with pytest.raises(Exception):
+        spool_s3_object(
+            s3_object,
+            client=s3_moto_client,
+            spool_dir=str(tmp_path),
+            budget=spool_budget,
+        )
+    assert spool_budget.used == 0
+    assert not list(tmp_path.iterdir())
+
+
+def test_spool_s3_object_memory(spool_budget, tmp_path):
+    def spool_peak_memory(size: int) -> int:
+        client = SyntheticS3Client(size)
+        s3_object = S3Object(bucket="bucket", key="spool/synthetic.bin")
+        tracemalloc.start()
+        try:
+            spooled = spool_s3_object(
+                s3_object,
+                client=client,
+                spool_dir=str(tmp_path),
+                part_size=MB,
+                max_workers=2,
+                chunk_size=64 * 1024,
+                budget=spool_budget,
+            )
+            spooled.close()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    small_peak = spool_peak_memory(2 * MB)
+    large_peak = spool_peak_memory(16 * MB)
+    # the peak memory depends on the chunk size and workers, not the object size
+    assert large_peak < 2 * small_peak
+    assert large_peak < MB
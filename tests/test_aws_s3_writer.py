@@ -0,0 +1,117 @@
+import pytest
+
+from example_app.aws_s3_event import S3Object
+from example_app.aws_s3_writer import S3MultipartWriter
+from example_app.aws_s3_writer import S3WriteStats
+
+MB = 1024 * 1024
+PART_SIZE = 5 * MB
+
+
+class FailingPartClient:
+    """An S3 client proxy that fails to upload a part"""
+
+    def __init__(self, client, part_number: int):
+        self.client = client
+        self.part_number = part_number
+
+    def upload_part(self, **params):
+        if params["PartNumber"] == self.part_number:
+            raise IOError("part upload failed")
+        return self.client.upload_part(**params)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+@pytest.fixture
+def s3_output(mock_app_bucket, aws_region) -> S3Object:
+    return S3Object(bucket=mock_app_bucket, key="output/result.bin", region=aws_region)
+
+
+def get_body(client, s3_object: S3Object) -> bytes:
+    response = client.get_object(Bucket=s3_object.bucket, Key=s3_object.key)
+    return response["Body"].read()
+
+
+def test_s3_write_stats():
+    assert S3WriteStats(size=100, parts=0, seconds=2.0).throughput == 50.0
+    assert S3WriteStats(size=100, parts=0, seconds=0.0).throughput == 0.0
+
+
+def test_s3_multipart_writer_part_size(s3_moto_client, s3_output):
+    with pytest.raises(ValueError):
+        S3MultipartWriter(s3_output, client=s3_moto_client, part_size=MB)
+
+
+def test_s3_multipart_writer(s3_moto_client, s3_output):
+    chunk = bytes(range(256)) * 4096  # 1 MB
+    with S3MultipartWriter(
+        s3_output, client=s3_moto_client, part_size=PART_SIZE, max_workers=2
+    ) as writer:
+        for _ in range(12):
+            writer.write(chunk)
+    assert writer.closed
+    assert writer.upload_id
+    assert writer.stats.size == 12 * MB
+    assert writer.stats.parts == 3
+    assert writer.stats.throughput > 0
+    assert get_body(s3_moto_client, s3_output) == chunk * 12
+    head = s3_moto_client.head_object(Bucket=s3_output.bucket, Key=s3_output.key)
+    assert head["ETag"].endswith('-3"')
+
+
+def test_s3_multipart_writer_single_put(s3_moto_client, s3_output):
+    with S3MultipartWriter(
+        s3_output,
+        client=s3_moto_client,
+        part_size=PART_SIZE,
+        extra_args={"ContentType": "text/plain"},
+    ) as writer:
+        writer.write(b"small ")
+        writer.write(b"output")
+    assert writer.upload_id is None
+    assert writer.stats.parts == 0
+    assert writer.stats.size == 12
+    assert get_body(s3_moto_client, s3_output) == b"small output"
+    head = s3_moto_client.head_object(Bucket=s3_output.bucket, Key=s3_output.key)
+    assert head["ContentType"] == "text/plain"
+
+
+def test_s3_multipart_writer_empty(s3_moto_client, s3_output):
+    with S3MultipartWriter(s3_output, client=s3_moto_client) as writer:
+        pass
+    assert writer.stats.size == 0
+    assert get_body(s3_moto_client, s3_output) == b""
+
+
+def test_s3_multipart_writer_abort_on_exception(s3_moto_client, s3_output):
+    with pytest.raises(RuntimeError):
+        with S3MultipartWriter(
+            s3_output, client=s3_moto_client, part_size=PART_SIZE
+        ) as writer:
+            writer.write(b"x" * (PART_SIZE + 1))
+            raise RuntimeError("handler failed")
+    assert writer.closed
+    assert writer.upload_id
+    uploads = s3_moto_client.list_multipart_uploads(Bucket=s3_output.bucket)
+    assert not uploads.get("Uploads")
+    objects = s3_moto_client.list_objects_v2(Bucket=s3_output.bucket)
+    assert objects["KeyCount"] == 0
+    with pytest.raises(ValueError):
+        writer.write(b"closed")
+
+
+def test_s3_multipart_writer_abort_on_part_failure(s3_moto_client, s3_output):
+    client = FailingPartClient(s3_moto_client, part_number=2)
+    writer = S3MultipartWriter(
+        s3_output, client=client, part_size=PART_SIZE, max_workers=1
+    )
+    with pytest.raises(IOError):
+        writer.write(b"x" * (3 * PART_SIZE))
+        writer.close()
+    assert writer.closed
+    uploads = s3_moto_client.list_multipart_uploads(Bucket=s3_output.bucket)
+    assert not uploads.get("Uploads")
+    objects = s3_moto_client.list_objects_v2(Bucket=s3_output.bucket)
+    assert objects["KeyCount"] == 0
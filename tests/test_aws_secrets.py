@@ -1,9 +1,22 @@
 import json
+import time
+from types import SimpleNamespace
+from typing import List
 
 import pytest
 from botocore.exceptions import ClientError
+from botocore.exceptions import EndpointConnectionError
 
+from example_app import resilience
+from example_app.aws_secrets import AWSCURRENT
+from example_app.aws_secrets import AWSPENDING
+from example_app.aws_secrets import SecretsBatch
+from example_app.aws_secrets import SecretsCache
+from example_app.aws_secrets import fetch_aws_secret_value
 from example_app.aws_secrets import get_aws_secret
+from example_app.aws_secrets import get_aws_secrets
+from example_app.resilience import CircuitOpenError
+from example_app.resilience import RetryPolicy
 
 
 def test_mock_app_secrets(secrets_moto_client):
@@ -27,3 +40,265 @@ def test_mock_app_secrets(secrets_moto_client):
 def test_mock_app_secrets_failure(secrets_moto_client):
     with pytest.raises(ClientError):
         get_aws_secret(secret_id="missing-secret", client=secrets_moto_client)
+
+
+@pytest.fixture
+def secrets_cache() -> SecretsCache:
+    return SecretsCache(ttl=60, max_size=2)
+
+
+@pytest.fixture
+def app_secret_name(secrets_moto_client, app_ro_secrets) -> str:
+    secret_name = "app-rds-cached"
+    secrets_moto_client.create_secret(
+        Name=secret_name, SecretString=json.dumps(app_ro_secrets)
+    )
+    return secret_name
+
+
+def test_secrets_cache_hit(secrets_cache, secrets_moto_client, app_secret_name, mocker):
+    spy = mocker.spy(secrets_moto_client, "get_secret_value")
+    secret = secrets_cache.get(app_secret_name, secrets_moto_client)
+    assert secrets_cache.get(app_secret_name, secrets_moto_client) == secret
+    assert spy.call_count == 1
+    # the cached secret cannot be modified by callers
+    secret["password"] = "modified"
+    assert secrets_cache.get(app_secret_name, secrets_moto_client) != secret
+
+
+def test_secrets_cache_json_array(secrets_cache, secrets_moto_client):
+    hosts = [["host-1", 5432], ["host-2", 5432]]
+    secrets_moto_client.create_secret(Name="app-hosts", SecretString=json.dumps(hosts))
+    assert secrets_cache.get("app-hosts", secrets_moto_client) == hosts
+    # a cached secret is the same JSON value, and a copy of it
+    secret = secrets_cache.get("app-hosts", secrets_moto_client)
+    assert secret == hosts
+    secret[0][1] = 0
+    assert secrets_cache.get("app-hosts", secrets_moto_client) == hosts
+
+
+def test_secrets_cache_ttl(secrets_cache, secrets_moto_client, app_secret_name, mocker):
+    spy = mocker.spy(secrets_moto_client, "get_secret_value")
+    secrets_cache.get(app_secret_name, secrets_moto_client, ttl=0.01)
+    time.sleep(0.02)
+    secrets_cache.get(app_secret_name, secrets_moto_client)
+    assert spy.call_count == 2
+
+
+def test_secrets_cache_size(secrets_cache, secrets_moto_client):
+    for i in range(3):
+        secrets_cache.put(f"secret-{i}", secrets_moto_client, {"i": i})
+    assert len(secrets_cache) == 2
+    secrets_cache.invalidate("secret-2")
+    assert len(secrets_cache) == 1
+    secrets_cache.invalidate()
+    assert len(secrets_cache) == 0
+
+
+def test_secrets_cache_version_stages(
+    secrets_cache, secrets_moto_client, app_secret_name
+):
+    current = secrets_cache.get(app_secret_name, secrets_moto_client, AWSCURRENT)
+    secrets_moto_client.put_secret_value(
+        SecretId=app_secret_name,
+        SecretString=json.dumps({"password": "rotated"}),
+        VersionStages=[AWSPENDING],
+    )
+    pending = secrets_cache.get(app_secret_name, secrets_moto_client, AWSPENDING)
+    assert pending == {"password": "rotated"}
+    assert secrets_cache.get(app_secret_name, secrets_moto_client) == current
+
+
+def test_secrets_cache_refresh(secrets_cache, secrets_moto_client, app_secret_name):
+    secrets_cache.get(app_secret_name, secrets_moto_client, ttl=0.5)
+    secrets_moto_client.put_secret_value(
+        SecretId=app_secret_name, SecretString=json.dumps({"password": "rotated"})
+    )
+    time.sleep(0.45)  # after the refresh time, before the cache expires
+    assert secrets_cache.get(app_secret_name, secrets_moto_client)["port"] == 5432
+    # a background refresh gets the new version
+    for _ in range(100):
+        secret = secrets_cache.get(app_secret_name, secrets_moto_client)
+        if secret == {"password": "rotated"}:
+            break
+        time.sleep(0.01)
+    assert secret == {"password": "rotated"}
+
+
+def test_secrets_cache_refresh_same_version(
+    secrets_cache, secrets_moto_client, app_secret_name, mocker
+):
+    spy = mocker.spy(secrets_moto_client, "get_secret_value")
+    secrets_cache.get(app_secret_name, secrets_moto_client, ttl=0.5)
+    time.sleep(0.45)
+    secrets_cache.get(app_secret_name, secrets_moto_client)
+    time.sleep(0.1)
+    # the refresh extends the TTL without getting the secret value again
+    secrets_cache.get(app_secret_name, secrets_moto_client)
+    assert spy.call_count == 1
+
+
+def test_get_aws_secret_cached(secrets_moto_client, app_secret_name, mocker):
+    spy = mocker.spy(secrets_moto_client, "get_secret_value")
+    secret = get_aws_secret(secret_id=app_secret_name, client=secrets_moto_client)
+    assert get_aws_secret(app_secret_name, secrets_moto_client) == secret
+    assert spy.call_count == 1
+    assert get_aws_secret(app_secret_name, secrets_moto_client, ttl=0) == secret
+    assert spy.call_count == 2
+
+
+def test_get_aws_secrets(
+    secrets_moto_client, mock_app_ro_secrets, mock_app_rw_secrets, mocker
+):
+    secret_ids = ["app-rds-readonly", "app-rds-write", "missing-secret"]
+    batch = get_aws_secrets(secret_ids, client=secrets_moto_client)
+    assert isinstance(batch, SecretsBatch)
+    assert batch.secrets == {
+        "app-rds-readonly": mock_app_ro_secrets,
+        "app-rds-write": mock_app_rw_secrets,
+    }
+    assert list(batch.errors) == ["missing-secret"]
+    assert isinstance(batch.errors["missing-secret"], ClientError)
+
+    # the secrets cache is filled
+    spy = mocker.spy(secrets_moto_client, "get_secret_value")
+    assert get_aws_secret("app-rds-write", secrets_moto_client) == mock_app_rw_secrets
+    assert spy.call_count == 0
+
+
+class SlowSecretsClient:
+    """A secretsmanager client stub, with a delay for each request"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.meta = SimpleNamespace(
+            region_name="us-west-2",
+            config=SimpleNamespace(region_name="us-west-2"),
+        )
+
+    def get_secret_value(self, SecretId: str, **kwargs):
+        time.sleep(self.delay)
+        return {"SecretString": json.dumps({"id": SecretId}), "VersionId": "v1"}
+
+    def batch_get_secret_value(self, SecretIdList: List[str]):
+        return {
+            "SecretValues": [
+                {"Name": s, "SecretString": json.dumps({"id": s}), "VersionId": "v1"}
+                for s in SecretIdList
+                if s != "batch-error"
+            ],
+            "Errors": [
+                {"SecretId": s, "ErrorCode": "ResourceNotFoundException"}
+                for s in SecretIdList
+                if s == "batch-error"
+            ],
+        }
+
+
+def test_get_aws_secrets_concurrency():
+    client = SlowSecretsClient(delay=0.2)
+    secret_ids = [f"secret-{i}" for i in range(8)]
+    start = time.monotonic()
+    batch = get_aws_secrets(secret_ids, client=client, ttl=0)
+    elapsed = time.monotonic() - start
+    assert elapsed < 0.2 * 4
+    assert batch.secrets == {s: {"id": s} for s in secret_ids}
+    assert not batch.errors
+
+
+def test_get_aws_secrets_batch():
+    client = SlowSecretsClient(delay=10)  # any GetSecretValue would be too slow
+    secret_ids = [f"secret-{i}" for i in range(25)] + ["batch-error"]
+    batch = get_aws_secrets(secret_ids, client=client, ttl=0, batch=True)
+    assert len(batch.secrets) == 25
+    error = batch.errors["batch-error"]
+    assert error.response["Error"]["Code"] == "ResourceNotFoundException"
+
+
+def test_get_aws_secrets_batch_request_error():
+    client = SlowSecretsClient(delay=0.01)
+    batch_get = client.batch_get_secret_value
+    get_secret_value = client.get_secret_value
+    fetched = []
+
+    def batch_get_secret_value(SecretIdList: List[str]):
+        if "secret-20" in SecretIdList:
+            raise client_error("ThrottlingException", 400)
+        return batch_get(SecretIdList)
+
+    def get_secret_value_spy(SecretId: str, **kwargs):
+        fetched.append(SecretId)
+        return get_secret_value(SecretId, **kwargs)
+
+    client.batch_get_secret_value = batch_get_secret_value
+    client.get_secret_value = get_secret_value_spy
+    secret_ids = [f"secret-{i}" for i in range(30)]
+    batch = get_aws_secrets(secret_ids, client=client, ttl=0, batch=True)
+    # the secrets of the failed batch request are retrieved one by one
+    assert batch.secrets == {s: {"id": s} for s in secret_ids}
+    assert not batch.errors
+    assert sorted(fetched) == sorted(secret_ids[20:])
+
+
+class FlakySecretsClient:
+    """A secretsmanager client stub, which raises the injected errors first"""
+
+    def __init__(self, *errors: Exception, region_name: str = "stub-region-1"):
+        self.errors = list(errors)
+        self.calls = 0
+        self.meta = SimpleNamespace(
+            region_name=region_name, config=SimpleNamespace(region_name=region_name)
+        )
+
+    def get_secret_value(self, SecretId: str, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"SecretString": json.dumps({"id": SecretId}), "VersionId": "v1"}
+
+
+def client_error(code: str, status: int) -> ClientError:
+    response = {
+        "Error": {"Code": code, "Message": code},
+        "ResponseMetadata": {"HTTPStatusCode": status},
+    }
+    return ClientError(response, "GetSecretValue")
+
+
+@pytest.fixture
+def breakers(monkeypatch, mocker):
+    monkeypatch.setattr(resilience, "CIRCUIT_BREAKERS", {})
+    mocker.patch.object(RetryPolicy, "delay", return_value=0.0)
+    return resilience.CIRCUIT_BREAKERS
+
+
+def test_fetch_aws_secret_value_retries(breakers):
+    client = FlakySecretsClient(client_error("InternalServiceError", 500))
+    response = fetch_aws_secret_value("stub", client)
+    assert json.loads(response["SecretString"]) == {"id": "stub"}
+    assert client.calls == 2
+    assert breakers["secretsmanager:stub-region-1"].stats().successes == 1
+
+
+def test_fetch_aws_secret_value_not_found(breakers):
+    client = FlakySecretsClient(client_error("ResourceNotFoundException", 400))
+    with pytest.raises(ClientError):
+        fetch_aws_secret_value("stub", client)
+    assert client.calls == 1
+    assert breakers["secretsmanager:stub-region-1"].state == "closed"
+
+
+def test_fetch_aws_secret_value_breaker(breakers):
+    errors = [EndpointConnectionError(endpoint_url="https://stub")] * 10
+    client = FlakySecretsClient(*errors)
+    for _ in range(3):
+        with pytest.raises(EndpointConnectionError):
+            fetch_aws_secret_value("stub", client)
+    # the open breaker fails fast, without a call to secretsmanager
+    with pytest.raises(CircuitOpenError):
+        fetch_aws_secret_value("stub", client)
+    assert client.calls == 5
+    assert breakers["secretsmanager:stub-region-1"].state == "open"
+    # the breakers are for each region
+    other_client = FlakySecretsClient(region_name="stub-region-2")
+    assert fetch_aws_secret_value("stub", other_client)
@@ -0,0 +1,84 @@
+import json
+from copy import deepcopy
+from typing import Dict
+from typing import List
+
+import pytest
+
+from example_app.aws_s3_event import S3Object
+from example_app.aws_sqs_batch import process_sqs_s3_batch
+from example_app.aws_sqs_batch import sqs_s3_batch_handler
+from tests.aws_events import sqs_event
+
+
+@pytest.fixture
+def mock_sqs_s3_batch(mock_s3_event_put) -> Dict:
+    s3_events = []
+    for key in ["foo/ok-1", "foo/bad", "foo/ok-2"]:
+        s3_event = deepcopy(mock_s3_event_put)
+        s3_event["Records"][0]["s3"]["object"]["key"] = key
+        s3_events.append(s3_event)
+    return sqs_event(*s3_events)
+
+
+def message_ids(event: Dict) -> List[str]:
+    return [record["messageId"] for record in event["Records"]]
+
+
+def fail_bad_keys(s3_object: S3Object):
+    if "bad" in s3_object.key:
+        raise ValueError(f"bad key: {s3_object.key}")
+
+
+def test_sqs_s3_batch_handler(mock_sqs_s3_batch):
+    processed = []
+
+    @sqs_s3_batch_handler
+    def handler(s3_object: S3Object):
+        fail_bad_keys(s3_object)
+        processed.append(s3_object.key)
+
+    response = handler(mock_sqs_s3_batch, None)
+    bad_message_id = message_ids(mock_sqs_s3_batch)[1]
+    assert response == {"batchItemFailures": [{"itemIdentifier": bad_message_id}]}
+    assert processed == ["foo/ok-1", "foo/ok-2"]
+    assert handler.__name__ == "handler"
+
+
+def test_sqs_s3_batch_handler_success(mock_sqs_s3_event):
+    handler = sqs_s3_batch_handler(lambda s3_object: None)
+    assert handler(mock_sqs_s3_event, None) == {"batchItemFailures": []}
+
+
+def test_process_sqs_s3_batch(mock_sqs_s3_batch):
+    results = process_sqs_s3_batch(mock_sqs_s3_batch, fail_bad_keys)
+    assert [r.message_id for r in results] == message_ids(mock_sqs_s3_batch)
+    assert [r.ok for r in results] == [True, False, True]
+    assert [s.key for s in results[1].s3_objects] == ["foo/bad"]
+    assert isinstance(results[1].error, ValueError)
+
+
+def test_process_sqs_s3_batch_malformed_message(mock_sqs_s3_batch):
+    mock_sqs_s3_batch["Records"][0]["body"] = "not-json"
+    results = process_sqs_s3_batch(mock_sqs_s3_batch, lambda s3_object: None)
+    assert [r.ok for r in results] == [False, True, True]
+
+
+def test_process_sqs_s3_batch_test_event():
+    test_event = {"Service": "Amazon S3", "Event": "s3:TestEvent"}
+    results = process_sqs_s3_batch(sqs_event(test_event), fail_bad_keys)
+    assert [r.ok for r in results] == [True]
+    assert results[0].s3_objects == []
+
+
+def test_process_sqs_s3_batch_fifo(mock_sqs_s3_batch):
+    for record in mock_sqs_s3_batch["Records"]:
+        record["eventSourceARN"] += ".fifo"
+    results = process_sqs_s3_batch(mock_sqs_s3_batch, fail_bad_keys)
+    # messages after a failure in a FIFO queue are not processed
+    assert [r.ok for r in results] == [True, False, False]
+    assert results[2].s3_objects == []
+
+
+def test_sqs_event_body(mock_sqs_s3_event, mock_s3_event_put):
+    assert json.loads(mock_sqs_s3_event["Records"][0]["body"]) == mock_s3_event_put
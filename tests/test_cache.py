@@ -0,0 +1,72 @@
+from example_app.cache import CacheStats
+from example_app.cache import TTLCache
+
+
+def test_cache_stats():
+    assert CacheStats(hits=3, misses=1, evictions=0, size=1).hit_ratio == 0.75
+    assert CacheStats(hits=0, misses=0, evictions=0, size=0).hit_ratio == 0.0
+
+
+def test_ttl_cache_get_put():
+    cache = TTLCache(max_size=2, ttl=60)
+    assert cache.get("a") is None
+    assert cache.get("a", "default") == "default"
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 2, 1)
+    cache.reset_stats()
+    assert cache.stats() == CacheStats(0, 0, 0, 1)
+
+
+def test_ttl_cache_expiry(mocker):
+    clock = mocker.patch("example_app.cache.time.monotonic", return_value=100.0)
+    cache = TTLCache(ttl=10)
+    cache.put("a", 1)
+    cache.put("b", 2, ttl=30)
+    clock.return_value = 115.0
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert len(cache) == 1
+
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats().evictions == 1
+
+
+def test_ttl_cache_invalidate():
+    cache = TTLCache()
+    for key in [("items", 1), ("items", 2), ("users", 1)]:
+        cache.put(key, key)
+    cache.invalidate(("items", 1))
+    assert cache.get(("items", 1)) is None
+    cache.invalidate(lambda key: key[0] == "items")
+    assert cache.get(("items", 2)) is None
+    assert cache.get(("users", 1)) == ("users", 1)
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_ttl_cache_update():
+    def increment(value):
+        value = (value or 0) + 1
+        return value, value * 10
+
+    cache = TTLCache(max_size=2)
+    assert cache.update("counter", increment) == 10
+    assert cache.update("counter", increment) == 20
+    assert cache.get("counter") == 2
+    assert cache.update("counter", increment, ttl=-1) == 30
+    # an expired value is None for the update
+    assert cache.update("counter", increment) == 10
+    cache.put("a", 1)
+    cache.update("b", increment)
+    assert cache.get("counter") is None
@@ -0,0 +1,218 @@
+import json
+import os
+
+import pytest
+
+from example_app.aws_s3_event import S3Object
+from example_app.db_copy import ChunkReader
+from example_app.db_copy import copy_s3_object
+from example_app.db_copy import copy_sql
+from example_app.db_copy import csv_field
+from example_app.db_copy import load_s3_event
+from example_app.db_copy import ndjson_to_csv
+from example_app.db_copy import quote_ident
+from example_app.db_copy import upsert_sql
+from example_app.db_pool import PgPool
+from tests.fake_postgres import FakePgConnect
+from tests.fake_postgres import FakePgConnection
+
+COLUMNS = ["id", "name", "tags"]
+
+NDJSON_RECORDS = [
+    {"id": 1, "name": "one", "tags": ["a", "b"]},
+    {"id": 2, "name": "two, with a comma"},
+    {"id": 3, "name": 'three "quoted"', "tags": [], "extra": True},
+]
+
+
+@pytest.fixture
+def put_s3_object(s3_moto_client, mock_app_bucket, aws_region):
+    def put(key: str, body: bytes) -> S3Object:
+        s3_moto_client.put_object(Bucket=mock_app_bucket, Key=key, Body=body)
+        return S3Object(bucket=mock_app_bucket, key=key, region=aws_region)
+
+    return put
+
+
+@pytest.fixture
+def ndjson_body() -> bytes:
+    return b"\n".join(json.dumps(r).encode() for r in NDJSON_RECORDS) + b"\n"
+
+
+def test_chunk_reader():
+    reader = ChunkReader([b"abc", b"", b"defg", b"h"])
+    assert reader.read(2) == b"ab"
+    assert reader.read(4) == b"cdef"
+    assert reader.read() == b"gh"
+    assert reader.read(4) == b""
+    assert reader.size == 8
+
+
+def test_ndjson_to_csv(ndjson_body):
+    # split the NDJSON into small chunks, so lines span chunks
+    chunks = [ndjson_body[i : i + 7] for i in range(0, len(ndjson_body), 7)]
+    csv_text = b"".join(ndjson_to_csv(chunks, COLUMNS)).decode()
+    assert csv_text.splitlines() == [
+        '1,one,"[""a"", ""b""]"',
+        '2,"two, with a comma",',
+        '3,"three ""quoted""",[]',
+    ]
+
+
+def test_ndjson_to_csv_null_and_empty_string():
+    chunks = [b'{"id": 1, "name": ""}\n{"id": 2, "name": null}\n{"id": 3}\n']
+    csv_text = b"".join(ndjson_to_csv(chunks, ["id", "name"])).decode()
+    # COPY reads an unquoted empty field as NULL, and "" as an empty string
+    assert csv_text.splitlines() == ['1,""', "2,", "3,"]
+
+
+def test_csv_field():
+    assert csv_field(None) == ""
+    assert csv_field("") == '""'
+    assert csv_field(1.5) == "1.5"
+    assert csv_field("line\nbreak") == '"line\nbreak"'
+    assert csv_field("\\.") == '"\\."'
+    assert csv_field({"a": "b"}) == '"{""a"": ""b""}"'
+
+
+def test_ndjson_to_csv_without_final_newline():
+    chunks = [b'{"id": 1}\n{"id"', b": 2}"]
+    assert b"".join(ndjson_to_csv(chunks, ["id"])) == b"1\n2\n"
+
+
+def test_quote_ident():
+    assert quote_ident("items") == '"items"'
+    assert quote_ident("app.items") == '"app"."items"'
+    assert quote_ident('bad"name') == '"bad""name"'
+
+
+def test_copy_sql():
+    sql = copy_sql("app.items", ["id", "name"], header=True)
+    assert sql == (
+        'COPY "app"."items" ("id", "name") FROM STDIN WITH (FORMAT csv, HEADER true)'
+    )
+
+
+def test_upsert_sql():
+    sql = upsert_sql("app.items", "_staging_items", ["id", "name"], ["id"])
+    assert sql == (
+        'INSERT INTO "app"."items" ("id", "name") '
+        'SELECT DISTINCT ON ("id") "id", "name" FROM "_staging_items" '
+        'ORDER BY "id", "_copy_row" DESC '
+        'ON CONFLICT ("id") DO UPDATE SET "name" = EXCLUDED."name"'
+    )
+    assert upsert_sql("items", "staging", ["id"], ["id"]).endswith("DO NOTHING")
+
+
+def test_copy_csv_s3_object(s3_moto_client, put_s3_object):
+    body = b"id,name\n1,one\n2,two\n3,three\n"
+    s3_object = put_s3_object("load/items.csv", body)
+    conn = FakePgConnection()
+    stats = copy_s3_object(
+        s3_object,
+        conn,
+        "app.items",
+        ["id", "name"],
+        client=s3_moto_client,
+        chunk_size=5,
+    )
+    assert b"".join(conn.copied) == body
+    assert conn.executed == [(copy_sql("app.items", ["id", "name"], True), None)]
+    assert stats.rows == 3
+    assert stats.size == len(body)
+    assert stats.table == "app.items"
+    assert stats.rows_per_second > 0
+    assert conn.commits == 0  # the caller commits
+
+
+def test_copy_ndjson_s3_object_upsert(s3_moto_client, put_s3_object, ndjson_body):
+    s3_object = put_s3_object("load/items.ndjson", ndjson_body)
+
+    def query(sql, params):
+        if sql.startswith("INSERT"):
+            return [()] * len(NDJSON_RECORDS)
+
+    conn = FakePgConnection(query)
+    stats = copy_s3_object(
+        s3_object,
+        conn,
+        "app.items",
+        COLUMNS,
+        upsert_keys=["id"],
+        client=s3_moto_client,
+    )
+    statements = [sql for sql, _ in conn.executed]
+    assert statements[0].startswith('CREATE TEMP TABLE "_staging_items"')
+    assert statements[1] == copy_sql("_staging_items", COLUMNS, header=False)
+    assert statements[2] == upsert_sql("app.items", "_staging_items", COLUMNS, ["id"])
+    assert statements[3] == 'DROP TABLE "_staging_items"'
+    assert b"".join(conn.copied).count(b"\n") == len(NDJSON_RECORDS)
+    assert stats.rows == len(NDJSON_RECORDS)
+
+
+def test_load_s3_event(s3_moto_client, put_s3_object, mocker):
+    s3_object = put_s3_object("load/items.csv", b"id\n1\n2\n")
+    event = {
+        "Records": [
+            {
+                "awsRegion": s3_object.region,
+                "s3": {
+                    "bucket": {"name": s3_object.bucket},
+                    "object": {"key": s3_object.key},
+                },
+            }
+        ]
+    }
+    mocker.patch("example_app.aws_s3_pipeline.boto_client", return_value=s3_moto_client)
+    fake_connect = FakePgConnect()
+    pool = PgPool({}, connect=fake_connect)
+    results = list(load_s3_event(event, "items", ["id"], pool=pool))
+    assert [(stats.s3_object, stats.rows) for stats in results] == [(s3_object, 2)]
+    assert fake_connect.connections[0].commits == 1
+
+
+@pytest.fixture
+def pg_conn():
+    """A connection to a real Postgres, from the APP_TEST_PG_DSN env-var"""
+    dsn = os.getenv("APP_TEST_PG_DSN")
+    if not dsn:
+        pytest.skip("APP_TEST_PG_DSN is not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    conn = psycopg2.connect(dsn)
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+def test_copy_ndjson_s3_object_upsert_postgres(s3_moto_client, put_s3_object, pg_conn):
+    records = [
+        {"id": 1, "name": "one", "tags": ["a"]},
+        {"id": 2, "name": ""},
+        {"id": 3, "name": None, "tags": {"k": "v"}},
+        {"id": 1, "name": "one again", "tags": []},  # the last row wins
+        {"id": 4, "name": "\\."},
+    ]
+    body = b"\n".join(json.dumps(r).encode() for r in records) + b"\n"
+    s3_object = put_s3_object("load/items.ndjson", body)
+    with pg_conn.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMP TABLE items (id int PRIMARY KEY, name text, tags jsonb)"
+        )
+        cursor.execute("INSERT INTO items VALUES (2, 'two', NULL)")
+    stats = copy_s3_object(
+        s3_object,
+        pg_conn,
+        "items",
+        COLUMNS,
+        upsert_keys=["id"],
+        client=s3_moto_client,
+    )
+    assert stats.rows == 4
+    with pg_conn.cursor() as cursor:
+        cursor.execute("SELECT id, name, tags FROM items ORDER BY id")
+        assert cursor.fetchall() == [
+            (1, "one again", []),
+            (2, "", None),
+            (3, None, {"k": "v"}),
+            (4, "\\.", None),
+        ]
@@ -0,0 +1,148 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from example_app import db_query
+from example_app.db_query import PREPARED_STATEMENTS
+from example_app.db_query import QUERY_CACHE
+from example_app.db_query import Query
+from example_app.db_query import execute_prepared
+from example_app.db_query import fetch_all
+from example_app.db_query import fetch_one
+from example_app.db_query import invalidate_query
+from example_app.db_query import invalidate_table
+from tests.fake_postgres import FakePgConnection
+from example_app.shared_cache import SharedCache
+from tests.fake_postgres import FakePgError
+
+ITEM_QUERY = Query(
+    name="get_item",
+    sql="SELECT id, name FROM app.items WHERE id = $1",
+    cache_ttl=60,
+    tables=("app.items",),
+)
+
+COUNT_QUERY = Query(name="count_items", sql="SELECT count(*) FROM app.items")
+
+
+def items_query(sql, params):
+    if sql.startswith("EXECUTE get_item"):
+        return [(params[0], f"item-{params[0]}")]
+    if sql.startswith("EXECUTE count_items"):
+        return [(10,)]
+
+
+@pytest.fixture
+def conn() -> FakePgConnection:
+    QUERY_CACHE.invalidate()
+    QUERY_CACHE.reset_stats()
+    yield FakePgConnection(items_query)
+    QUERY_CACHE.invalidate()
+
+
+def executed(conn: FakePgConnection):
+    return [sql for sql, _ in conn.executed]
+
+
+def test_execute_prepared(conn):
+    assert execute_prepared(conn, COUNT_QUERY) == [(10,)]
+    assert execute_prepared(conn, COUNT_QUERY) == [(10,)]
+    assert executed(conn) == [
+        f"PREPARE count_items AS {COUNT_QUERY.sql}",
+        "EXECUTE count_items",
+        "EXECUTE count_items",
+    ]
+    assert "count_items" in PREPARED_STATEMENTS.names(conn)
+
+
+def test_execute_prepared_params(conn):
+    assert execute_prepared(conn, ITEM_QUERY, (1,)) == [(1, "item-1")]
+    assert conn.executed[-1] == ("EXECUTE get_item (%s)", (1,))
+
+
+def test_execute_prepared_per_connection(conn):
+    other_conn = FakePgConnection(items_query)
+    execute_prepared(conn, COUNT_QUERY)
+    execute_prepared(other_conn, COUNT_QUERY)
+    assert executed(other_conn)[0].startswith("PREPARE count_items")
+
+
+def test_execute_prepared_error(conn):
+    def failing_query(sql, params):
+        if sql.startswith("EXECUTE get_item") and params == (0,):
+            raise FakePgError("canceling statement due to statement timeout", "57014")
+        return items_query(sql, params)
+
+    conn.query = failing_query
+    execute_prepared(conn, ITEM_QUERY, (1,))
+    with pytest.raises(FakePgError):
+        execute_prepared(conn, ITEM_QUERY, (0,))
+    # the statement is still prepared for the session, e.g. after a rollback
+    conn.rollback()
+    assert execute_prepared(conn, ITEM_QUERY, (2,)) == [(2, "item-2")]
+    assert executed(conn).count(f"PREPARE get_item AS {ITEM_QUERY.sql}") == 1
+
+
+def test_execute_prepared_not_prepared(conn):
+    execute_prepared(conn, COUNT_QUERY)
+    # e.g. the session was reset by a connection proxy
+    conn.prepared.clear()
+    with pytest.raises(FakePgError):
+        execute_prepared(conn, COUNT_QUERY)
+    assert "count_items" not in PREPARED_STATEMENTS.names(conn)
+    assert execute_prepared(conn, COUNT_QUERY) == [(10,)]
+
+
+def test_fetch_all_cache(conn):
+    assert fetch_all(conn, ITEM_QUERY, (1,)) == [(1, "item-1")]
+    assert fetch_all(conn, ITEM_QUERY, (1,)) == [(1, "item-1")]
+    assert fetch_all(conn, ITEM_QUERY, (2,)) == [(2, "item-2")]
+    assert executed(conn).count("EXECUTE get_item (%s)") == 2
+    stats = QUERY_CACHE.stats()
+    assert (stats.hits, stats.misses) == (1, 2)
+    assert stats.hit_ratio == pytest.approx(1 / 3)
+
+
+def test_fetch_all_shared_cache(conn, tmp_path, monkeypatch):
+    shared_cache = SharedCache(str(tmp_path / "query.cache"), slots=16)
+    monkeypatch.setattr(db_query, "QUERY_CACHE", shared_cache)
+    price_query = Query(name="get_price", sql="SELECT ..", cache_ttl=60)
+    price_row = (1, Decimal("9.99"), datetime.date(2020, 1, 1))
+    conn.query = lambda sql, params: (
+        [price_row] if sql.startswith("EXECUTE get_price") else items_query(sql, params)
+    )
+    # the rows are tuples, from the cursor and from the cache
+    assert fetch_all(conn, ITEM_QUERY, (1,)) == [(1, "item-1")]
+    assert fetch_all(conn, ITEM_QUERY, (1,)) == [(1, "item-1")]
+    assert executed(conn).count("EXECUTE get_item (%s)") == 1
+    # the rows that are not JSON are not cached
+    assert fetch_all(conn, price_query) == [price_row]
+    assert fetch_all(conn, price_query) == [price_row]
+    assert executed(conn).count("EXECUTE get_price") == 2
+    assert fetch_all(conn, ITEM_QUERY, (Decimal("1"),)) == [(Decimal("1"), "item-1")]
+    shared_cache.close()
+
+
+def test_fetch_all_without_cache(conn):
+    fetch_all(conn, COUNT_QUERY)
+    fetch_all(conn, COUNT_QUERY)
+    assert executed(conn).count("EXECUTE count_items") == 2
+    assert len(QUERY_CACHE) == 0
+
+
+def test_fetch_one(conn):
+    assert fetch_one(conn, ITEM_QUERY, (3,)) == (3, "item-3")
+    empty = Query(name="empty", sql="SELECT 1 WHERE false")
+    assert fetch_one(conn, empty) is None
+
+
+def test_invalidate(conn):
+    fetch_all(conn, ITEM_QUERY, (1,))
+    invalidate_query(ITEM_QUERY)
+    fetch_all(conn, ITEM_QUERY, (1,))
+    invalidate_table("app.users")
+    fetch_all(conn, ITEM_QUERY, (1,))
+    invalidate_table("app.items")
+    fetch_all(conn, ITEM_QUERY, (1,))
+    assert executed(conn).count("EXECUTE get_item (%s)") == 3
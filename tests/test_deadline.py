@@ -0,0 +1,109 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from example_app import deadline
+from example_app.deadline import REQUEST_DEADLINE
+from example_app.deadline import DeadlineExceeded
+from example_app.deadline import DeadlineMiddleware
+from example_app.deadline import add_request_deadline
+from example_app.deadline import deadline_context
+from example_app.deadline import deadline_timeout
+from example_app.deadline import remaining_time
+
+
+def deadline_app(**kwargs) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/remaining")
+    def remaining():
+        return {"remaining": remaining_time()}
+
+    @app.get("/slow")
+    def slow():
+        time.sleep(0.02)
+        return {"timeout": deadline_timeout(5.0)}
+
+    add_request_deadline(app)
+    if kwargs:
+        app.add_middleware(DeadlineMiddleware, **kwargs)
+    return app
+
+
+def test_deadline_timeout_without_deadline():
+    assert remaining_time() is None
+    assert deadline_timeout() is None
+    assert deadline_timeout(5.0) == 5.0
+
+
+def test_deadline_timeout(request_deadline):
+    request_deadline(2.0)
+    assert 1.9 < remaining_time() <= 2.0
+    assert deadline_timeout(1.0) == 1.0
+    assert 1.9 < deadline_timeout(5.0) <= 2.0
+    assert 1.9 < deadline_timeout() <= 2.0
+
+
+def test_deadline_timeout_exceeded(request_deadline):
+    request_deadline(-0.1)
+    assert remaining_time() < 0
+    with pytest.raises(DeadlineExceeded):
+        deadline_timeout(5.0)
+
+
+def test_deadline_context(monkeypatch):
+    monkeypatch.setattr(deadline, "DEADLINE_MARGIN_MS", 500)
+
+    @deadline_context
+    def handler(event, context):
+        return remaining_time()
+
+    context = SimpleNamespace(get_remaining_time_in_millis=lambda: 3000)
+    assert 2.4 < handler({}, context) <= 2.5
+    assert REQUEST_DEADLINE.get() is None
+    # a context without the remaining time, e.g. in tests, has no deadline
+    assert handler({}, SimpleNamespace()) is None
+
+
+def test_deadline_context_exceeded():
+    @deadline_context
+    def handler(event, context):
+        return deadline_timeout(5.0)
+
+    # the remaining time is less than the margin
+    context = SimpleNamespace(get_remaining_time_in_millis=lambda: 100)
+    with pytest.raises(DeadlineExceeded):
+        handler({}, context)
+    assert REQUEST_DEADLINE.get() is None
+
+
+def test_deadline_middleware():
+    client = TestClient(deadline_app(budget_ms=1000))
+    remaining = client.get("/remaining").json()["remaining"]
+    assert 0.9 < remaining <= 1.0
+    assert REQUEST_DEADLINE.get() is None
+
+
+def test_deadline_middleware_exceeded():
+    client = TestClient(deadline_app(budget_ms=10))
+    response = client.get("/slow")
+    assert response.status_code == 504
+    assert response.json() == {"detail": "Gateway Timeout"}
+
+
+def test_deadline_middleware_keeps_deadline(request_deadline):
+    # e.g. the deadline from the Lambda context of the handler
+    request_deadline(5.0)
+    client = TestClient(deadline_app(budget_ms=1000))
+    assert client.get("/remaining").json()["remaining"] > 4.9
+
+
+def test_add_request_deadline(monkeypatch):
+    app = FastAPI()
+    assert not add_request_deadline(app)
+    assert DeadlineExceeded in app.exception_handlers
+    monkeypatch.setattr(deadline, "REQUEST_BUDGET_MS", 1000)
+    assert add_request_deadline(FastAPI())
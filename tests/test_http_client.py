@@ -0,0 +1,143 @@
+import asyncio
+import threading
+
+import pytest
+import requests
+
+from example_app.deadline import DeadlineExceeded
+from example_app.http_client import HttpClient
+from example_app.http_client import ResponseCache
+from example_app.http_client import cache_ttl
+from tests.https_stub import HttpsStub
+
+
+@pytest.fixture
+def https_stub(tmp_path) -> HttpsStub:
+    with HttpsStub(tmp_path) as stub:
+        yield stub
+
+
+@pytest.fixture
+def http_client(https_stub) -> HttpClient:
+    client = HttpClient(pool_maxsize=4, verify=https_stub.cert_path)
+    yield client
+    client.close()
+
+
+def test_http_client_reuses_connections(http_client, https_stub):
+    for i in range(5):
+        response = http_client.get(f"{https_stub.url}/items/{i}")
+        assert response.status_code == 200
+        assert response.json() == {"path": f"/items/{i}"}
+    assert https_stub.requests == 5
+    assert https_stub.connections == 1
+
+
+def test_requests_get_opens_connections(https_stub):
+    # the module-level requests.get opens a connection for each request
+    for _ in range(3):
+        requests.get(https_stub.url, verify=https_stub.cert_path, timeout=5)
+    assert https_stub.connections == 3
+
+
+def test_http_client_threads(http_client, https_stub):
+    def get_items():
+        for _ in range(5):
+            assert http_client.get(https_stub.url).status_code == 200
+
+    threads = [threading.Thread(target=get_items) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert https_stub.requests == 20
+    assert https_stub.connections <= http_client.pool_maxsize
+
+
+def test_http_client_async(http_client, https_stub):
+    async def get_items():
+        return await asyncio.gather(
+            *[http_client.async_get(f"{https_stub.url}/{i}") for i in range(8)]
+        )
+
+    responses = asyncio.run(get_items())
+    assert [r.json()["path"] for r in responses] == [f"/{i}" for i in range(8)]
+    response = asyncio.run(http_client.async_request("GET", https_stub.url))
+    assert response.status_code == 200
+    assert https_stub.connections <= http_client.pool_maxsize
+
+
+def test_http_client_timeout(request_deadline):
+    client = HttpClient(connect_timeout=3.0, read_timeout=10.0)
+    assert client.timeout() == (3.0, 10.0)
+    assert client.timeout(5.0) == 5.0
+    request_deadline(2.0)
+    connect_timeout, read_timeout = client.timeout()
+    assert connect_timeout <= 2.0 and read_timeout <= 2.0
+    request_deadline(-0.1)
+    with pytest.raises(DeadlineExceeded):
+        client.get("https://localhost:1")
+
+
+def test_http_client_new_session_after_fork(http_client, mocker):
+    session = http_client.session
+    assert http_client.session is session
+    mocker.patch("example_app.http_client.os.getpid", return_value=-1)
+    assert http_client.session is not session
+
+
+def test_cache_ttl():
+    assert cache_ttl({}, default=300) == 300
+    assert cache_ttl({"cache-control": "public, max-age=3600"}) == 3600
+    assert cache_ttl({"cache-control": "no-store"}) == 0
+    assert cache_ttl({"cache-control": "private, max-age=60"}) == 0
+    assert cache_ttl({"expires": "Thu, 01 Jan 1970 00:00:00 GMT"}) == 0
+    assert cache_ttl({"expires": "Fri, 01 Jan 2100 00:00:00 GMT"}) > 0
+    assert cache_ttl({"expires": "invalid"}) == 0
+
+
+def test_http_client_response_cache(tmp_path):
+    cache_dir = str(tmp_path / "http-cache")
+    with HttpsStub(tmp_path, headers={"Cache-Control": "max-age=60"}) as stub:
+        client = HttpClient(cache_dir=cache_dir, verify=stub.cert_path)
+        url = f"{stub.url}/.well-known/jwks.json"
+        response = client.get(url, cache=True)
+        assert client.get(url, cache=True).json() == response.json()
+        assert stub.requests == 1
+        # another client, e.g. in another worker, has the same cache
+        other_client = HttpClient(cache_dir=cache_dir, verify=stub.cert_path)
+        cached = other_client.get(url, cache=True)
+        assert cached.json() == {"path": "/.well-known/jwks.json"}
+        assert cached.headers["content-type"] == "application/json"
+        assert stub.requests == 1
+        # only the GETs with cache=True use the cache
+        client.get(url)
+        assert stub.requests == 2
+        client.cache.clear()
+        client.get(url, cache=True)
+        assert stub.requests == 3
+
+
+def test_http_client_response_not_cached(tmp_path):
+    cache_dir = str(tmp_path / "http-cache")
+    with HttpsStub(tmp_path, headers={"Cache-Control": "no-store"}) as stub:
+        client = HttpClient(cache_dir=cache_dir, verify=stub.cert_path)
+        client.get(stub.url, cache=True)
+        client.get(stub.url, cache=True)
+        assert stub.requests == 2
+
+
+def test_response_cache_expiry(tmp_path, mocker):
+    cache = ResponseCache(str(tmp_path), ttl=10)
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'{"keys": []}'
+    response.encoding = "utf-8"
+    clock = mocker.patch("example_app.http_client.time.time", return_value=100.0)
+    assert cache.put("https://example.com/jwks.json", response)
+    assert cache.get("https://example.com/jwks.json").json() == {"keys": []}
+    assert cache.get("https://example.com/other.json") is None
+    clock.return_value = 110.0
+    assert cache.get("https://example.com/jwks.json") is None
+    response.status_code = 500
+    assert not cache.put("https://example.com/jwks.json", response)
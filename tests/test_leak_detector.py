@@ -0,0 +1,120 @@
+import logging
+import tracemalloc
+
+import pytest
+
+from example_app import aws_authorizer
+from example_app.aws_authorizer import aws_auth_handler
+from example_app.leak_detector import LeakDetector
+from example_app.leak_detector import assert_bounded_growth
+from example_app.leak_detector import detect_leaks
+from example_app.leak_detector import measure_growth
+from example_app.main import app
+from example_app.main import create_asgi_handler
+
+LEAKED = []
+
+
+def leaky_handler(event, context):
+    LEAKED.append(bytearray(1024))
+    return {"statusCode": 200}
+
+
+def bounded_handler(event, context):
+    data = [bytearray(1024) for _ in range(4)]
+    return {"statusCode": 200, "size": len(data)}
+
+
+@pytest.fixture
+def leaked():
+    yield LEAKED
+    LEAKED.clear()
+
+
+@pytest.fixture
+def ping_event():
+    return {
+        "resource": "/{proxy+}",
+        "path": "/ping",
+        "httpMethod": "GET",
+        "headers": {"Host": "api-id.execute-api.us-west-2.amazonaws.com"},
+        "multiValueHeaders": {},
+        "queryStringParameters": None,
+        "multiValueQueryStringParameters": None,
+        "body": None,
+        "isBase64Encoded": False,
+        "requestContext": {
+            "resourcePath": "/{proxy+}",
+            "httpMethod": "GET",
+            "requestId": "request-id",
+            "stage": "dev",
+            "identity": {"sourceIp": "192.168.100.1"},
+        },
+    }
+
+
+def test_detect_leaks_disabled():
+    assert detect_leaks(leaky_handler, enabled=False) is leaky_handler
+
+
+def test_detect_leaks(leaked, caplog):
+    handler = detect_leaks(leaky_handler, enabled=True, interval=100, top=3)
+    detector = handler.leak_detector
+    try:
+        with caplog.at_level(logging.WARNING):
+            for _ in range(201):
+                assert handler({}, None) == {"statusCode": 200}
+    finally:
+        detector.stop()
+    assert not tracemalloc.is_tracing()
+    assert detector.invocations == 201
+    assert len(detector.reports) == 2
+    for report in detector.reports:
+        assert report.invocations == 100
+        assert report.growth >= 100 * 1024
+        assert "test_leak_detector.py" in report.growers[0].site
+        assert report.growers[0].count_diff >= 100
+    assert "invocations of leaky_handler" in caplog.text
+
+
+def test_leak_detector_check(leaked):
+    detector = LeakDetector("handler", interval=10)
+    detector.start()
+    try:
+        detector.invoked()
+        leaky_handler({}, None)
+        report = detector.check()
+    finally:
+        detector.stop()
+    assert report.growth >= 1024
+    assert len(report.growers) <= detector.top
+
+
+def test_measure_growth(leaked):
+    report = measure_growth(leaky_handler, [{}] * 300, warmup=100)
+    assert report.invocations == 200
+    assert report.growth >= 200 * 1024
+    assert "test_leak_detector.py" in report.growers[0].site
+
+
+def test_assert_bounded_growth(leaked):
+    assert_bounded_growth(bounded_handler, [{}] * 1000, max_growth=16 * 1024)
+    with pytest.raises(AssertionError, match="test_leak_detector.py"):
+        assert_bounded_growth(leaky_handler, [{}] * 1000, max_growth=16 * 1024)
+
+
+def test_asgi_handler_bounded_growth(ping_event):
+    handler = create_asgi_handler(app)
+    assert_bounded_growth(handler, [ping_event] * 2000, max_growth=64 * 1024)
+
+
+def test_auth_handler_bounded_growth(monkeypatch):
+    # the error logs would otherwise grow the stdout captured by pytest
+    monkeypatch.setattr(aws_authorizer.LOGGER, "disabled", True)
+    # invalid tokens are rejected without fetching the JWKS
+    method_arn = "arn:aws:execute-api:us-west-2:123456789012:api-id/dev/GET/ping"
+    events = [
+        {"type": "TOKEN", "methodArn": method_arn},
+        {"type": "TOKEN", "authorizationToken": "Bearer abc", "methodArn": method_arn},
+    ]
+    assert_bounded_growth(aws_auth_handler, events * 1000, max_growth=64 * 1024)
@@ -0,0 +1,242 @@
+import io
+import json
+import logging
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from example_app import logger as app_logger
+from example_app.logger import QueueLogWriter
+from example_app.logger import REQUEST_ID
+from example_app.logger import get_logger
+from example_app.logger import logging_context
+
+
+class SlowStream(io.StringIO):
+    """A stream that records the thread of each write"""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+        self.writes = 0
+
+    def write(self, s):
+        self.threads.add(threading.current_thread().name)
+        self.writes += 1
+        time.sleep(0.001)
+        return super().write(s)
+
+
+@pytest.fixture
+def queue_writer():
+    writer = QueueLogWriter(stream=SlowStream(), batch_size=50)
+    yield writer
+    writer.stop()
+
+
+@pytest.fixture
+def queue_logger(queue_writer):
+    logger = logging.getLogger("tests.queue_logger")
+    logger.handlers = [queue_writer.handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger
+    logger.handlers = []
+
+
+def test_get_logger_stream_mode():
+    logger = get_logger("tests.stream_logger")
+    assert [type(h) for h in logger.handlers] == [logging.StreamHandler]
+    # a second call does not add handlers
+    assert get_logger("tests.stream_logger").handlers == logger.handlers
+
+
+def test_get_logger_queue_mode(monkeypatch):
+    monkeypatch.setattr(app_logger, "LOG_MODE", "queue")
+    logger = get_logger("tests.queue_mode_logger")
+    assert [type(h) for h in logger.handlers] == [app_logger.LogQueueHandler]
+    assert logger.handlers[0] is app_logger.get_queue_writer().handler
+
+
+def test_queue_writer_json_lines(queue_writer, queue_logger):
+    payload = {"a": 1}
+    token = REQUEST_ID.set("request-1")
+    try:
+        queue_logger.info("payload: %s", payload)
+    finally:
+        REQUEST_ID.reset(token)
+    payload["a"] = 2  # the message is merged when it is logged
+    queue_writer.flush()
+
+    stream = queue_writer.stream
+    assert stream.threads == {"log-writer"}
+    entry = json.loads(stream.getvalue())
+    assert entry["message"] == "payload: {'a': 1}"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "tests.queue_logger"
+    assert entry["request_id"] == "request-1"
+    assert entry["timestamp"].endswith("Z")
+
+
+def test_queue_writer_exception(queue_writer, queue_logger):
+    try:
+        raise ValueError("oops")
+    except ValueError:
+        queue_logger.exception("failed")
+    queue_writer.flush()
+    entry = json.loads(queue_writer.stream.getvalue())
+    assert entry["message"] == "failed"
+    assert "ValueError: oops" in entry["exception"]
+
+
+def test_queue_writer_batches(queue_writer, queue_logger):
+    for i in range(200):
+        queue_logger.info("message %d", i)
+    queue_writer.flush()
+    lines = queue_writer.stream.getvalue().splitlines()
+    assert [json.loads(line)["message"] for line in lines] == [
+        f"message {i}" for i in range(200)
+    ]
+    assert queue_writer.stream.writes < 200
+
+
+def test_queue_writer_stop(queue_logger, queue_writer):
+    queue_logger.info("last words")
+    queue_writer.stop()
+    assert "last words" in queue_writer.stream.getvalue()
+    queue_writer.flush()  # a no-op after stop
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_queue_writer_after_fork(tmp_path, monkeypatch):
+    log_path = tmp_path / "queue.log"
+    with open(log_path, "a") as stream:
+        writer = QueueLogWriter(stream=stream)
+        monkeypatch.setattr(app_logger, "_QUEUE_WRITER", writer)
+        monkeypatch.setattr(app_logger, "LOG_MODE", "queue")
+        logger = get_logger("tests.fork_logger")
+        logger.setLevel(logging.INFO)
+        logger.info("parent")
+        pid = os.fork()
+        if pid == 0:
+            # the worker process, as in Supervisor.spawn
+            exit_code = 1
+            try:
+                logger.info("child %d", os.getpid())
+                app_logger.flush_logs()
+                exit_code = 0
+            finally:
+                os._exit(exit_code)  # pylint: disable=protected-access
+        _, status = os.waitpid(pid, 0)
+        writer.stop()
+        logger.handlers = []
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    messages = [
+        json.loads(line)["message"] for line in log_path.read_text().splitlines()
+    ]
+    assert sorted(messages) == sorted(["parent", f"child {pid}"])
+
+
+def test_logging_context(queue_writer, queue_logger, monkeypatch):
+    monkeypatch.setattr(app_logger, "_QUEUE_WRITER", queue_writer)
+
+    @logging_context
+    def handler(event, context):
+        queue_logger.info("handled %s", event)
+        return "done"
+
+    context = SimpleNamespace(aws_request_id="request-2")
+    assert handler("event", context) == "done"
+    assert REQUEST_ID.get() is None
+    # the log queue is flushed before the handler returns
+    entry = json.loads(queue_writer.stream.getvalue())
+    assert entry["message"] == "handled event"
+    assert entry["request_id"] == "request-2"
+
+
+@pytest.fixture
+def debug_sampling(monkeypatch):
+    monkeypatch.setattr(app_logger, "LOG_DEBUG_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(app_logger, "LOG_DEBUG_HEADER", "x-debug-log")
+    monkeypatch.setattr(app_logger, "LOG_DEBUG_TRACE_SAMPLED", True)
+    assert app_logger.debug_sampling_enabled()
+
+
+@pytest.fixture
+def info_logger():
+    logger = get_logger("tests.info_logger")
+    logger.setLevel(logging.INFO)
+    stream = io.StringIO()
+    logger.handlers = [app_logger.get_stream_handler(stream)]
+    yield logger
+    logger.handlers = []
+
+
+def test_request_log_level(debug_sampling, monkeypatch):
+    request_log_level = app_logger.request_log_level
+    assert request_log_level() == logging.INFO
+    assert request_log_level({"x-debug-log": "true"}) == logging.DEBUG
+    assert request_log_level({"x-debug-log": "0"}) == logging.INFO
+    trace = "Root=1-5759e988-bd862e3fe1be46a994272793;Sampled=1"
+    assert request_log_level({"x-amzn-trace-id": trace}) == logging.DEBUG
+
+    monkeypatch.setattr(app_logger, "LOG_DEBUG_SAMPLE_RATE", 1.0)
+    assert request_log_level() == logging.DEBUG
+
+
+def test_request_scoped_logger(info_logger):
+    assert isinstance(info_logger, app_logger.RequestScopedLogger)
+    stream = info_logger.handlers[0].stream
+    info_logger.debug("not logged")
+    token = app_logger.REQUEST_LOG_LEVEL.set(logging.DEBUG)
+    try:
+        assert info_logger.isEnabledFor(logging.DEBUG)
+        info_logger.debug("logged")
+    finally:
+        app_logger.REQUEST_LOG_LEVEL.reset(token)
+    assert not info_logger.isEnabledFor(logging.DEBUG)
+    assert "not logged" not in stream.getvalue()
+    assert "logged" in stream.getvalue()
+
+
+def test_logging_context_debug_sampling(debug_sampling, info_logger):
+    @logging_context
+    def handler(event, context):
+        info_logger.debug("debug %s", event["path"])
+        return "done"
+
+    handler({"path": "/info", "headers": {}}, None)
+    handler({"path": "/debug", "headers": {"X-Debug-Log": "1"}}, None)
+    output = info_logger.handlers[0].stream.getvalue()
+    assert "debug /info" not in output
+    assert "debug /debug" in output
+
+
+def test_request_log_level_middleware(debug_sampling, info_logger):
+    app = FastAPI()
+
+    @app.get("/debug")
+    def debug():
+        info_logger.debug("debug route")
+        return {}
+
+    assert app_logger.add_request_log_level(app)
+    client = TestClient(app)
+    assert client.get("/debug").status_code == 200
+    assert "debug route" not in info_logger.handlers[0].stream.getvalue()
+    assert client.get("/debug", headers={"X-Debug-Log": "1"}).status_code == 200
+    assert "debug route" in info_logger.handlers[0].stream.getvalue()
+
+
+def test_add_request_log_level_disabled(monkeypatch):
+    monkeypatch.setattr(app_logger, "LOG_DEBUG_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(app_logger, "LOG_DEBUG_HEADER", "")
+    monkeypatch.setattr(app_logger, "LOG_DEBUG_TRACE_SAMPLED", False)
+    app = FastAPI()
+    assert not app_logger.add_request_log_level(app)
+    assert not app.user_middleware
@@ -1,6 +1,10 @@
+import json
+from types import SimpleNamespace
+
 from starlette.testclient import TestClient
 
 from example_app.main import app
+from example_app.main import create_asgi_handler
 
 client = TestClient(app)
 
@@ -17,3 +21,28 @@ def test_app_version():
     assert response.status_code == 200
     data = response.json()
     assert data["version"] == app.VERSION
+
+
+def test_asgi_handler_ping():
+    event = {
+        "resource": "/{proxy+}",
+        "path": "/ping",
+        "httpMethod": "GET",
+        "headers": {"Host": "api-id.execute-api.us-west-2.amazonaws.com"},
+        "multiValueHeaders": {},
+        "queryStringParameters": None,
+        "multiValueQueryStringParameters": None,
+        "body": None,
+        "isBase64Encoded": False,
+        "requestContext": {
+            "resourcePath": "/{proxy+}",
+            "httpMethod": "GET",
+            "requestId": "request-id",
+            "stage": "dev",
+            "identity": {"sourceIp": "192.168.100.1"},
+        },
+    }
+    handler = create_asgi_handler(app)
+    response = handler(event, SimpleNamespace(aws_request_id="request-id"))
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["ping"] == "pong!"
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from example_app import profiler
+from example_app.profiler import ProfilerMiddleware
+from example_app.profiler import ProfileWriter
+from example_app.profiler import StackSampler
+from example_app.profiler import profile_token
+from example_app.profiler import verify_profile_token
+
+
+@pytest.fixture
+def profile_writer(tmp_path) -> ProfileWriter:
+    return ProfileWriter(profile_dir=str(tmp_path), max_bytes=4096, max_files=3)
+
+
+def profiled_app(profile_writer, sample_rate=0.0, secret=None) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/slow")
+    def slow():
+        time.sleep(0.05)
+        return {"slow": True}
+
+    app.add_middleware(
+        ProfilerMiddleware,
+        sample_rate=sample_rate,
+        secret=secret,
+        writer=profile_writer,
+    )
+    return app
+
+
+def test_profile_token():
+    token = profile_token("secret", "get", "/slow")
+    assert verify_profile_token(token, "secret", "GET", "/slow")
+    assert not verify_profile_token(token, "other-secret", "GET", "/slow")
+    assert not verify_profile_token(token, "secret", "GET", "/fast")
+    assert not verify_profile_token("garbage", "secret", "GET", "/slow")
+    expired = profile_token("secret", "GET", "/slow", int(time.time()) - 3600)
+    assert not verify_profile_token(expired, "secret", "GET", "/slow")
+
+
+def test_stack_sampler():
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    time.sleep(0.05)
+    sampler.stop()
+    assert sampler.samples
+    lines = sampler.collapsed_lines(max_bytes=10 ** 6)
+    assert all(line.endswith("\n") for line in lines)
+    assert "test_stack_sampler" in "".join(lines)
+    assert sampler.collapsed_lines(max_bytes=0) == []
+
+
+def test_profiler_sampled_request(profile_writer, tmp_path):
+    client = TestClient(profiled_app(profile_writer, sample_rate=1.0))
+    response = client.get("/slow")
+    assert response.status_code == 200
+    profiles = list(tmp_path.glob("*.collapsed"))
+    assert len(profiles) == 1
+    assert "slow" in profiles[0].name
+    assert profiles[0].stat().st_size <= profile_writer.max_bytes
+
+
+def test_profiler_rotation(profile_writer, tmp_path):
+    client = TestClient(profiled_app(profile_writer, sample_rate=1.0))
+    for _ in range(5):
+        assert client.get("/slow").status_code == 200
+    assert len(list(tmp_path.glob("*.collapsed"))) == profile_writer.max_files
+
+
+def test_profiler_signed_request(profile_writer, tmp_path):
+    client = TestClient(profiled_app(profile_writer, secret="secret"))
+    assert client.get("/slow").status_code == 200
+    assert not list(tmp_path.glob("*.collapsed"))
+
+    headers = {"X-Profile-Token": profile_token("secret", "GET", "/slow")}
+    assert client.get("/slow", headers=headers).status_code == 200
+    assert len(list(tmp_path.glob("*.collapsed"))) == 1
+
+
+def test_add_profiler_disabled(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_ENABLED", False)
+    monkeypatch.setattr(profiler, "PROFILE_SECRET", None)
+    app = FastAPI()
+    assert not profiler.add_profiler(app)
+    assert not app.user_middleware
+
+
+def test_add_profiler_enabled(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_ENABLED", True)
+    monkeypatch.setattr(profiler, "PROFILE_SAMPLE_RATE", 0.01)
+    app = FastAPI()
+    assert profiler.add_profiler(app)
+    assert app.user_middleware[0].cls is ProfilerMiddleware
@@ -0,0 +1,122 @@
+import pytest
+from fastapi import FastAPI
+from starlette.testclient import TestClient
+
+from example_app.cache import TTLCache
+from example_app.rate_limit import RateLimit
+from example_app.rate_limit import RateLimitMiddleware
+from example_app.rate_limit import parse_route_limits
+from example_app.rate_limit import request_principal
+from example_app.rate_limit import take_token
+from example_app.shared_cache import SharedCache
+
+
+def limited_app(**kwargs) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    def ping():
+        return {"ping": "pong!"}
+
+    @app.get("/api/v1/example")
+    def example():
+        return {"example": True}
+
+    app.add_middleware(RateLimitMiddleware, **kwargs)
+    return app
+
+
+def test_parse_route_limits():
+    assert parse_route_limits("") == {}
+    assert parse_route_limits("/api/v1/example=5:10, /ping=0") == {
+        "/api/v1/example": RateLimit(5.0, 10.0),
+        "/ping": RateLimit(0.0, 1.0),
+    }
+    assert parse_route_limits("/api=2") == {"/api": RateLimit(2.0, 2.0)}
+
+
+def test_take_token():
+    limit = RateLimit(rate=2.0, burst=2.0)
+    bucket, retry_after = take_token(None, limit, now=100.0)
+    assert (bucket, retry_after) == ((1.0, 100.0), 0.0)
+    bucket, retry_after = take_token(bucket, limit, now=100.0)
+    assert (bucket, retry_after) == ((0.0, 100.0), 0.0)
+    bucket, retry_after = take_token(bucket, limit, now=100.25)
+    assert bucket == (0.5, 100.25)
+    assert retry_after == pytest.approx(0.25)
+    # the bucket refills at the rate, up to the burst
+    bucket, retry_after = take_token(bucket, limit, now=110.0)
+    assert (bucket, retry_after) == ((1.0, 110.0), 0.0)
+
+
+def test_request_principal():
+    scope = {"client": ("192.168.100.1", 1234)}
+    assert request_principal(scope) == "ip:192.168.100.1"
+    assert request_principal({}) == "anonymous"
+    # a REST API (v1) event with a lambda authorizer
+    scope["aws.event"] = {"requestContext": {"authorizer": {"principalId": "jane"}}}
+    assert request_principal(scope) == "principal:jane"
+    # an HTTP API (v2) event with a JWT authorizer
+    claims = {"sub": "user-id", "username": "janedoe"}
+    scope["aws.event"] = {"requestContext": {"authorizer": {"jwt": {"claims": claims}}}}
+    assert request_principal(scope) == "principal:janedoe"
+    scope["aws.event"] = {"requestContext": {}}
+    assert request_principal(scope) == "ip:192.168.100.1"
+
+
+def test_rate_limit_middleware():
+    client = TestClient(limited_app(rate=1.0, burst=2.0))
+    assert client.get("/api/v1/example").status_code == 200
+    assert client.get("/api/v1/example").status_code == 200
+    response = client.get("/api/v1/example")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+    assert response.json() == {"detail": "Too Many Requests"}
+    # the routes without a route limit share the default bucket
+    assert client.get("/ping").status_code == 429
+
+
+def test_rate_limit_middleware_routes():
+    routes = parse_route_limits("/ping=0,/api=1:1")
+    client = TestClient(limited_app(rate=100.0, burst=100.0, routes=routes))
+    assert all(client.get("/ping").status_code == 200 for _ in range(10))
+    assert client.get("/api/v1/example").status_code == 200
+    assert client.get("/api/v1/example").status_code == 429
+
+
+def test_rate_limit_middleware_principals():
+    def key_func(scope):
+        headers = dict(scope["headers"])
+        return headers.get(b"x-principal", b"").decode()
+
+    client = TestClient(limited_app(rate=1.0, burst=1.0, key_func=key_func))
+    assert client.get("/ping", headers={"X-Principal": "a"}).status_code == 200
+    assert client.get("/ping", headers={"X-Principal": "a"}).status_code == 429
+    assert client.get("/ping", headers={"X-Principal": "b"}).status_code == 200
+
+
+def test_rate_limit_middleware_bounded_buckets():
+    buckets = TTLCache(max_size=2)
+    middleware = RateLimitMiddleware(
+        None, rate=1.0, burst=1.0, buckets=buckets, key_func=lambda s: s["key"]
+    )
+    for key in ["a", "b", "c"]:
+        assert middleware.admit({"key": key, "path": "/ping"}) == 0
+    assert len(buckets) == 2
+    # the bucket of "a" was evicted, so it is full again
+    assert middleware.admit({"key": "a", "path": "/ping"}) == 0
+    assert middleware.admit({"key": "a", "path": "/ping"}) > 0
+
+
+def test_rate_limit_middleware_shared_buckets(tmp_path):
+    path = str(tmp_path / "rate_limit.cache")
+    apps = [
+        limited_app(rate=1.0, burst=2.0, buckets=SharedCache(path, slots=64))
+        for _ in range(2)
+    ]
+    clients = [TestClient(app) for app in apps]
+    # the workers share the bucket of a client
+    assert clients[0].get("/ping").status_code == 200
+    assert clients[1].get("/ping").status_code == 200
+    assert clients[0].get("/ping").status_code == 429
+    assert clients[1].get("/ping").status_code == 429
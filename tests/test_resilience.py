@@ -0,0 +1,219 @@
+import threading
+import time
+from typing import List
+
+import pytest
+import requests
+from botocore.exceptions import ClientError
+from botocore.exceptions import EndpointConnectionError
+
+from example_app import resilience
+from example_app.deadline import DeadlineExceeded
+from example_app.deadline import remaining_time
+from example_app.resilience import CircuitBreaker
+from example_app.resilience import CircuitOpenError
+from example_app.resilience import RetryPolicy
+from example_app.resilience import breaker_stats
+from example_app.resilience import circuit_breaker
+from example_app.resilience import hedged_call
+from example_app.resilience import is_transient
+from example_app.resilience import resilient
+from example_app.resilience import resilient_call
+
+
+class FlakyDependency:
+    """
+    A stub dependency that raises the injected errors, in order, and then
+    returns a value; it can also be slow for the first calls.
+    """
+
+    def __init__(self, *errors: BaseException, value="ok", latency: List = None):
+        self.errors = list(errors)
+        self.value = value
+        self.latency = list(latency or [])
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            error = self.errors.pop(0) if self.errors else None
+            latency = self.latency.pop(0) if self.latency else 0
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return self.value
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def client_error(code: str, status: int) -> ClientError:
+    response = {
+        "Error": {"Code": code, "Message": code},
+        "ResponseMetadata": {"HTTPStatusCode": status},
+    }
+    return ClientError(response, "GetSecretValue")
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    monkeypatch.setattr(resilience, "CIRCUIT_BREAKERS", {})
+    return resilience.CIRCUIT_BREAKERS
+
+
+@pytest.fixture
+def no_backoff(mocker):
+    return mocker.patch.object(RetryPolicy, "delay", return_value=0.0)
+
+
+def test_is_transient():
+    response = requests.Response()
+    response.status_code = 503
+    assert is_transient(requests.HTTPError(response=response))
+    response.status_code = 404
+    assert not is_transient(requests.HTTPError(response=response))
+    assert is_transient(requests.ConnectionError())
+    assert is_transient(requests.Timeout())
+    assert is_transient(client_error("InternalServiceError", 500))
+    assert is_transient(client_error("ThrottlingException", 400))
+    assert not is_transient(client_error("ResourceNotFoundException", 400))
+    assert is_transient(EndpointConnectionError(endpoint_url="https://aws"))
+    assert not is_transient(DeadlineExceeded())
+    assert not is_transient(CircuitOpenError())
+    assert not is_transient(ValueError())
+
+
+def test_retry_policy_full_jitter():
+    policy = RetryPolicy(attempts=5, base_delay=0.1, max_delay=1.0)
+    delays = [[policy.delay(attempt) for _ in range(200)] for attempt in range(6)]
+    for attempt, attempt_delays in enumerate(delays):
+        cap = min(1.0, 0.1 * 2 ** attempt)
+        assert all(0 <= delay <= cap for delay in attempt_delays)
+        # the delays are spread over the whole range
+        assert max(attempt_delays) > cap * 0.8
+        assert min(attempt_delays) < cap * 0.2
+
+
+def test_circuit_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10, clock=clock)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.stats() == ("open", 2, 0, 0, 1)
+    assert not breaker.allow()
+    clock.now += 10
+    # one trial call is allowed when the breaker is half-open
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.stats() == ("closed", 0, 1, 3, 2)
+
+
+def test_circuit_breaker_registry(breakers):
+    breaker = circuit_breaker("jwks")
+    assert circuit_breaker("jwks") is breaker
+    breaker.record_failure()
+    assert breaker_stats() == {"jwks": ("closed", 1, 0, 0, 0)}
+
+
+def test_resilient_call_retries(no_backoff):
+    dependency = FlakyDependency(ConnectionError(), TimeoutError())
+    breaker = CircuitBreaker("test", failure_threshold=5)
+    assert resilient_call(dependency, breaker=breaker, retry=RetryPolicy(3)) == "ok"
+    assert dependency.calls == 3
+    assert no_backoff.call_count == 2
+    assert breaker.stats() == ("closed", 0, 1, 0, 0)
+
+
+def test_resilient_call_retries_exhausted(no_backoff):
+    dependency = FlakyDependency(*[ConnectionError()] * 3)
+    with pytest.raises(ConnectionError):
+        resilient_call(dependency, retry=RetryPolicy(2))
+    assert dependency.calls == 2
+
+
+def test_resilient_call_not_transient(no_backoff):
+    dependency = FlakyDependency(ValueError())
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    with pytest.raises(ValueError):
+        resilient_call(dependency, breaker=breaker)
+    assert dependency.calls == 1
+    assert breaker.state == "closed"
+
+
+def test_resilient_call_open_circuit(no_backoff):
+    dependency = FlakyDependency(*[ConnectionError()] * 10)
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    with pytest.raises(ConnectionError):
+        resilient_call(dependency, breaker=breaker, retry=RetryPolicy(3))
+    # there is no retry after the breaker opens
+    assert dependency.calls == 2
+    # the open breaker fails fast, without a call to the dependency
+    with pytest.raises(CircuitOpenError):
+        resilient_call(dependency, breaker=breaker, retry=RetryPolicy(3))
+    assert dependency.calls == 2
+    assert breaker.stats().rejections == 1
+
+
+def test_resilient_call_deadline(request_deadline):
+    dependency = FlakyDependency(ConnectionError())
+    request_deadline(0.001)
+    policy = RetryPolicy(attempts=3, base_delay=10.0, max_delay=10.0)
+    with pytest.raises(ConnectionError):
+        resilient_call(dependency, retry=policy)
+    # the backoff would pass the deadline, so there is no retry
+    assert dependency.calls == 1
+
+
+def test_hedged_call():
+    # the first attempt is slow, so the hedged attempt is the result
+    dependency = FlakyDependency(latency=[1.0])
+    started = time.monotonic()
+    assert hedged_call(dependency, delay=0.05) == "ok"
+    assert time.monotonic() - started < 0.5
+    assert dependency.calls == 2
+
+
+def test_hedged_call_fast():
+    dependency = FlakyDependency()
+    assert hedged_call(dependency, delay=1.0) == "ok"
+    assert dependency.calls == 1
+
+
+def test_hedged_call_errors():
+    dependency = FlakyDependency(ConnectionError(), ConnectionError(), latency=[0.2])
+    with pytest.raises(ConnectionError):
+        hedged_call(dependency, delay=0.05)
+    assert dependency.calls == 2
+
+
+def test_hedged_call_context(request_deadline):
+    request_deadline(5.0)
+    assert 4.9 < hedged_call(remaining_time, delay=1.0) <= 5.0
+
+
+def test_resilient_decorator(breakers, no_backoff):
+    dependency = FlakyDependency(ConnectionError(), value={"keys": []})
+
+    @resilient("stub", hedge_delay=1.0)
+    def fetch(uri: str):
+        return dependency()
+
+    assert fetch("https://stub") == {"keys": []}
+    assert fetch.__name__ == "fetch"
+    assert fetch.breaker is breakers["stub"]
+    assert fetch.breaker.stats() == ("closed", 0, 1, 0, 0)
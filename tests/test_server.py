@@ -0,0 +1,104 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from example_app import server
+from example_app.server import cpu_quota
+from example_app.server import worker_count
+
+
+@pytest.fixture
+def cgroup_files(tmp_path):
+    def write(name, text):
+        path = tmp_path / name
+        path.write_text(text)
+        return str(path)
+
+    return write
+
+
+def test_cpu_quota_v2(cgroup_files, tmp_path):
+    missing = str(tmp_path / "missing")
+    assert cpu_quota(cgroup_files("cpu.max", "150000 100000\n"), missing) == 1.5
+    assert cpu_quota(cgroup_files("cpu.max", "max 100000\n"), missing) is None
+
+
+def test_cpu_quota_v1(cgroup_files, tmp_path):
+    missing = str(tmp_path / "missing")
+    quota = cgroup_files("cpu.cfs_quota_us", "200000\n")
+    period = cgroup_files("cpu.cfs_period_us", "100000\n")
+    assert cpu_quota(missing, quota, period) == 2.0
+    no_quota = cgroup_files("no_quota", "-1\n")
+    assert cpu_quota(missing, no_quota, period) is None
+    assert cpu_quota(missing, missing, missing) is None
+
+
+def test_worker_count(monkeypatch):
+    monkeypatch.setattr(server, "available_cpus", lambda: 8)
+    monkeypatch.setattr(server, "cpu_quota", lambda: None)
+    assert worker_count(3) == 3
+    assert worker_count(0) == 8
+    monkeypatch.setattr(server, "cpu_quota", lambda: 2.5)
+    assert worker_count(0) == 3
+    monkeypatch.setattr(server, "cpu_quota", lambda: 0.25)
+    assert worker_count(0) == 1
+
+
+def test_event_loop_and_http_protocol():
+    assert server.event_loop() in ["uvloop", "asyncio"]
+    assert server.http_protocol() in ["httptools", "h11"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_ping(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            url = f"http://127.0.0.1:{port}/ping"
+            with urllib.request.urlopen(url, timeout=1) as response:
+                return json.loads(response.read())
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def test_server_restart_and_stop():
+    port = free_port()
+    env = dict(os.environ, APP_SERVER_GRACEFUL_TIMEOUT="5")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "example_app.server"]
+        + ["--host", "127.0.0.1", "--port", str(port), "--workers", "2"],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    try:
+        assert get_ping(port)["ping"] == "pong!"
+        proc.send_signal(signal.SIGHUP)
+        time.sleep(0.5)
+        assert get_ping(port)["ping"] == "pong!"
+        proc.send_signal(signal.SIGTERM)
+        output, _ = proc.communicate(timeout=15)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    assert proc.returncode == 0
+    log = output.decode()
+    assert "Restarting the workers" in log
+    # 2 workers, and 2 more after the restart
+    assert log.count("Started worker") == 4
+    assert log.count("exited with status") == 4
@@ -0,0 +1,181 @@
+import datetime
+import multiprocessing
+import os
+from decimal import Decimal
+
+import pytest
+
+from example_app.cache import TTLCache
+from example_app.cache import create_cache
+from example_app.shared_cache import SharedCache
+
+
+@pytest.fixture
+def cache_path(tmp_path) -> str:
+    return str(tmp_path / "test.cache")
+
+
+@pytest.fixture
+def cache(cache_path) -> SharedCache:
+    shared_cache = SharedCache(cache_path, slots=64, slot_size=512, ttl=60)
+    yield shared_cache
+    shared_cache.close()
+
+
+def test_shared_cache_get_put(cache):
+    assert cache.get("a") is None
+    assert cache.get("a", "default") == "default"
+    assert cache.put("a", {"value": 1})
+    assert cache.get("a") == {"value": 1}
+    assert cache.put(("items", 1), [1, "one"])
+    assert cache.get(("items", 1)) == [1, "one"]
+    assert cache.put("a", 2)
+    assert cache.get("a") == 2
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (3, 2, 2)
+    cache.reset_stats()
+    assert cache.stats() == (0, 0, 0, 2)
+
+
+def test_shared_cache_expiry(cache, mocker):
+    clock = mocker.patch("example_app.shared_cache.time.time", return_value=100.0)
+    cache.put("a", 1, ttl=10)
+    cache.put("b", 2, ttl=30)
+    clock.return_value = 115.0
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert len(cache) == 1
+
+
+def test_shared_cache_lru_eviction(cache_path, mocker):
+    clock = mocker.patch("example_app.shared_cache.time.time", return_value=100.0)
+    cache = SharedCache(cache_path, slots=2, slot_size=256, ways=2)
+    cache.put("a", 1)
+    clock.return_value = 101.0
+    cache.put("b", 2)
+    clock.return_value = 102.0
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    clock.return_value = 103.0
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats().evictions == 1
+    cache.close()
+
+
+def test_shared_cache_value_too_large(cache):
+    assert not cache.put("a", "x" * 1024)
+    assert cache.get("a") is None
+
+
+def test_shared_cache_invalidate(cache):
+    for key in [("items", 1), ("items", 2), ("users", 1)]:
+        cache.put(key, key)
+    cache.invalidate(("items", 1))
+    assert cache.get(("items", 1)) is None
+    cache.invalidate(lambda key: key[0] == "items")
+    assert cache.get(("items", 2)) is None
+    assert cache.get(("users", 1)) == ["users", 1]  # a JSON value
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_shared_cache_json_values(cache):
+    assert cache.put(("items", 1), {"id": 1, "tags": ("a", "b")})
+    assert cache.get(("items", 1)) == {"id": 1, "tags": ["a", "b"]}
+    # the keys and values that are not JSON are not cached
+    assert not cache.put("a", Decimal("1.5"))
+    assert not cache.put(("day", datetime.date(2020, 1, 1)), 1)
+    assert cache.get("a") is None
+    assert cache.get(("day", datetime.date(2020, 1, 1))) is None
+    cache.invalidate(("day", datetime.date(2020, 1, 1)))
+    assert cache.update("b", lambda value: (object(), "result")) == "result"
+    assert cache.get("b") is None
+
+
+def test_shared_cache_private_directory(tmp_path):
+    directory = tmp_path / "shm"
+    cache = SharedCache(str(directory / "test.cache"), slots=8)
+    cache.close()
+    assert directory.stat().st_mode & 0o777 == 0o700
+    assert (directory / "test.cache").stat().st_mode & 0o777 == 0o600
+    directory.chmod(0o755)
+    with pytest.raises(PermissionError):
+        SharedCache(str(directory / "test.cache"), slots=8)
+    directory.chmod(0o700)
+    os.symlink(directory, tmp_path / "link")
+    with pytest.raises(PermissionError):
+        SharedCache(str(tmp_path / "link" / "test.cache"), slots=8)
+
+
+def test_shared_cache_private_file(tmp_path):
+    path = tmp_path / "test.cache"
+    path.touch(mode=0o644)
+    with pytest.raises(PermissionError):
+        SharedCache(str(path), slots=8)
+    path.unlink()
+    os.symlink(tmp_path / "target.cache", path)
+    with pytest.raises(OSError):  # the file is not opened with a symlink
+        SharedCache(str(path), slots=8)
+    assert not (tmp_path / "target.cache").exists()
+
+
+def test_shared_cache_update(cache):
+    def increment(value):
+        value = (value or 0) + 1
+        return value, value * 10
+
+    assert cache.update("counter", increment) == 10
+    assert cache.update("counter", increment) == 20
+    assert cache.get("counter") == 2
+    assert cache.update("counter", increment, ttl=-1) == 30
+    # an expired value is None for the update
+    assert cache.update("counter", increment) == 10
+
+
+def test_shared_cache_reopen(cache_path):
+    cache = SharedCache(cache_path, slots=64, slot_size=512)
+    cache.put("a", 1)
+    cache.close()
+    cache = SharedCache(cache_path, slots=64, slot_size=512)
+    assert cache.get("a") == 1
+    cache.close()
+    # a different layout re-initializes the file
+    cache = SharedCache(cache_path, slots=32, slot_size=512)
+    assert cache.get("a") is None
+    cache.close()
+
+
+def put_values(path: str, start: int, count: int):
+    cache = SharedCache(path, slots=64, slot_size=512)
+    for i in range(start, start + count):
+        cache.put(("key", i), i)
+    cache.close()
+
+
+def test_shared_cache_processes(cache):
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=put_values, args=(cache.path, i * 10, 10))
+        for i in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    values = [cache.get(("key", i)) for i in range(40)]
+    # the keys of a set can evict each other, but most values are shared
+    assert sum(value == i for i, value in enumerate(values)) >= 32
+    assert all(value in [i, None] for i, value in enumerate(values))
+
+
+def test_create_cache(tmp_path):
+    assert isinstance(create_cache("test", max_size=8), TTLCache)
+    cache = create_cache("test", max_size=8, shared_dir=str(tmp_path / "shm"))
+    assert isinstance(cache, SharedCache)
+    assert cache.path == str(tmp_path / "shm" / "test.cache")
+    assert cache.max_size == 8
+    assert (tmp_path / "shm").stat().st_mode & 0o777 == 0o700
+    cache.close()